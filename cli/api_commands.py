@@ -82,6 +82,7 @@ from spynl.api.retail.receiving import ReceivingGetSchema
 from spynl.api.retail.retail_transactions import TransactionGetSchema
 from spynl.api.retail.sales import (
     ConsignmentGetSchema,
+    SaleAddBatchSchema,
     SaleCancelSchema,
     SaleGetSchema,
     WithdrawalGetSchema,
@@ -286,6 +287,7 @@ def shared_schemas(folder):
 
     # cancel parameters for sale:
     dump_schema_to_file(SaleCancel, 'sale_cancel_parameters', folder)
+    dump_schema_to_file(SaleAddBatchSchema, 'sale_add_batch_parameters', folder)
 
     # schemas for customer/sales (barcodes per customer):
     dump_schema_to_file(CustomerSalesSchema, 'sales_per_barcode', folder)
@@ -4,12 +4,16 @@ import shutil
 
 import click
 from marshmallow_jsonschema import JSONSchema
+from pyramid.paster import bootstrap
 
 from cli.api_commands import dump_file, folder_option
 from cli.cli import cli
-from cli.utils import fail, run_command
+from cli.utils import check_ini, fail, run_command
 
 import spynl.services.pdf
+from spynl.services.jobs.queue import work
+from spynl.services.mail import outbox
+from spynl.services.pdf.batch import PackingListBatchSchema, SalesReceiptBatchSchema
 from spynl.services.pdf.endpoints import (
     DownloadOrderSchema,
     EmailOrderSchema,
@@ -20,6 +24,7 @@ from spynl.services.pdf.endpoints import (
 )
 from spynl.services.reports.article_status import (
     ArticleStatusEmailQuery,
+    ArticleStatusExportQuery,
     ArticleStatusFilterQuery,
     ArticleStatusQuery,
 )
@@ -74,6 +79,52 @@ def install_gi(folder):
     click.echo('Installed gi successfully to %s' % site_packages)
 
 
+@services.command()
+@click.option(
+    '-i',
+    '--ini',
+    help='Specify an ini file to use.',
+    type=click.Path(exists=True),
+    callback=check_ini,
+)
+@click.option('--burst', is_flag=True, help='Stop when there are no jobs left.')
+@click.option(
+    '--poll-interval',
+    default=2.0,
+    help='Seconds to wait before looking for new jobs again.',
+)
+def worker(ini, burst, poll_interval):
+    """Run the jobs of the job queue (report emails and exports)."""
+    env = bootstrap(ini)
+    try:
+        work(env['registry'], poll_interval=poll_interval, burst=burst)
+    finally:
+        env['closer']()
+
+
+@services.command(name='mail-worker')
+@click.option(
+    '-i',
+    '--ini',
+    help='Specify an ini file to use.',
+    type=click.Path(exists=True),
+    callback=check_ini,
+)
+@click.option('--burst', is_flag=True, help='Stop when there is no mail left.')
+@click.option(
+    '--poll-interval',
+    default=2.0,
+    help='Seconds to wait before looking for new mail again.',
+)
+def mail_worker(ini, burst, poll_interval):
+    """Send the mail of the mail outbox."""
+    env = bootstrap(ini)
+    try:
+        outbox.work(env['registry'], poll_interval=poll_interval, burst=burst)
+    finally:
+        env['closer']()
+
+
 @folder_option
 @services.command()
 def generate_json_schemas(folder=None):
@@ -84,6 +135,8 @@ def generate_json_schemas(folder=None):
     dump_file('article_status', schema, folder)
     schema = JSONSchema().dump(ArticleStatusEmailQuery())
     dump_file('article_status_email', schema, folder)
+    schema = JSONSchema().dump(ArticleStatusExportQuery())
+    dump_file('article_status_export', schema, folder)
     # retail customer
     schema = JSONSchema().dump(RetailCustomerFilterQuery())
     dump_file('retail_customer_sales_filter', schema, folder)
@@ -106,6 +159,10 @@ def generate_json_schemas(folder=None):
     dump_file('email_sales_receipt', schema, folder)
     schema = JSONSchema().dump(SalesReceiptDownloadSchema())
     dump_file('download_sales_receipt', schema, folder)
+    schema = JSONSchema().dump(SalesReceiptBatchSchema())
+    dump_file('download_receipts_batch', schema, folder)
+    schema = JSONSchema().dump(PackingListBatchSchema())
+    dump_file('download_packing_lists_batch', schema, folder)
     schema = JSONSchema().dump(EmailOrderSchema())
     dump_file('email_sales_order_receipt', schema, folder)
     schema = JSONSchema().dump(DownloadOrderSchema())
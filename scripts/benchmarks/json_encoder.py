@@ -0,0 +1,110 @@
+"""
+Compare the json encoding of a report of 50000 rows with the encoder that looks
+up the encode functions and the time zone of the user for every object (how it
+was done before), and the encoder that is made once at config commit.
+
+The request has a user_info_function that copies the user, like the one of
+spynl.api.auth does.
+
+Usage: python scripts/benchmarks/json_encoder.py [rows]
+"""
+
+import copy
+import datetime
+import json
+import sys
+import timeit
+from decimal import Decimal
+
+from bson import ObjectId
+from pyramid import testing
+
+from spynl.main import serial
+from spynl.main.dateutils import user_timezone
+from spynl.main.serial import json as spynl_json
+from spynl.main.serial.objects import add_encode_function
+from spynl.main.utils import get_settings
+
+
+def legacy_dumps(body):
+    """The encoder as it was: settings are read for every object."""
+
+    def encode(obj):
+        encode_functions = get_settings().get('serial_encode_functions', {})
+        for obj_type in encode_functions:
+            if isinstance(obj, obj_type):
+                obj = encode_functions[obj_type](obj)
+        return str(obj)
+
+    class JSONEncoder(json.JSONEncoder):
+        def default(self, obj):
+            if isinstance(obj, Decimal):
+                return float(obj)
+            if isinstance(obj, set):
+                return list(obj)
+            return encode(obj)
+
+    return json.dumps(body, ensure_ascii=False, cls=JSONEncoder)
+
+
+def chunked_dumps(body):
+    """As the renderer writes large responses."""
+    with user_timezone():
+        return list(spynl_json.iterdumps(body))
+
+
+def report(rows):
+    date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    return {
+        'data': [
+            {
+                '_id': ObjectId(),
+                'date': date + datetime.timedelta(minutes=i),
+                'modified': date,
+                'article': 'article {}'.format(i),
+                'qty': i % 7,
+                'price': Decimal('19.95'),
+                'value': Decimal(i) / 3,
+                'active': bool(i % 2),
+            }
+            for i in range(rows)
+        ],
+        'totals': {'qty': rows, 'value': Decimal(rows)},
+        'status': 'ok',
+    }
+
+
+def main(rows=50000, number=3):
+    user = {'_id': ObjectId(), 'username': 'user', 'tz': 'Europe/Amsterdam'}
+    user.update({'setting{}'.format(i): {'value': i} for i in range(50)})
+    config = testing.setUp(
+        request=testing.DummyRequest(),
+        settings={'user_info_function': lambda request, purpose: copy.deepcopy(user)},
+    )
+    serial.main(config)
+    add_encode_function(config, str, ObjectId)
+
+    class Event:
+        pass
+
+    event = Event()
+    event.config = config
+    serial.compile_encoders(event)
+
+    body = report(rows)
+    assert legacy_dumps(body) == spynl_json.dumps(body)
+    assert b''.join(chunked_dumps(body)).decode() == spynl_json.dumps(body)
+
+    for name, dumps in [
+        ('legacy', legacy_dumps),
+        ('compiled', spynl_json.dumps),
+        ('compiled, chunked', chunked_dumps),
+    ]:
+        seconds = min(timeit.repeat(lambda: dumps(body), number=1, repeat=number))
+        print('{:<20}{:8.1f} ms'.format(name, seconds * 1000))
+
+    testing.tearDown()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
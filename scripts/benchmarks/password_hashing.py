@@ -0,0 +1,59 @@
+"""
+Compare the CPU a login costs for every password hash type, and how long it takes
+to check the passwords of logins that come in at the same time in threads (the
+pure python pbkdf2 of hash type 2 holds the GIL, hashlib releases it).
+
+Usage: python scripts/benchmarks/password_hashing.py [logins] [threads]
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from spynl.api.auth.authentication import (
+    PBKDF2_ITERATIONS,
+    challenge_password,
+    salt_generator,
+    scramble_password,
+)
+
+HASH_TYPES = [
+    ('1 (md5)', '1'),
+    ('2 (pbkdf2, python)', '2'),
+    ('3 (sha512)', '3'),
+    ('4 (pbkdf2, hashlib)', '4'),
+]
+
+
+def main(logins=50, threads=8):
+    password = 'correct horse battery staple'
+    salt = salt_generator()
+    concurrent = '{} logins, {} threads'.format(logins, threads)
+    print('{:<24}{:>16}{:>24}'.format('hash type', 'cpu per login', concurrent))
+    for name, hash_type in HASH_TYPES:
+        scrambled = scramble_password(password, salt, hash_type)
+
+        def login():
+            assert challenge_password(password, scrambled, salt, hash_type)
+
+        start = time.process_time()
+        for _ in range(logins):
+            login()
+        cpu = (time.process_time() - start) / logins
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as executor:
+            for _ in range(logins):
+                executor.submit(login)
+        wall = time.perf_counter() - start
+
+        print('{:<24}{:13.2f} ms{:21.1f} ms'.format(name, cpu * 1000, wall * 1000))
+    print(
+        'hash type 2 uses 400 iterations of sha1, hash type 4 {} of sha256'.format(
+            PBKDF2_ITERATIONS
+        )
+    )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:3]))
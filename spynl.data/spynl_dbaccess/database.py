@@ -13,22 +13,32 @@ db.users.pymongo_find_one would use the original find_one. Whereas
 db.users.find_one would use our version.
 """
 
+import copy
 import datetime
+import logging
 import re
+import threading
+import time
+from collections import OrderedDict
 
 import pkg_resources
+from bson import ObjectId
 from bson.codec_options import CodecOptions
-from pymongo import MongoClient
+from pymongo import InsertOne, MongoClient, ReturnDocument, UpdateOne
 from pymongo.collection import Collection
-from pymongo.errors import PyMongoError
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from pymongo.read_preferences import ReadPreference
 
 __all__ = [
     'CollectionWrapper',
+    'Counters',
     'Database',
+    'DocumentCache',
     'DocumentNotFound',
     'ForbiddenOperators',
+    'IndexCache',
     'UnindexedQuery',
+    'UnitOfWork',
 ]
 
 
@@ -54,6 +64,11 @@ MAX_TIME_MS = 60 * 2 * 1000  # 2 minutes
 VERSION = pkg_resources.get_distribution('spynl.data').version
 # The max number of items is CAP+1, because it retains max cap and then adds the newest.
 MODIFIED_HISTORY_CAP = 200
+INDEX_CACHE_TTL = 5 * 60  # 5 minutes
+DOCUMENT_CACHE_COLLECTIONS = ('tenants', 'users')
+DOCUMENT_CACHE_TTL = 60
+DOCUMENT_CACHE_WATCH_RETRY = 5  # seconds
+COUNTERS_COLLECTION = 'counters'
 
 
 class DocumentNotFound(PyMongoError):
@@ -72,6 +87,336 @@ class ForbiddenOperation(PyMongoError):
     """Raised when a query contains forbidden operators."""
 
 
+class IndexCache:
+    """
+    Process-wide cache of the indexed first keys of collections.
+
+    Large collections are checked for unindexed queries before every find, so
+    instead of asking the server for the index information each time we keep
+    the set of first keys per collection for `ttl` seconds. Entries are keyed
+    by the full name of the collection (database.collection).
+    """
+
+    def __init__(self, ttl=INDEX_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def first_keys(self, collection):
+        """Return a frozenset of the first key of each index of the collection."""
+        key = collection.full_name
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        indexes = collection.index_information().values()
+        first_keys = frozenset(idx['key'][0][0] for idx in indexes)
+        #                              │  └─ The field name.
+        #                              └─ The first of the fields in the index.
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, first_keys)
+        return first_keys
+
+    def invalidate(self, full_name=None):
+        """
+        Drop the cached entry for a collection, or all entries within a
+        database if the name ends with a dot, or everything if no name is given.
+        """
+        with self._lock:
+            if full_name is None:
+                self._entries.clear()
+            elif full_name.endswith('.'):
+                for key in [k for k in self._entries if k.startswith(full_name)]:
+                    del self._entries[key]
+            else:
+                self._entries.pop(full_name, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# shared by all Database instances in this process.
+INDEX_CACHE = IndexCache()
+
+
+class DocumentCache:
+    """
+    Process-wide LRU cache with a TTL for documents that are read on almost every
+    request and rarely change, like tenants and users.
+
+    Documents are cached by the full name of their collection and their _id, and
+    only for the collections in `collections`. Writes through CollectionWrapper
+    invalidate the cache, writes through pymongo directly should call
+    `invalidate` themselves. To keep multiple processes coherent, `watch` starts a
+    thread that invalidates documents that are changed anywhere else (this
+    requires a replica set). While that change stream is not running nothing is
+    cached, because changes made by other processes would go unnoticed.
+
+    A maxsize of 0 disables the cache.
+    """
+
+    log = logging.getLogger(__name__)
+
+    def __init__(
+        self, maxsize=0, ttl=DOCUMENT_CACHE_TTL, collections=DOCUMENT_CACHE_COLLECTIONS
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.collections = frozenset(collections)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._paused = False
+        # bumped on every invalidation, so a document that was read before a
+        # concurrent write is not put in the cache after that write.
+        self._generation = 0
+
+    def caches(self, collection):
+        return (
+            self.maxsize > 0
+            and not self._paused
+            and collection.name in self.collections
+        )
+
+    def find_one(self, collection, id):
+        """
+        Return a copy of the document with this _id, or None if it does not exist.
+        Missing documents are not cached.
+        """
+        if not self.caches(collection):
+            return collection.find_one({'_id': id})
+
+        key = (collection.full_name, id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            generation = self._generation
+
+        document = collection.find_one({'_id': id})
+        if document is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, document)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return copy.deepcopy(document)
+
+    def invalidate(self, full_name=None, id=None):
+        """
+        Drop a single document, all documents of a collection if no id is given,
+        or everything if no collection is given.
+        """
+        with self._lock:
+            self._generation += 1
+            if full_name is None:
+                self._entries.clear()
+            elif id is not None:
+                self._entries.pop((full_name, id), None)
+            else:
+                for key in [k for k in self._entries if k[0] == full_name]:
+                    del self._entries[key]
+
+    def invalidate_for_filter(self, collection, filter):
+        """Invalidate the documents that a write with this filter can change."""
+        if not self.caches(collection):
+            return
+        id = (filter or {}).get('_id')
+        if id is None or isinstance(id, dict):
+            self.invalidate(collection.full_name)
+        else:
+            self.invalidate(collection.full_name, id)
+
+    def watch(self, database):
+        """
+        Invalidate documents changed by other processes, by following a change
+        stream on the cached collections of the (pymongo) database in a daemon
+        thread.
+        """
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def follow():
+            while True:
+                self._follow(database)
+                time.sleep(DOCUMENT_CACHE_WATCH_RETRY)
+
+        # nothing is cached until the change stream is opened.
+        self._paused = True
+        self._watcher = threading.Thread(
+            target=follow, name='document-cache-watcher', daemon=True
+        )
+        self._watcher.start()
+
+    def _follow(self, database):
+        """Invalidate changed documents until the change stream ends or fails."""
+        pipeline = [{'$match': {'ns.coll': {'$in': list(self.collections)}}}]
+        try:
+            with database.watch(pipeline) as stream:
+                self._paused = False
+                for change in stream:
+                    ns = change.get('ns', {})
+                    if 'documentKey' not in change or 'coll' not in ns:
+                        # a drop or rename, forget everything.
+                        self.invalidate()
+                        continue
+                    self.invalidate(
+                        '{db}.{coll}'.format(**ns), change['documentKey']['_id']
+                    )
+        except PyMongoError:
+            self.log.exception('Document cache change stream failed.')
+        finally:
+            # stop caching until the stream is back, anything could change in the
+            # meantime.
+            self._paused = True
+            self.invalidate()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# shared by all Database instances in this process.
+DOCUMENT_CACHE = DocumentCache()
+
+
+class Counters:
+    """
+    Atomic counters, for receipt numbers and incremental ids.
+
+    Every counter is a document in the counters collection, per tenant and name,
+    that is incremented with find_one_and_update, so concurrent requests never get
+    the same number and getting one is a single round trip. A counter that does
+    not exist yet starts at `seed` (the last number that was used, or a callable
+    that returns it), so existing data can be taken over.
+
+    With a block_size larger than 1 a process takes block_size numbers at once
+    and hands them out itself. That saves round trips, but numbers are not given
+    out in order across processes, and numbers left in a block when the process
+    stops are never used.
+    """
+
+    def __init__(self, block_size=1):
+        self.block_size = block_size
+        # (database name, counter _id) -> [next number, last number]
+        self._blocks = {}
+        # (database name, counter _id) -> highest number passed to skip_to
+        self._skipped = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def counter_id(tenant_id, name):
+        """A counter with tenant_id None is shared by all tenants."""
+        return name if tenant_id is None else '{}:{}'.format(tenant_id, name)
+
+    def next(self, db, tenant_id, name, seed=0):
+        """Return the next number of the counter."""
+        db = self._pymongo_db(db)
+        if self.block_size <= 1:
+            return self._allocate(db, tenant_id, name, 1, seed)
+
+        key = (db.name, self.counter_id(tenant_id, name))
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None or block[0] > block[1]:
+                last = self._allocate(db, tenant_id, name, self.block_size, seed)
+                block = self._blocks[key] = [last - self.block_size + 1, last]
+            number = block[0]
+            block[0] += 1
+            return number
+
+    def reserve(self, db, tenant_id, name, amount, seed=0):
+        """
+        Return a range of amount numbers of the counter, for when many numbers are
+        needed at once. The numbers are taken from the database, not from the
+        block of this process.
+        """
+        if amount < 1:
+            return range(0)
+        last = self._allocate(self._pymongo_db(db), tenant_id, name, amount, seed)
+        return range(last - amount + 1, last + 1)
+
+    def skip_to(self, db, tenant_id, name, number):
+        """
+        Make sure the next number is higher than number, for when numbers were
+        used that did not come from the counter. The process remembers the
+        highest number it moved a counter to, lower numbers cost no write.
+        """
+        db = self._pymongo_db(db)
+        counter_id = self.counter_id(tenant_id, name)
+        key = (db.name, counter_id)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None and block[0] <= number:
+                block[0] = number + 1
+            if number <= self._skipped.get(key, 0):
+                # the counter was moved past number already, save the write.
+                return
+        result = db[COUNTERS_COLLECTION].update_one(
+            {'_id': counter_id}, {'$max': {'value': number}}
+        )
+        if result.matched_count:
+            with self._lock:
+                self._skipped[key] = max(number, self._skipped.get(key, 0))
+
+    def clear(self):
+        """Forget the blocks of this process and the numbers it skipped to."""
+        with self._lock:
+            self._blocks.clear()
+            self._skipped.clear()
+
+    def _allocate(self, db, tenant_id, name, amount, seed):
+        """Increment the counter by amount and return its new value."""
+        collection = db[COUNTERS_COLLECTION]
+        counter_id = self.counter_id(tenant_id, name)
+        counter = collection.find_one_and_update(
+            {'_id': counter_id},
+            {'$inc': {'value': amount}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if counter is not None:
+            return counter['value']
+
+        start = seed() if callable(seed) else seed
+        try:
+            # $max in case another process made the counter and used it already.
+            collection.update_one(
+                {'_id': counter_id},
+                {
+                    '$max': {'value': start},
+                    '$setOnInsert': {'tenant_id': tenant_id, 'name': name},
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # another process made the counter at the same time.
+            pass
+        counter = collection.find_one_and_update(
+            {'_id': counter_id},
+            {'$inc': {'value': amount}},
+            return_document=ReturnDocument.AFTER,
+        )
+        return counter['value']
+
+    @staticmethod
+    def _pymongo_db(db):
+        return db.pymongo_db if isinstance(db, Database) else db
+
+
+# shared by all Database instances in this process.
+COUNTERS = Counters()
+
+
 def default_database_callback(d, *args, **kwargs):
     return d
 
@@ -132,6 +477,10 @@ class Database:
         self._max_limit = kwargs.pop('max_limit', MAX_LIMIT)
         self._max_agg_limit = kwargs.pop('max_agg_limit', MAX_AGG_LIMIT)
         self._max_time_ms = kwargs.pop('max_time_ms', MAX_TIME_MS)
+        # the process-wide caches are configured by the application, pass your own
+        # instances to use different settings.
+        self.index_cache = kwargs.pop('index_cache', INDEX_CACHE)
+        self.document_cache = kwargs.pop('document_cache', DOCUMENT_CACHE)
         self.reset_callbacks()
 
         client_kwargs = {'ssl': ssl}
@@ -198,6 +547,32 @@ class Database:
         collection = self.pymongo_db.get_collection(collection_name)
         return CollectionWrapper(collection, self, large)
 
+    def invalidate_index_cache(self, collection_name=None):
+        """
+        Forget the cached indexes of a collection, or of all collections of
+        this database. Use this after creating or dropping indexes.
+        """
+        self.index_cache.invalidate(
+            '{}.{}'.format(self._db.name, collection_name or '')
+        )
+
+    def invalidate_document_cache(self, collection_name=None, id=None):
+        """
+        Forget a cached document, all cached documents of a collection, or all
+        cached documents. Use this after writing to a cached collection directly
+        through pymongo.
+        """
+        if collection_name is None:
+            self.document_cache.invalidate()
+        else:
+            self.document_cache.invalidate(
+                '{}.{}'.format(self._db.name, collection_name), id
+            )
+
+    def unit_of_work(self, transaction=False):
+        """Return a UnitOfWork that writes with the callbacks of this database."""
+        return UnitOfWork(self, transaction=transaction)
+
     @property
     def pymongo_db(self):
         """Return the pymongo database object. For direct operations."""
@@ -288,10 +663,7 @@ class CollectionWrapper:
         # if this is registered as a large collection
         if validate_indexes and self._large:
             filter_keys = CollectionWrapper._get_filter_keys(filter)
-            indexes = self._secondary.index_information().values()
-            indexed_keys = [idx['key'][0][0] for idx in indexes]
-            #                          │  └─ The field name.
-            #                          └─ The first of the fields in the index.
+            indexed_keys = self._db.index_cache.first_keys(self._secondary)
             if (
                 indexed_keys
                 and filter
@@ -311,6 +683,14 @@ class CollectionWrapper:
             raise DocumentNotFound
         return document
 
+    def get_cached(self, id):
+        """
+        Return the document with this _id from the document cache of the
+        database, or None if it does not exist. Like get, this does not use the
+        find callback.
+        """
+        return self._db.document_cache.find_one(self._collection, id)
+
     def find_one(self, filter=None, *args, **kwargs):
         if not kwargs:
             kwargs = {}
@@ -353,12 +733,16 @@ class CollectionWrapper:
     def delete_one(self, filter=None, *args, **kwargs):
         self._validate_filter(filter, validate_indexes=False)
         filter = self._db.find_callback(filter, self)
-        return self.pymongo_delete_one(filter, *args, **kwargs)
+        result = self.pymongo_delete_one(filter, *args, **kwargs)
+        self._db.document_cache.invalidate_for_filter(self._collection, filter)
+        return result
 
     def delete_many(self, filter, *args, **kwargs):
         self._validate_filter(filter, validate_indexes=False)
         filter = self._db.find_callback(filter, self)
-        return self.pymongo_delete_many(filter, *args, **kwargs)
+        result = self.pymongo_delete_many(filter, *args, **kwargs)
+        self._db.document_cache.invalidate_for_filter(self._collection, filter)
+        return result
 
     def insert_one(self, data, *args, user=None, action=None, **kwargs):
         data = self._db.save_callback(data, self)
@@ -383,7 +767,9 @@ class CollectionWrapper:
             update.get('$set', {}), self, update_filter=filter, user=user, action=action
         )
 
-        return self.pymongo_update_one(filter, update, *args, **kwargs)
+        result = self.pymongo_update_one(filter, update, *args, **kwargs)
+        self._db.document_cache.invalidate_for_filter(self._collection, filter)
+        return result
 
     def update_many(self, filter, update, *args, user=None, action=None, **kwargs):
         self._validate_filter(filter, validate_indexes=False)
@@ -397,7 +783,9 @@ class CollectionWrapper:
             update.get('$set', {}), self, update_filter=filter, user=user, action=action
         )
 
-        return self.pymongo_update_many(filter, update, *args, **kwargs)
+        result = self.pymongo_update_many(filter, update, *args, **kwargs)
+        self._db.document_cache.invalidate_for_filter(self._collection, filter)
+        return result
 
     def aggregate(self, pipeline, *args, **kwargs):
         if not kwargs:
@@ -455,4 +843,110 @@ class CollectionWrapper:
         replacement = self._db.timestamp_callback(
             replacement, self, update_filter=filter, user=user, action=action
         )
-        return self.pymongo_replace_one(filter, replacement, upsert=True, **kwargs)
+        result = self.pymongo_replace_one(filter, replacement, upsert=True, **kwargs)
+        self._db.document_cache.invalidate_for_filter(self._collection, filter)
+        return result
+
+
+class UnitOfWork:
+    """Collects writes to several collections and commits them together.
+
+    Writes get the callbacks of the database (tenant and timestamps) when they
+    are added, and are written by commit:
+
+    * with transaction, in one multi-document transaction, so either all or none
+      of the writes are done (this needs a replica set).
+    * without, as an ordered bulk write per collection, in the order the
+      collections were first written to. Write the main document first: if it
+      cannot be written, nothing else is.
+
+    All writes of a unit get the same timestamp. Updates add it to
+    modified_history in the update itself, instead of reading the document first
+    like CollectionWrapper.update_one does, and leave created as it is.
+    """
+
+    def __init__(self, db, transaction=False):
+        self._db = db
+        self.transaction = transaction
+        # collection name -> [(operation, filter of an update)]
+        self._operations = OrderedDict()
+        self._timestamp = None
+
+    def _wrapper(self, collection):
+        """collection is a name or a resource, see Database.__getitem__."""
+        name = getattr(collection, 'collection', collection)
+        return CollectionWrapper(self._db.pymongo_db.get_collection(name), self._db)
+
+    def _stamp(self, wrapper):
+        if self._timestamp is None:
+            self._timestamp = self._db.timestamp_callback({}, wrapper)
+        return copy.deepcopy(self._timestamp)
+
+    def _add(self, wrapper, operation, filter=None):
+        name = wrapper.pymongo_collection.name
+        self._operations.setdefault(name, []).append((operation, filter))
+
+    def insert_one(self, collection, document):
+        """Add an insert and return the _id of the document."""
+        wrapper = self._wrapper(collection)
+        document = self._db.save_callback(document, wrapper)
+        document.update(self._stamp(wrapper))
+        document.setdefault('_id', ObjectId())
+        self._add(wrapper, InsertOne(document))
+        return document['_id']
+
+    def insert_many(self, collection, documents):
+        """Add inserts and return the _ids of the documents."""
+        return [self.insert_one(collection, document) for document in documents]
+
+    def update_one(self, collection, filter, update):
+        wrapper = self._wrapper(collection)
+        wrapper._validate_filter(filter, validate_indexes=False)
+        filter = self._db.find_callback(filter, wrapper)
+        if not UPDATE_OPERATORS & update.keys():
+            raise ForbiddenOperation(
+                'Must use one or more of the following '
+                'operators for update: %s.' % ', '.join(UPDATE_OPERATORS)
+            )
+        timestamp = self._stamp(wrapper)['modified']
+        update = {
+            **update,
+            '$set': {**update.get('$set', {}), 'modified': timestamp},
+            '$push': {
+                **update.get('$push', {}),
+                'modified_history': {
+                    '$each': [timestamp],
+                    '$slice': -(MODIFIED_HISTORY_CAP + 1),
+                },
+            },
+        }
+        self._add(wrapper, UpdateOne(filter, update), filter)
+
+    def __len__(self):
+        return sum(len(operations) for operations in self._operations.values())
+
+    def commit(self):
+        """Write all operations, see the class docstring."""
+        if not self._operations:
+            return
+        if self.transaction:
+            with self._db.pymongo_client.start_session() as session:
+                session.with_transaction(self._write)
+        else:
+            self._write()
+
+        for name, operations in self._operations.items():
+            collection = self._db.pymongo_db.get_collection(name)
+            for _operation, filter in operations:
+                if filter is not None:
+                    self._db.document_cache.invalidate_for_filter(collection, filter)
+        self._operations.clear()
+        self._timestamp = None
+
+    def _write(self, session=None):
+        for name, operations in self._operations.items():
+            self._db.pymongo_db.get_collection(name).bulk_write(
+                [operation for operation, _filter in operations],
+                ordered=True,
+                session=session,
+            )
@@ -1,6 +1,7 @@
 import math
 import uuid
 from collections import defaultdict
+from functools import partial
 
 from bson.objectid import ObjectId
 from marshmallow import (
@@ -12,6 +13,7 @@ from marshmallow import (
     validates_schema,
 )
 
+from spynl_dbaccess.database import COUNTERS
 from spynl_schemas.fields import Nested, ObjectIdField
 from spynl_schemas.foxpro_serialize import resolve, serialize
 from spynl_schemas.shared_schemas import BaseSchema, CashierSchema, Schema, ShopSchema
@@ -94,9 +96,13 @@ class CustomerSchema(Schema):
             except ValueError:
                 _id = data['id']
 
-            customer = self.context['db'].customers.find_one(
-                {'_id': _id, 'tenant_id': self.context['tenant_id']}
-            )
+            if 'customers' in self.context:
+                # the customers of a batch of sales, looked up at once
+                customer = self.context['customers'].get(_id)
+            else:
+                customer = self.context['db'].customers.find_one(
+                    {'_id': _id, 'tenant_id': self.context['tenant_id']}
+                )
             if not customer:
                 raise ValidationError('This customer does not exist.', '_id')
 
@@ -791,16 +797,24 @@ class SaleSchema(BaseSchema):
 
         if not data.get('device') and 'user_info' in self.context:
             data['device'] = str(self.context['user_info']['_id'])
-        if (
-            not data.get('receiptNr')
-            and 'db' in self.context
-            and 'tenant_id' in self.context
-        ):
-            data['receiptNr'] = self.get_next_receiptnr(
-                self.context['db'],
-                self.context['tenant_id'],
-                transaction_type=data['type'],
-            )
+        if 'db' in self.context and 'tenant_id' in self.context:
+            if data.get('receiptNr'):
+                # the pos numbered the sale itself, the counter should not hand
+                # out the number again
+                self.skip_receiptnr(
+                    self.context['db'],
+                    self.context['tenant_id'],
+                    data['receiptNr'],
+                    transaction_type=data['type'],
+                )
+            elif not self.context.get('batch'):
+                # a batch reserves the receipt numbers of the sales that are valid
+                # at once, after loading them (see reserve_receiptnrs)
+                data['receiptNr'] = self.get_next_receiptnr(
+                    self.context['db'],
+                    self.context['tenant_id'],
+                    transaction_type=data['type'],
+                )
 
         data.update(self.calculate_totals(data))
 
@@ -866,10 +880,19 @@ class SaleSchema(BaseSchema):
                     'type': link_type[data['type']],
                 }
             )
-            self.context['db'].transactions.update_one(
-                {'_id': ObjectId(data['link']['id'])},
-                {'$set': {'link': new_link, 'status': 'closed'}},
-            )
+            # with a unit of work the consignment is closed when the sale is saved
+            unit = self.context.get('unit')
+            if unit is not None:
+                unit.update_one(
+                    'transactions',
+                    {'_id': ObjectId(data['link']['id'])},
+                    {'$set': {'link': new_link, 'status': 'closed'}},
+                )
+            else:
+                self.context['db'].transactions.update_one(
+                    {'_id': ObjectId(data['link']['id'])},
+                    {'$set': {'link': new_link, 'status': 'closed'}},
+                )
         return data
 
     @staticmethod
@@ -1319,20 +1342,48 @@ class SaleSchema(BaseSchema):
         return serialize(queries)
 
     @staticmethod
-    def get_next_receiptnr(db, tenant_id, transaction_type=2):
+    def _last_receiptnr(db, tenant_id, transaction_type):
+        # only needed the first time, when the counter is made.
         query = {
             'tenant_id': tenant_id,
             'type': transaction_type,
-            '$or': [{'receiptNr': {'$type': 'int'}}, {'receiptNr': {'$type': 'long'}}],
+            '$or': [
+                {'receiptNr': {'$type': 'int'}},
+                {'receiptNr': {'$type': 'long'}},
+            ],
         }
         result = db.transactions.find_one(
             query, {'receiptNr': 1}, sort=[('receiptNr', -1)]
         )
-        if result is not None:
-            next_nr = result['receiptNr'] + 1
-        else:
-            next_nr = 1
-        return next_nr
+        return result['receiptNr'] if result is not None else 0
+
+    @classmethod
+    def get_next_receiptnr(cls, db, tenant_id, transaction_type=2):
+        return COUNTERS.next(
+            db,
+            tenant_id,
+            'receiptNr.{}'.format(transaction_type),
+            seed=partial(cls._last_receiptnr, db, tenant_id, transaction_type),
+        )
+
+    @staticmethod
+    def skip_receiptnr(db, tenant_id, receiptnr, transaction_type=2):
+        COUNTERS.skip_to(
+            db, tenant_id, 'receiptNr.{}'.format(transaction_type), receiptnr
+        )
+
+    @classmethod
+    def reserve_receiptnrs(cls, db, tenant_id, amount, transaction_type=2):
+        """Return an iterator of amount receipt numbers, for a batch of sales."""
+        return iter(
+            COUNTERS.reserve(
+                db,
+                tenant_id,
+                'receiptNr.{}'.format(transaction_type),
+                amount,
+                seed=partial(cls._last_receiptnr, db, tenant_id, transaction_type),
+            )
+        )
 
     @classmethod
     def prepare_for_pdf(cls, sale):
@@ -1606,16 +1657,20 @@ class TransitSchema(SaleSchema):
 
     @post_load
     def postprocess(self, data, **kwargs):
-        if (
-            not data.get('receiptNr')
-            and 'db' in self.context
-            and 'tenant_id' in self.context
-        ):
-            data['receiptNr'] = self.get_next_receiptnr(
-                self.context['db'],
-                self.context['tenant_id'],
-                transaction_type=data['type'],
-            )
+        if 'db' in self.context and 'tenant_id' in self.context:
+            if data.get('receiptNr'):
+                self.skip_receiptnr(
+                    self.context['db'],
+                    self.context['tenant_id'],
+                    data['receiptNr'],
+                    transaction_type=data['type'],
+                )
+            else:
+                data['receiptNr'] = self.get_next_receiptnr(
+                    self.context['db'],
+                    self.context['tenant_id'],
+                    transaction_type=data['type'],
+                )
         return data
 
 
@@ -1,6 +1,7 @@
 import os
 import random
 import string
+import threading
 import uuid
 
 import pymongo
@@ -9,8 +10,11 @@ from pymongo.read_preferences import ReadPreference
 
 from spynl_dbaccess import (
     CollectionWrapper,
+    Counters,
     Database,
+    DocumentCache,
     ForbiddenOperators,
+    IndexCache,
     UnindexedQuery,
 )
 from spynl_dbaccess.database import default_database_callback
@@ -96,6 +100,204 @@ def test_not_rejected_for_index(database):
         pytest.fail('Should not have raised %s' % UnindexedQuery)
 
 
+def test_index_information_is_cached(database):
+    ctx = UserResource()
+    database.invalidate_index_cache()
+    misses = database.index_cache.misses
+    database[ctx]._validate_filter({'username': 'kareem'})
+    database[ctx]._validate_filter({'username': 'kareem'})
+    assert database.index_cache.misses == misses + 1
+
+
+def test_invalidate_index_cache(database):
+    ctx = UserResource()
+    database[ctx]._validate_filter({'username': 'kareem'})
+    database.users.pymongo_create_index('email')
+    with pytest.raises(UnindexedQuery):
+        database[ctx]._validate_filter({'email': 'kareem@gmail.com'})
+
+    database.invalidate_index_cache('users')
+    database[ctx]._validate_filter({'email': 'kareem@gmail.com'})
+
+
+def test_index_cache_expires():
+    class FakeCollection:
+        full_name = 'db.col'
+        calls = 0
+
+        def index_information(self):
+            self.calls += 1
+            return {'_id_': {'key': [('_id', 1)]}}
+
+    collection = FakeCollection()
+    cache = IndexCache(ttl=0)
+    assert cache.first_keys(collection) == {'_id'}
+    cache.first_keys(collection)
+    assert collection.calls == 2 and cache.stats()['misses'] == 2
+
+
+@pytest.fixture
+def cached_database(database):
+    database.document_cache = DocumentCache(maxsize=10)
+    return database
+
+
+def test_get_cached(cached_database, user_id):
+    user = cached_database.users.get_cached(user_id)
+    user['username'] = 'mutated'
+    assert cached_database.users.get_cached(user_id)['username'] == 'kareem'
+    assert cached_database.document_cache.stats() == {
+        'hits': 1,
+        'misses': 1,
+        'size': 1,
+    }
+
+
+def test_get_cached_only_caches_configured_collections(cached_database):
+    _id = cached_database.col.pymongo_insert_one({}).inserted_id
+    cached_database.col.get_cached(_id)
+    assert cached_database.document_cache.stats()['size'] == 0
+
+
+def test_get_cached_is_invalidated_by_update(cached_database, user_id):
+    cached_database.users.get_cached(user_id)
+    cached_database.users.update_one({'_id': user_id}, {'$set': {'username': 'a'}})
+    assert cached_database.users.get_cached(user_id)['username'] == 'a'
+
+
+def test_get_cached_is_invalidated_by_upsert(cached_database, user_id):
+    cached_database.users.get_cached(user_id)
+    cached_database.users.upsert_one({'username': 'kareem'}, {'username': 'b'})
+    assert cached_database.users.get_cached(user_id)['username'] == 'b'
+
+
+def test_document_cache_is_bounded(cached_database):
+    cached_database.document_cache.maxsize = 2
+    ids = cached_database.users.pymongo_insert_many([{}, {}, {}]).inserted_ids
+    for _id in ids:
+        cached_database.users.get_cached(_id)
+    assert cached_database.document_cache.stats()['size'] == 2
+
+
+class FakeUsers:
+    name = 'users'
+    full_name = 'db.users'
+
+    def find_one(self, filter):
+        return {'_id': filter['_id']}
+
+
+class FakeChangeStream:
+    def __init__(self, changes, error=None):
+        self.changes = changes
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        yield from self.changes
+        if self.error:
+            raise self.error
+
+
+class FakeDatabase:
+    def __init__(self, stream):
+        self.stream = stream
+
+    def watch(self, pipeline):
+        return self.stream
+
+
+def test_document_cache_change_stream_invalidates_changed_documents():
+    cache = DocumentCache(maxsize=10)
+    users = FakeUsers()
+    sizes = []
+
+    def changes():
+        cache.find_one(users, 1)
+        cache.find_one(users, 2)
+        yield {'ns': {'db': 'db', 'coll': 'users'}, 'documentKey': {'_id': 1}}
+        sizes.append(cache.stats()['size'])
+
+    cache._follow(FakeDatabase(FakeChangeStream(changes())))
+    assert sizes == [1]
+
+
+def test_document_cache_stops_caching_when_change_stream_fails():
+    cache = DocumentCache(maxsize=10)
+    users = FakeUsers()
+    cache.find_one(users, 1)
+
+    stream = FakeChangeStream([], error=pymongo.errors.PyMongoError())
+    cache._follow(FakeDatabase(stream))
+    assert cache.stats()['size'] == 0
+
+    cache.find_one(users, 1)
+    assert cache.stats()['size'] == 0 and not cache.caches(users)
+
+
+def test_counters(database):
+    counters = Counters()
+    assert [counters.next(database, '1', 'nr') for _ in range(3)] == [1, 2, 3]
+    # per tenant and per name
+    assert counters.next(database, '2', 'nr') == 1
+    assert counters.next(database, '1', 'other') == 1
+
+
+def test_counters_start_after_seed(database):
+    counters = Counters()
+    seeds = []
+
+    def seed():
+        seeds.append(1)
+        return 41
+
+    assert counters.next(database, '1', 'nr', seed=seed) == 42
+    assert counters.next(database, '1', 'nr', seed=seed) == 43
+    # the seed is only needed to make the counter
+    assert seeds == [1]
+
+
+def test_counters_are_unique_across_threads(database):
+    counters = Counters()
+    numbers = []
+
+    def take():
+        numbers.extend(counters.next(database, '1', 'nr') for _ in range(20))
+
+    threads = [threading.Thread(target=take) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(numbers) == list(range(1, 101))
+
+
+def test_counters_blocks(database):
+    first, second = Counters(block_size=10), Counters(block_size=10)
+    assert [first.next(database, '1', 'nr') for _ in range(3)] == [1, 2, 3]
+    assert second.next(database, '1', 'nr') == 11
+    assert database.counters.pymongo_find_one({'_id': '1:nr'})['value'] == 20
+
+
+def test_counters_skip_to(database):
+    counters = Counters(block_size=10)
+    counters.next(database, None, 'nr')
+    counters.skip_to(database, None, 'nr', 100)
+    assert counters.next(database, None, 'nr') == 101
+    # never goes back
+    counters.skip_to(database, None, 'nr', 50)
+    assert counters.next(database, None, 'nr') == 102
+    # a number in the block of this process is not handed out anymore
+    counters.skip_to(database, None, 'nr', 105)
+    assert counters.next(database, None, 'nr') == 106
+    assert database.counters.pymongo_find_one({'_id': 'nr'})['value'] == 110
+
+
 def test_rejected_for_forbidden_parameters(database):
     with pytest.raises(ForbiddenOperators):
         database.users._validate_filter({'$where': 'function () { return 1 }'})
@@ -283,3 +485,45 @@ def test_reset_callbacks(database):
     database.reset_callbacks()
     for c in ['find_callback', 'save_callback', 'aggregate_callback']:
         assert getattr(database, c) == default_database_callback
+
+
+def test_unit_of_work_writes_on_commit(database):
+    database.save_callback = lambda data, collection: {**data, 'tenant_id': ['1']}
+    database.col.pymongo_insert_one({'_id': 1, 'modified_history': []})
+    unit = database.unit_of_work()
+    _id = unit.insert_one('sales', {'nr': 1})
+    unit.update_one('col', {'_id': 1}, {'$set': {'active': False}})
+    unit.insert_many('events', [{'method': 'a'}, {'method': 'b'}])
+    assert len(unit) == 4
+    assert database.sales.count_documents({}) == 0
+
+    unit.commit()
+    sale = database.sales.find_one({'_id': _id})
+    assert sale['tenant_id'] == ['1']
+    assert sale['created'] == sale['modified']
+    updated = database.col.find_one({'_id': 1})
+    assert updated['active'] is False
+    assert updated['modified_history'] == [sale['modified']]
+    assert database.events.count_documents({'tenant_id': ['1']}) == 2
+    assert len(unit) == 0
+
+
+def test_unit_of_work_caps_modified_history(database, monkeypatch):
+    monkeypatch.setattr('spynl_dbaccess.database.MODIFIED_HISTORY_CAP', 1)
+    database.col.pymongo_insert_one({'_id': 1, 'modified_history': ['a', 'b']})
+    unit = database.unit_of_work()
+    unit.update_one('col', {'_id': 1}, {'$set': {'x': 1}})
+    unit.commit()
+    history = database.col.find_one({'_id': 1})['modified_history']
+    assert len(history) == 2
+    assert history[0] == 'b'
+
+
+def test_unit_of_work_stops_at_the_first_error(database):
+    database.col.pymongo_insert_one({'_id': 1})
+    unit = database.unit_of_work()
+    unit.insert_one('col', {'_id': 1})
+    unit.insert_one('events', {'method': 'a'})
+    with pytest.raises(pymongo.errors.BulkWriteError):
+        unit.commit()
+    assert database.events.count_documents({}) == 0
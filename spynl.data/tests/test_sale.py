@@ -541,6 +541,39 @@ def test_get_next_receiptNr_from_diff_type(database, t_type, schema):
     )
 
 
+def test_get_next_receiptNr_uses_counter(database):
+    """the highest receiptNr is only looked up the first time."""
+    database.transactions.insert_one({'receiptNr': 10, 'tenant_id': '1', 'type': 2})
+    assert SaleSchema.get_next_receiptnr(database, '1') == 11
+    assert SaleSchema.get_next_receiptnr(database, '1') == 12
+    assert SaleSchema.get_next_receiptnr(database, '1', transaction_type=3) == 1
+
+
+def test_reserve_receiptnrs(database):
+    database.transactions.insert_one({'receiptNr': 10, 'tenant_id': '1', 'type': 2})
+    assert list(SaleSchema.reserve_receiptnrs(database, '1', 3)) == [11, 12, 13]
+    assert SaleSchema.get_next_receiptnr(database, '1') == 14
+
+
+def test_batch_leaves_receiptnr_unset(database):
+    """a batch numbers its valid sales after loading them."""
+    with open(os.path.join(EXAMPLE_SALES_DIR, 'example_sale.json')) as f:
+        sale = json.loads(f.read())
+    sale.pop('receiptNr', None)
+    context = {'tenant_id': '1', 'db': database, 'batch': True}
+    assert not SaleSchema(context=context).load(sale).get('receiptNr')
+    assert SaleSchema.get_next_receiptnr(database, '1') == 1
+
+
+def test_skip_receiptnr(database):
+    """a number the pos gave a sale itself is not handed out by the counter."""
+    assert SaleSchema.get_next_receiptnr(database, '1') == 1
+    SaleSchema.skip_receiptnr(database, '1', 20)
+    assert SaleSchema.get_next_receiptnr(database, '1') == 21
+    SaleSchema.skip_receiptnr(database, '1', 5)
+    assert SaleSchema.get_next_receiptnr(database, '1') == 22
+
+
 def test_get_next_receiptNr_when_doesnt_exist_or_has_bad_type(database):
     database.transactions.insert_many(
         [dict(tenant_id=['123'], type=2), dict(tenant_id=['123'], type=2, receiptNr='')]
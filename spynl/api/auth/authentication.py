@@ -1,13 +1,16 @@
 """Deals with passwords authentication, scrambling and resetting."""
 
+import hmac
 import random
-from hashlib import md5, sha512
+from base64 import b64encode
+from hashlib import md5, pbkdf2_hmac, sha512
 
 from pbkdf2 import crypt
 
 from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.dateutils import now
+from spynl.main.utils import get_settings
 
 # from spynl.api.auth.utils import get_user_info
 from spynl.api.auth.exceptions import (
@@ -15,10 +18,20 @@ from spynl.api.auth.exceptions import (
     UnrecognisedHashType,
 )
 
-HASH_TYPE = '2'
+# Hash types:
+# 1: md5, 2: pbkdf2 (sha1, 400 iterations, pure python), 3: sha512,
+# 4: pbkdf2 with sha256 from hashlib, the number of iterations is part of the hash.
+HASH_TYPE = '4'
+# the default number of iterations for hash type 4, see spynl.auth.pbkdf2_iterations
+PBKDF2_ITERATIONS = 100000
 
 
-def scramble_password(password, salt='', hash_type=None):
+def pbkdf2_iterations():
+    """The number of iterations new type 4 hashes get."""
+    return int(get_settings('spynl.auth.pbkdf2_iterations') or PBKDF2_ITERATIONS)
+
+
+def scramble_password(password, salt='', hash_type=None, iterations=None):
     """
     Check the hash type against what is stored in the user object.
 
@@ -31,17 +44,51 @@ def scramble_password(password, salt='', hash_type=None):
         return crypt(password, salt)
     elif hash_type == '3':
         return sha512((password + salt).encode('utf-8')).hexdigest()
+    elif hash_type == '4':
+        iterations = iterations or pbkdf2_iterations()
+        digest = pbkdf2_hmac(
+            'sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations
+        )
+        return '$pbkdf2-sha256${}${}'.format(iterations, b64encode(digest).decode())
 
     raise UnrecognisedHashType()
 
 
+def hash_iterations(scrambled_password):
+    """Return the number of iterations of a type 4 hash."""
+    try:
+        return int(scrambled_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
 def challenge_password(password, scrambled_password, salt='', hash_type=None):
     """Challenge a given password against the existing one."""
-    return scrambled_password == scramble_password(
-        password, salt=salt, hash_type=hash_type
+    if not scrambled_password:
+        return False
+    iterations = None
+    if hash_type == '4':
+        iterations = hash_iterations(scrambled_password)
+        if iterations is None:
+            return False
+    return hmac.compare_digest(
+        scrambled_password,
+        scramble_password(
+            password, salt=salt, hash_type=hash_type, iterations=iterations
+        ),
     )
 
 
+def needs_rehash(user):
+    """
+    Whether the password of the user should be hashed again, because it has an
+    older hash type or fewer iterations than new hashes get.
+    """
+    if user.get('hash_type') != HASH_TYPE:
+        return True
+    return hash_iterations(user.get('password_hash')) != pbkdf2_iterations()
+
+
 def set_password(request, user, password, hash_type=None):
     """
     Update the user's password hash.
@@ -55,14 +102,18 @@ def set_password(request, user, password, hash_type=None):
     salt = user.get('password_salt', salt_generator())
     new_password_hash = scramble_password(password, salt, hash_type)
 
+    # the hashes are challenged, a type 4 hash can have another number of
+    # iterations than the new one.
     older_hashes = [
-        item.get('hash')
+        (item.get('hash'), item.get('hash_type'))
         for item in user.get('oldPasswords', [])
         if isinstance(item, dict) and item.get('hash_type') == hash_type
     ]
-    if user.get('password_hash'):
-        older_hashes.append(user['password_hash'])
-    if new_password_hash in older_hashes:
+    older_hashes.append((user.get('password_hash'), user.get('hash_type')))
+    if any(
+        challenge_password(password, older_hash, salt, older_type)
+        for older_hash, older_type in older_hashes
+    ):
         raise SpynlPasswordRequirementsException(
             _('password-does-not-meet-requirements-already-used')
         )
@@ -82,6 +133,26 @@ def set_password(request, user, password, hash_type=None):
     request.db.users.update_one({'username': user['username']}, update_user)
 
 
+def rehash_password(request, user, password):
+    """
+    Hash the (correct) password of the user again with the default hash type. The
+    password stays the same, so it is not added to the history. The salt stays the
+    same too, set_password uses it to check the history.
+    """
+    salt = user.get('password_salt') or salt_generator()
+    request.db.users.update_one(
+        {'_id': user['_id']},
+        {
+            '$set': {
+                'password_hash': scramble_password(password, salt, HASH_TYPE),
+                'hash_type': HASH_TYPE,
+                'password_salt': salt,
+                'hash_date': now(tz='UTC'),
+            }
+        },
+    )
+
+
 def salt_generator():
     """Generate an alphanumerical salt string."""
     chars = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
@@ -112,10 +183,7 @@ def challenge(
         user.get('password_salt'),
         user.get('hash_type'),
     ):
-        hash_type = HASH_TYPE
-        # rehash the password if the user's hash_type is not conform to the
-        # default hash_type
-        if hash_type != user.get('hash_type'):
-            set_password(request, user, password, hash_type)
+        if needs_rehash(user):
+            rehash_password(request, user, password)
         return user['_id']
     return None
@@ -1,9 +1,17 @@
 """List some Exceptions. Implement Authorization Policy."""
 
 import sys
+import threading
 from enum import Enum, unique
 
-from pyramid.authorization import ACLAllowed, ACLDenied, Allow, Authenticated, Everyone
+from pyramid.authorization import (
+    ALL_PERMISSIONS,
+    ACLAllowed,
+    ACLDenied,
+    Allow,
+    Authenticated,
+    Everyone,
+)
 from pyramid.location import lineage
 from pyramid.security import Allowed, Denied
 from pyramid.util import is_nonstr_iter
@@ -11,6 +19,7 @@ from pyramid.util import is_nonstr_iter
 from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.exceptions import IllegalAction
+from spynl.main.utils import get_logger
 
 from spynl.api.auth.exceptions import TenantDoesNotExist
 from spynl.api.auth.resources import B2BResource, Tenants, User
@@ -19,12 +28,14 @@ from spynl.api.auth.tenantid_utils import (
     reject_search_by_tenant_id,
     validate_tenant_id,
 )
-from spynl.api.auth.utils import MASTER_TENANT_ID, lookup_tenant
+from spynl.api.auth.utils import MASTER_TENANT_ID
 from spynl.api.mongo import MongoResource
 
 if sys.version_info > (3,):  # pragma: nocover
     basestring = str
 
+logger = get_logger(__name__)
+
 
 # TenantPrincipals
 # These are checked to see if a logged in user may act upon tenants.
@@ -65,13 +76,121 @@ class MultiAuthPolicySelected(object):
         self.userid = userid
 
 
-class IAuthorizationPolicy:
+class ACLTable:
+    """
+    The ACLs of a resource class and its parents, compiled into a table.
+
+    The ACEs of the lineage are numbered in the order check_acls walks them, and
+    the table maps (role, permission) to the number of the first ACE for that
+    role and permission. ACEs with ALL_PERMISSIONS (like DENY_ALL) are kept per
+    role. The ACE that decides for a set of principals is the one with the lowest
+    number among the entries of those principals, which is the ACE check_acls
+    would find first. Decisions are memoized per (frozenset(principals),
+    permission), where only the principals that occur in the ACLs count, so
+    the memo does not grow with the number of users.
+    """
+
+    def __init__(self, resource_class):
+        self.resource_class = resource_class
+        # (ace, acl, location) in lineage order, location is None for the context
+        self.aces = []
+        self.table = {}
+        self.all_permissions = {}
+        self._decisions = {}
+        self._lock = threading.Lock()
+
+        # the acl check_acls reports when nothing matches
+        self.last_acl = '<No ACL found on any object in resource lineage>'
+        for location in class_lineage(resource_class):
+            try:
+                acl = self.last_acl = location.__acl__
+            except AttributeError:
+                continue
+            for ace in acl:
+                number = len(self.aces)
+                self.aces.append(
+                    (ace, acl, None if location is resource_class else location)
+                )
+                ace_role, ace_permissions = ace[1], ace[2]
+                if ace_permissions is ALL_PERMISSIONS:
+                    self.all_permissions.setdefault(ace_role, number)
+                    continue
+                if not is_nonstr_iter(ace_permissions):
+                    ace_permissions = [ace_permissions]
+                for ace_permission in ace_permissions:
+                    self.table.setdefault((ace_role, ace_permission), number)
+        self.roles = frozenset(
+            [role for role, _permission in self.table] + list(self.all_permissions)
+        )
+
+    @staticmethod
+    def compilable(resource_class):
+        """Dynamic (callable) ACLs cannot be compiled."""
+        return not any(
+            callable(getattr(location, '__acl__', None))
+            for location in class_lineage(resource_class)
+        )
 
+    def decide(self, principals, permission):
+        """Return the (ace, acl, location) that decides, or None (default deny)."""
+        key = (self.roles.intersection(principals), permission)
+        try:
+            return self._decisions[key]
+        except KeyError:
+            pass
+        numbers = [
+            number
+            for role in key[0]
+            for number in (
+                self.table.get((role, permission)),
+                self.all_permissions.get(role),
+            )
+            if number is not None
+        ]
+        decision = self.aces[min(numbers)] if numbers else None
+        with self._lock:
+            self._decisions[key] = decision
+        return decision
+
+
+def class_lineage(resource_class):
+    """Like pyramid's lineage, for resources that set __parent__ on the class."""
+    location = resource_class
+    while location is not None:
+        yield location
+        location = getattr(location, '__parent__', None)
+
+
+class IAuthorizationPolicy:
     """An object representing a Pyramid Security policy."""
 
-    def __init__(self, policies, callback=None):
+    def __init__(self, policies, callback=None, trace=False):
         self._policies = policies
         self._callback = callback
+        # log the principals and the ACEs that decide at debug level
+        self.trace = trace
+        self._acl_tables = {}
+
+    def compile_acls(self, event):
+        """
+        Compile the ACLs of all resources when the configuration is commited (see
+        plugger.py). Resources that are not registered are compiled when they are
+        first used.
+        """
+        for resource_class in event.config.get_settings()['spynl.resources'].values():
+            self.acl_table(resource_class)
+
+    def acl_table(self, resource_class):
+        """Return the ACLTable of the resource class, None for dynamic ACLs."""
+        try:
+            return self._acl_tables[resource_class]
+        except KeyError:
+            pass
+        table = None
+        if ACLTable.compilable(resource_class):
+            table = ACLTable(resource_class)
+        self._acl_tables[resource_class] = table
+        return table
 
     def permits(self, request, context, permission):
         """
@@ -120,7 +239,8 @@ class IAuthorizationPolicy:
         localizer = request.localizer
 
         principals = append_authorization_principals(request, principals)
-        print(principals)
+        if self.trace:
+            logger.debug('Principals for %s: %s', request.path, principals)
 
         if request.method == 'OPTIONS':
             return Allowed(_('auth-pre-flight-requests-allowed').translate(localizer))
@@ -223,12 +343,35 @@ class IAuthorizationPolicy:
         for this request is in the ACE role list.
         This is based on pyramid.authorization.ACLAuthorizationPolicy
         but extended for our use case.
+
+        The decision is looked up in the compiled ACLTable of the class of the
+        context. Contexts with their own ACL or parent, or a dynamic ACL, are
+        checked by walking their lineage.
         """
+        table = None
+        attributes = getattr(context, '__dict__', {})
+        if '__acl__' not in attributes and '__parent__' not in attributes:
+            table = self.acl_table(type(context))
+        if table is None:
+            return self.walk_acls(context, principals, permission)
+
+        decision = table.decide(principals, permission)
+        if decision is None:
+            if self.trace:
+                logger.debug('No ACE of %s matches, default deny', type(context))
+            return ACLDenied(
+                '<default deny>', table.last_acl, permission, principals, context
+            )
+        ace, acl, location = decision
+        return self._decision(
+            context, principals, permission, ace, acl, location or context
+        )
+
+    def walk_acls(self, context, principals, permission):
+        """check_acls for contexts whose ACLs cannot be compiled."""
         acl = '<No ACL found on any object in resource lineage>'
         for location in lineage(context):
-            print(location)
             try:
-                print(location.__acl__)
                 acl = location.__acl__
             except AttributeError:
                 continue
@@ -237,7 +380,7 @@ class IAuthorizationPolicy:
                 acl = acl()
 
             for ace in acl:
-                ace_action, ace_role, ace_permissions = ace[0], ace[1], ace[2]
+                ace_role, ace_permissions = ace[1], ace[2]
                 if ace_role not in principals:
                     continue
 
@@ -246,28 +389,35 @@ class IAuthorizationPolicy:
                 if permission not in ace_permissions:
                     continue
 
-                if ace_action == Allow:
-                    if not hasattr(context, 'allowed_ace'):
-                        context.allowed_ace = ace
-
-                    return ACLAllowed(ace, acl, permission, principals, location)
-                else:
-                    if not hasattr(context, 'denied_ace'):
-                        context.denied_ace = ace
-                    return ACLDenied(ace, acl, permission, principals, location)
+                return self._decision(
+                    context, principals, permission, ace, acl, location
+                )
 
         # default deny (if no ACL in lineage at all, or if none of the
         # roles were mentioned in any ACE we found)
         return ACLDenied('<default deny>', acl, permission, principals, context)
 
+    def _decision(self, context, principals, permission, ace, acl, location):
+        if self.trace:
+            logger.debug('ACE %s of %s decides on %r', ace, location, permission)
+        if ace[0] == Allow:
+            if not hasattr(context, 'allowed_ace'):
+                context.allowed_ace = ace
+            return ACLAllowed(ace, acl, permission, principals, location)
+        else:
+            if not hasattr(context, 'denied_ace'):
+                context.denied_ace = ace
+            return ACLDenied(ace, acl, permission, principals, location)
+
     def load_identity(self, request):
         user = None
         for policy in self._policies:
             userid = policy.unauthenticated_userid(request)
             if userid is not None:
-                user = request.db.users.find_one({'_id': userid, 'active': True})
-                if user is not None:
+                user = request.identity_cache.get_user(userid)
+                if user is not None and user.get('active'):
                     break
+                user = None
         return user
 
     def identity(self, request):
@@ -369,13 +519,14 @@ def append_authorization_principals(request, principals):
     Set principals that are not defined by the authentication.
     """
 
+    identity_cache = request.identity_cache
     try:
-        if lookup_tenant(request.db, request.current_tenant_id).get('active') in (
+        if identity_cache.get_tenant(request.current_tenant_id).get('active') in (
             True,
             None,
         ):
             principals.append(Principals.TenantActive)
-        if lookup_tenant(request.db, request.requested_tenant_id).get('active') in (
+        if identity_cache.get_tenant(request.requested_tenant_id).get('active') in (
             True,
             None,
         ):
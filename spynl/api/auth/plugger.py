@@ -5,6 +5,7 @@ import json
 from pyramid.authentication import SessionAuthenticationPolicy
 from pyramid.authorization import Authenticated
 from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.settings import asbool
 
 from spynl.main.about import AboutResource
 
@@ -17,12 +18,21 @@ from spynl.api.auth.documentation import about_applications, about_roles, docume
 from spynl.api.auth.request_methods import (
     get_authenticated_user,
     get_current_tenant_id,
+    get_identity_cache,
     get_requested_tenant_id,
+    log_identity_cache_stats,
     validate_token,
 )
 from spynl.api.auth.resources import Events, SpynlSessions
-from spynl.api.auth.session_authentication import MongoDBSession, rolefinder
-from spynl.api.auth.token_authentication import TokenAuthAuthenticationPolicy
+from spynl.api.auth.session_authentication import (
+    SESSION_CACHE,
+    MongoDBSession,
+    rolefinder,
+)
+from spynl.api.auth.token_authentication import (
+    TOKEN_CACHE,
+    TokenAuthAuthenticationPolicy,
+)
 from spynl.api.auth.utils import get_user_info
 from spynl.api.mongo import MongoResource
 from spynl.api.mongo.plugger import add_dbaccess_endpoints
@@ -69,6 +79,12 @@ def includeme(config):
     # set up the function for the session factory, the rest of the set-up
     # happens in spynl.main.session
     config.add_settings(MongoDB=MongoDBSession)
+    settings = config.get_settings()
+    SESSION_CACHE.maxsize = int(settings.get('spynl.auth.session_cache_size', 10000))
+    SESSION_CACHE.ttl = float(settings.get('spynl.auth.session_cache_ttl', 5))
+    TOKEN_CACHE.maxsize = int(settings.get('spynl.auth.token_cache_size', 1000))
+    TOKEN_CACHE.ttl = float(settings.get('spynl.auth.token_cache_ttl', 30))
+    TOKEN_CACHE.signal = asbool(settings.get('spynl.auth.token_cache_signal'))
 
     policies = [
         TokenAuthAuthenticationPolicy(),
@@ -83,7 +99,12 @@ def includeme(config):
         SessionAuthenticationPolicy(callback=rolefinder),
     ]
 
-    config.set_security_policy(IAuthorizationPolicy(policies))
+    security_policy = IAuthorizationPolicy(
+        policies, trace=asbool(settings.get('spynl.auth.trace_acl'))
+    )
+    config.set_security_policy(security_policy)
+    # the ACLs of the resources are compiled after all plugins are loaded
+    config.add_subscriber(security_policy.compile_acls, 'spynl.main.ConfigCommited')
     config.add_view_deriver(
         authorization_control_tenant_id, under='validate_filter_and_data'
     )
@@ -96,6 +117,12 @@ def includeme(config):
 
     config.add_request_method(validate_token, name='token_payload', reify=True)
 
+    # User and tenant documents needed for authentication and authorization are
+    # looked up through request.identity_cache, so they are fetched only once
+    # per request.
+    config.add_request_method(get_identity_cache, name='identity_cache', reify=True)
+    config.add_subscriber(log_identity_cache_stats, 'pyramid.events.NewResponse')
+
     # The get_authenticated_user function can now be called by
     # request.cached_user the reify=True makes sure that the data is
     # cached and there is only one database call per request.
@@ -2,7 +2,78 @@ import uuid
 
 from bson import ObjectId
 
-from spynl.api.auth.exceptions import CannotRetrieveUser, UserNotActive
+from spynl.main.utils import get_logger
+
+from spynl.api.auth.exceptions import (
+    CannotRetrieveUser,
+    TenantDoesNotExist,
+    UserNotActive,
+)
+from spynl.api.auth.token_authentication import TOKEN_CACHE
+
+
+class IdentityCache:
+    """
+    Request scoped store for user and tenant documents.
+
+    During a single request the authentication policies, the rolefinder,
+    request.cached_user and the authorization policy all need the same user and
+    tenant documents. They look them up through this store, so every document
+    is fetched at most once per request. Documents that are not in the store yet
+    are fetched with get_cached, so they can come from the process-wide document
+    cache. `fetched` counts those lookups, `saved` the lookups that were served
+    from the store.
+
+    The returned documents are shared, so copy them before mutating.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._users = {}
+        self._tenants = {}
+        self.fetched = 0
+        self.saved = 0
+
+    def get_user(self, user_id):
+        """Return the user document, or None if it does not exist."""
+        if user_id in self._users:
+            self.saved += 1
+        else:
+            self.fetched += 1
+            self._users[user_id] = self._db.users.get_cached(user_id)
+        return self._users[user_id]
+
+    def get_tenant(self, tenant_id):
+        """Return the tenant document, raise TenantDoesNotExist if it does not."""
+        if tenant_id in self._tenants:
+            self.saved += 1
+        else:
+            self.fetched += 1
+            self._tenants[tenant_id] = self._db.tenants.get_cached(tenant_id)
+        tenant = self._tenants[tenant_id]
+        if not tenant:
+            raise TenantDoesNotExist(tenant_id)
+        return tenant
+
+    def stats(self):
+        return {'fetched': self.fetched, 'saved': self.saved}
+
+
+def get_identity_cache(request):
+    """Return the IdentityCache for this request (see plugger.py)."""
+    return IdentityCache(request.unscoped_db)
+
+
+def log_identity_cache_stats(event):
+    """Log how many identity lookups the IdentityCache saved for this request."""
+    request = event.request
+    # only requests that used the cache have it (reified) in their __dict__
+    identity_cache = request.__dict__.get('identity_cache')
+    if identity_cache is None:
+        return
+    get_logger(__name__).debug(
+        'Identity cache for %s: %s', request.path, identity_cache.stats()
+    )
 
 
 def get_current_tenant_id(request):
@@ -15,7 +86,7 @@ def get_current_tenant_id(request):
 
     tid = None
 
-    token = validate_token(request)
+    token = request.token_payload
     if token and 'tenant_id' in token:
         tid = token['tenant_id']
     elif 'tenant_id' in request.session:
@@ -62,7 +133,7 @@ def validate_token(request):
     except ValueError:
         return None
 
-    return request.pymongo_db.tokens.find_one({'token': token, 'revoked': False})
+    return TOKEN_CACHE.find_one(request.pymongo_db, token)
 
 
 def get_authenticated_user(request):
@@ -76,7 +147,7 @@ def get_authenticated_user(request):
     userid = request.authenticated_userid
     if userid is None:
         return None
-    user = request.pymongo_db.users.find_one({'_id': userid})
+    user = request.identity_cache.get_user(userid)
 
     if not user:
         raise CannotRetrieveUser()
@@ -1,8 +1,12 @@
 """Implements MongoDB Session to use instead of the standard pyramid session"""
+
 import binascii
 import logging
 import os
+import threading
 import time
+from collections import OrderedDict
+from copy import deepcopy
 from uuid import uuid4
 
 from bson.codec_options import CodecOptions
@@ -23,6 +27,60 @@ def _mkid():
     return uuid4().hex
 
 
+class SessionCache:
+    """
+    Thread-safe cache of session documents by sid, that expire after ttl seconds.
+
+    Most requests only read their session, so the documents of recent sessions are
+    kept in the process to save a find_one per request. Sessions that are changed
+    or removed by this process are updated in the cache, the ttl limits how long a
+    change by another process goes unnoticed. A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=10000, ttl=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(sid, None)
+                return None
+            self._entries.move_to_end(sid)
+            return deepcopy(entry[1])
+
+    def set(self, sid, document):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        document = deepcopy(document)
+        with self._lock:
+            self._entries[sid] = (time.monotonic(), document)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def remove(self, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+
+    def remove_user(self, userid, keep=None):
+        """Remove the sessions of a user, except the one with the sid keep."""
+        with self._lock:
+            for sid, (_time, document) in list(self._entries.items()):
+                if document.get('auth___userid') == userid and sid != keep:
+                    del self._entries[sid]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+SESSION_CACHE = SessionCache()
+
+
 @implementer(ISession)
 class MongoDBSession:
     """
@@ -32,9 +90,10 @@ class MongoDBSession:
     a dedicated collection in the database.
 
     We at least require a session ID (for identification), nothing else.
-    Changes made to the dict are reflected in the DB autmoatically.
-    However, if you change a value in a deeper level (e.g. a contained dict),
-    call session.changed() to notify it to save itself.
+    Changes made to the dict are tracked, and written to the database in one
+    update when save() is called, which the session factory does in a response
+    callback (see spynl.main.session). If you change a value in a deeper level
+    (e.g. a contained dict), call session.changed() to notify it to save itself.
 
     Note that MongoDB doesn't deal well with dots in keys,
     so we replace them with '___'.
@@ -43,18 +102,22 @@ class MongoDBSession:
     Also, we maybe store flash queue (_f_) and csrft token (_csrft_).
     """
 
-    # TODO: should _session be lazy, such that it's data is always fresh, no
-    #       matter which server instance is asked for it?
-
     collname = 'spynl_sessions'
     log = logging.getLogger(__name__)
 
     def __init__(self, id=None):
         """init session"""
         self._session = None
+        # the keys that were set or deleted since the session was saved
+        self._dirty = set()
+        self._deleted = set()
         # lookup existing session:
         if id is not None:
-            self._session = self._collection().find_one({'_id': id})
+            self._session = SESSION_CACHE.get(id)
+            if self._session is None:
+                self._session = self._collection().find_one({'_id': id})
+                if self._session is not None:
+                    SESSION_CACHE.set(id, self._session)
         # start new session:
         if self._session is None:
             sid = _mkid()
@@ -66,9 +129,11 @@ class MongoDBSession:
             }
             self.log.debug('New session initialized: %s', sid)
             self.new = True
+            self._stored = False
         else:
             self.log.debug('Looked up existing session with id %s', id)
             self.new = False
+            self._stored = True
 
     @property
     def id(self):  # pylint: disable=C0103
@@ -83,8 +148,7 @@ class MongoDBSession:
     @remember_me.setter
     def remember_me(self, value):
         """set remember me"""
-        self._session['_remember_me'] = value
-        self.changed()
+        self._set('_remember_me', value)
 
     @property
     def expire(self):
@@ -94,8 +158,7 @@ class MongoDBSession:
     @expire.setter
     def expire(self, value):
         """set expire"""
-        self._session['_expire'] = value
-        self.changed()
+        self._set('_expire', value)
 
     def __repr__(self):
         """readable representation"""
@@ -112,6 +175,19 @@ class MongoDBSession:
             codec_options=CodecOptions(tz_aware=True, uuid_representation=4),
         )
 
+    def _set(self, key, value):
+        """set a value of the stored session and mark it as changed"""
+        self._session[key] = value
+        self._dirty.add(key)
+        self._deleted.discard(key)
+        self.new = False
+
+    def _delete(self, key):
+        """remove a value of the stored session and mark it as changed"""
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        self.new = False
+
     # -- dict - like methods --
 
     def get(self, key):
@@ -124,13 +200,13 @@ class MongoDBSession:
 
     def __setitem__(self, key, value):
         """set a value"""
-        self._session[key.replace('.', '___')] = value
-        self.changed()
+        self._set(key.replace('.', '___'), value)
 
     def __delitem__(self, key):
         """remove a value"""
-        self._session.__delitem__(key.replace('.', '___'))
-        self.changed()
+        key = key.replace('.', '___')
+        del self._session[key]
+        self._delete(key)
 
     def __iter__(self):
         """Only works for proxying to a dict."""
@@ -148,21 +224,46 @@ class MongoDBSession:
         return self._session['_created']
 
     def changed(self):
-        """mark that this sesssion was changed"""
+        """mark that this sesssion was changed, all values will be saved"""
         self.new = False
-        self.save()
+        self._dirty.update(key for key in self._session if key != '_id')
+
+    @property
+    def dirty(self):
+        """Whether the session has changes that are not saved."""
+        return not self._stored or bool(self._dirty or self._deleted)
 
     def save(self):
-        """Only save when an _id (sid) and userid is present."""
-        if '_id' in self and 'auth.userid' in self:
+        """
+        Write the changes to the database. Only save when an _id (sid) and userid
+        is present.
+        """
+        if not ('_id' in self and 'auth.userid' in self) or not self.dirty:
+            return
+        if not self._stored:
             self._collection().replace_one({'_id': self.id}, self._session, upsert=True)
+        else:
+            update = {}
+            if self._dirty:
+                update['$set'] = {key: self._session[key] for key in self._dirty}
+            if self._deleted:
+                update['$unset'] = {key: '' for key in self._deleted}
+            self._collection().update_one({'_id': self.id}, update)
+        self._stored = True
+        self._dirty.clear()
+        self._deleted.clear()
+        SESSION_CACHE.set(self.id, self._session)
 
     def invalidate(self):
         """Clear the contents and remove a session."""
         self.log.info('Session removed: %s', self.id)
-        if self.new is False:
+        SESSION_CACHE.remove(self.id)
+        if self._stored:
             self._collection().delete_one({'_id': self.id})
         self._session.clear()
+        self._dirty.clear()
+        self._deleted.clear()
+        self._stored = False
 
     # flash API methods, adapted from Pyramid's default session
     def flash(self, msg, queue='', allow_duplicate=True):
@@ -170,12 +271,14 @@ class MongoDBSession:
         storage = self._session.setdefault('_f_' + queue, [])
         if allow_duplicate or (msg not in storage):
             storage.append(msg)
-        self.changed()
+        self._set('_f_' + queue, storage)
 
     def pop_flash(self, queue=''):
         """pop flash"""
-        storage = self._session.pop('_f_' + queue, [])
-        self.changed()
+        if '_f_' + queue not in self._session:
+            return []
+        storage = self._session.pop('_f_' + queue)
+        self._delete('_f_' + queue)
         return storage
 
     def peek_flash(self, queue=''):
@@ -187,8 +290,7 @@ class MongoDBSession:
     def new_csrf_token(self):
         """new CSRF token"""
         token = text_(binascii.hexlify(os.urandom(20)))
-        self._session['_csrft_'] = token
-        self.changed()
+        self._set('_csrft_', token)
         return token
 
     def get_csrf_token(self):
@@ -205,19 +307,29 @@ def rolefinder(userid, request):
     user. This is called by request.authenticated_userid, so be careful when
     using that function.
     """
-    user = request.db.users.find_one({'_id': userid, 'active': True})
+    user = request.identity_cache.get_user(userid)
 
     # By returning None here we will not set the Authenticated principal.
-    if not user:
+    if not user or not user.get('active'):
         return
 
     roles = []
     if request.current_tenant_id == MASTER_TENANT_ID:
-        roles = get_tenant_roles(request.db, user, MASTER_TENANT_ID, restrict=False)
+        roles = get_tenant_roles(
+            request.db,
+            user,
+            MASTER_TENANT_ID,
+            restrict=False,
+            tenant=request.identity_cache.get_tenant(MASTER_TENANT_ID),
+        )
 
     elif request.current_tenant_id:
         roles = get_tenant_roles(
-            request.db, user, request.current_tenant_id, restrict=True
+            request.db,
+            user,
+            request.current_tenant_id,
+            restrict=True,
+            tenant=request.identity_cache.get_tenant(request.current_tenant_id),
         )
 
     roles = ['role:%s' % role for role in roles]
@@ -136,6 +136,9 @@ class LoginSchema(Schema):
                 self.context['request'].pymongo_db.users.update_one(
                     {'_id': user['_id']}, {'$inc': {'failed_login': 1}}
                 )
+                self.context['request'].db.invalidate_document_cache(
+                    'users', user['_id']
+                )
             raise WrongCredentials()
 
 
@@ -352,6 +355,7 @@ def do_login(request, user, remember_me):
     request.pymongo_db.users.update_one(
         {'_id': user['_id']}, {'$set': {'failed_login': 0, 'last_login': now(tz='UTC')}}
     )
+    request.db.invalidate_document_cache('users', user['_id'])
 
     user_info = get_user_info(request)
     session['username'] = user.get('username')
@@ -2,9 +2,14 @@
 This module defines functions for generating, validating and decrypting tokens
 for authentication.
 """
+
+import copy
 import os
+import threading
+import time
 import uuid
-from datetime import datetime
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
 import boto3
 import bson
@@ -22,6 +27,125 @@ from spynl.main.utils import get_settings
 from spynl.api.auth.authorization import Principals
 from spynl.api.hr.exceptions import TokenError
 
+# tokens that are revoked or generated are announced in this collection, so other
+# processes drop them from their TokenCache.
+INVALIDATIONS_COLLECTION = 'token_invalidations'
+# number of seconds between two checks for announced tokens
+INVALIDATIONS_POLL_INTERVAL = 1
+# announced tokens are also looked for this many seconds before the last check, in
+# case the clocks of the servers differ a little.
+INVALIDATIONS_OVERLAP = 5
+# announcements are removed from the collection after this many seconds.
+INVALIDATIONS_EXPIRE = 3600
+
+
+class TokenCache:
+    """
+    Process-wide LRU cache with a TTL for the valid (not revoked) tokens.
+
+    Integrations call us at high rates with a handful of tokens, this saves a
+    lookup of the token on every request. Tokens that are revoked or generated by
+    this process are dropped immediately. With `signal` set, they are also
+    announced in the token_invalidations collection, which every process checks
+    at most once every INVALIDATIONS_POLL_INTERVAL seconds. Without it a token that
+    is revoked by another process is still accepted here for at most ttl seconds.
+
+    Tokens that do not exist are not cached. A ttl or maxsize of 0 disables the
+    cache.
+    """
+
+    def __init__(self, maxsize=1000, ttl=30, signal=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.signal = signal
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation, so a token that was read before it was
+        # revoked is not put in the cache after that.
+        self._generation = 0
+        self._last_poll = None
+        self._indexed = set()
+
+    def enabled(self):
+        return self.maxsize > 0 and self.ttl > 0
+
+    def find_one(self, db, token):
+        """Return a copy of the valid token document, or None."""
+        collection = db['tokens']
+        if not self.enabled():
+            return collection.find_one({'token': token, 'revoked': False})
+
+        if self.signal:
+            self._poll(db)
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            generation = self._generation
+
+        document = collection.find_one({'token': token, 'revoked': False})
+        if document is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[token] = (time.monotonic() + self.ttl, document)
+                self._entries.move_to_end(token)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return copy.deepcopy(document)
+
+    def invalidate(self, token=None):
+        """Drop a token, or all tokens if no token is given."""
+        with self._lock:
+            self._generation += 1
+            if token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(token, None)
+
+    def announce(self, db, token):
+        """Drop the token here, and in the other processes if signal is set."""
+        self.invalidate(token)
+        if not self.signal:
+            return
+        collection = db[INVALIDATIONS_COLLECTION]
+        if collection.full_name not in self._indexed:
+            collection.create_index('created', expireAfterSeconds=INVALIDATIONS_EXPIRE)
+            self._indexed.add(collection.full_name)
+        collection.insert_one({'token': token, 'created': datetime.now(timezone.utc)})
+
+    def _poll(self, db):
+        """Drop the tokens that were announced since the last check."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            last_poll = self._last_poll
+            if last_poll is not None and (now - last_poll).total_seconds() < (
+                INVALIDATIONS_POLL_INTERVAL
+            ):
+                return
+            self._last_poll = now
+
+        if last_poll is None:
+            # the first check only notes the time, nothing was cached before it
+            return
+        since = last_poll - timedelta(seconds=INVALIDATIONS_OVERLAP)
+        announced = db[INVALIDATIONS_COLLECTION].find(
+            {'created': {'$gte': since}}, {'token': 1}
+        )
+        for document in announced:
+            self.invalidate(document['token'])
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+TOKEN_CACHE = TokenCache()
+
 
 def legacy_token_request(token, request, revoke=False, description=None):
     # skip this step in e2e tests.
@@ -111,6 +235,7 @@ def revoke(db, token):
             )
 
     db.tokens.update_one({'_id': token['_id']}, {'$set': {'revoked': True}})
+    TOKEN_CACHE.announce(db, token['token'])
     return db.tokens.get(token['_id'])
 
 
@@ -151,6 +276,7 @@ def generate(db, user_id, tenant_id, usage_plan=None, payload=None, token_=None)
             )
 
     result = db.tokens.insert_one(token)
+    TOKEN_CACHE.announce(db, token['token'])
     return db.tokens.get(result.inserted_id)
 
 
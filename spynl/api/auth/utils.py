@@ -76,7 +76,7 @@ def lookup_tenant(db, tenant_id):
 
     Raise Exceptions when the tenant doesn't exist.
     """
-    tenant = db.tenants.pymongo_find_one({'_id': tenant_id})
+    tenant = db.tenants.get_cached(tenant_id)
     if not tenant:
         raise TenantDoesNotExist(tenant_id)
     return tenant
@@ -152,7 +152,7 @@ def audit_log(message=None, request_args=None):
     return outer_wrapper
 
 
-def get_tenant_roles(db, user, tenant_id, restrict=False):
+def get_tenant_roles(db, user, tenant_id, restrict=False, tenant=None):
     """
     return tenant roles for a user for a specific tenant_id
 
@@ -162,6 +162,8 @@ def get_tenant_roles(db, user, tenant_id, restrict=False):
     that are of the form: <appID>-<function>, in which appID is one of the
     tenant's apps.
     It will add the owner role if the user is an owner of the tenant.
+    Pass the tenant document if it was already looked up, to prevent another
+    database call.
     """
     roles = []
 
@@ -185,7 +187,8 @@ def get_tenant_roles(db, user, tenant_id, restrict=False):
     if 'sw-developer' in roles:
         roles.append('spynl-developer')
 
-    tenant = lookup_tenant(db, tenant_id)
+    if tenant is None:
+        tenant = lookup_tenant(db, tenant_id)
     # only allow roles that correspond to the t0enant's apps:
     if restrict:
         tenant_apps = get_tenant_applications(tenant)
@@ -210,7 +213,7 @@ def get_default_application(db, user, tenant_id):
             if default_application.get(tenant_id) is not None:
                 def_app = default_application.get(tenant_id)
     # check if tenant still has access to the app
-    tenant = db.tenants.pymongo_find_one({'_id': tenant_id})
+    tenant = db.tenants.get_cached(tenant_id)
     tenant_apps = get_tenant_applications(tenant)
     if def_app not in tenant_apps:
         def_app = None
@@ -478,6 +478,7 @@ def save_counters(ctx, request):
         return_document=pymongo.ReturnDocument.AFTER,
         projection={'counters': 1, '_id': 0},
     )
+    request.db.invalidate_document_cache('tenants', request.requested_tenant_id)
 
     return dict(data=updated_counters.get('counters', {}))
 
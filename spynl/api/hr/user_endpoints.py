@@ -11,6 +11,7 @@ Endpoints for managing user accounts.
 * get_tenant_roles
 * change_active
 """
+
 import os
 
 import pyotp
@@ -32,6 +33,7 @@ from spynl.api.auth.apps_and_roles import ROLES
 from spynl.api.auth.authentication import challenge, set_password
 from spynl.api.auth.exceptions import CannotRetrieveUser, Forbidden, WrongCredentials
 from spynl.api.auth.keys import check_key, remove_key, store_key
+from spynl.api.auth.session_authentication import SESSION_CACHE
 from spynl.api.auth.session_cycle import USER_EDIT_ME_WHITELIST
 from spynl.api.auth.utils import (
     MASTER_TENANT_ID,
@@ -161,6 +163,7 @@ def reset_pwd(request):
     set_password(request, user, pwd1)
 
     request.db.spynl_sessions.delete_many({'auth___userid': user['_id']})
+    SESSION_CACHE.remove_user(user['_id'])
     remove_key(request.db, user['_id'], 'pwd_reset')
     return dict(status='ok', message=_('reset-pwd-return'))
 
@@ -215,6 +218,7 @@ def change_pwd(request):
     request.db.spynl_sessions.delete_many(
         {'auth___userid': user_id, '_id': {'$ne': request.session.id}}
     )
+    SESSION_CACHE.remove_user(user_id, keep=request.session.id)
 
     # please also change the send_all_templates endpoint if you change
     # anything here.
@@ -17,10 +17,9 @@ from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.exceptions import IllegalAction, SpynlException
 from spynl.main.serial.file_responses import (
-    export_csv,
     export_excel,
     make_pdf_file_response,
-    serve_csv_response,
+    serve_csv,
     serve_excel_response,
 )
 from spynl.main.utils import get_settings
@@ -942,9 +941,7 @@ def download_csv(context, request):
     result = generate_list_of_skus(order)
     result = flatten_result(result)
     header = list(parameters['metadata'].keys())
-    temp_file = export_csv(header, result)
-
-    return serve_csv_response(request.response, temp_file)
+    return serve_csv(request.response, header, result)
 
 
 def download_excel(context, request):
@@ -8,9 +8,13 @@ in order to protect database performance but write to
 primary.
 """
 
+from functools import partial
+
 from pymongo import DESCENDING
 from pymongo.errors import DuplicateKeyError
 
+from spynl_dbaccess.database import COUNTERS
+
 from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.exceptions import IllegalAction, SpynlException
@@ -19,6 +23,8 @@ from spynl.main.utils import get_logger, get_settings
 from spynl.api.mongo.protection import reject_excluded_operators
 from spynl.api.mongo.utils import log_db_query
 
+INCREMENTAL_ID_LOWERBOUND = 100000
+
 
 @log_db_query
 def get(ctx, request, filtr, fields, limit=0, skip=0, sort=None):
@@ -175,32 +181,37 @@ def save(ctx, request, documents):
     return {'data': results}
 
 
+def _last_incremental_id(collection):
+    """The highest numeric _id of the collection, the counter starts after it."""
+    max_ = collection.find_one(
+        {'_id': {'$regex': '^[0-9]{6,}$'}}, {'_id': 1}, sort=[('_id', DESCENDING)]
+    )
+    return int(max_['_id']) if max_ else INCREMENTAL_ID_LOWERBOUND - 1
+
+
 @log_db_query
 def save_with_incremental_id(ctx, request, documents):
     """
-    For each document, find the next numeric _id incrementally, set it on the
-    document and then insert to the DB.
+    For each document, take the next numeric _id from the counter of the
+    collection, set it on the document and then insert to the DB.
     Return list of inserted ids.
     """
+    collection = request.db[ctx]
+    name = '_id.{}'.format(ctx.collection)
+    last_id = partial(_last_incremental_id, collection)
+
     ids = []
     for document in documents:
-        lowerbound = 100000
-        max_ = request.db[ctx].find_one(
-            {'_id': {'$regex': '^[0-9]{6,}$'}}, {'_id': 1}, sort=[('_id', DESCENDING)]
-        )
-        if not max_:
-            id = lowerbound
-        else:
-            id = int(max_['_id']) + 1
-
-        for i in range(1000):
-            document['_id'] = str(id)
+        for attempt in range(10):
+            document['_id'] = str(COUNTERS.next(request.db, None, name, seed=last_id))
             try:
-                result = request.db[ctx].insert_one(document)
+                result = collection.insert_one(document)
                 ids.append(result.inserted_id)
                 break
             except DuplicateKeyError:
-                id += 1
+                # the id was used without the counter, continue after the
+                # highest id.
+                COUNTERS.skip_to(request.db, None, name, last_id())
         else:
             raise SpynlException(_('cannot-find-next-incremental-id'))
 
@@ -6,7 +6,7 @@ from functools import partial
 from pyramid.security import NO_PERMISSION_REQUIRED
 from pyramid.settings import asbool
 
-from spynl_dbaccess.database import Database
+from spynl_dbaccess.database import COUNTERS, DOCUMENT_CACHE, INDEX_CACHE, Database
 
 from spynl.main.serial.objects import add_decode_function
 
@@ -70,6 +70,12 @@ def includeme(config):
         ['date', 'created.date', 'modified.date', 'periodStart', 'periodEnd'],
     )
 
+    # configure the process-wide caches of spynl_dbaccess
+    INDEX_CACHE.ttl = int(settings.get('spynl.mongo.index_cache_ttl', 300))
+    DOCUMENT_CACHE.maxsize = int(settings.get('spynl.mongo.document_cache_size', 0))
+    DOCUMENT_CACHE.ttl = int(settings.get('spynl.mongo.document_cache_ttl', 60))
+    COUNTERS.block_size = int(settings.get('spynl.mongo.counter_block_size', 1))
+
     # set up connection to DB
 
     db = Database(
@@ -80,6 +86,8 @@ def includeme(config):
         max_limit=int(settings['spynl.mongo.max_limit']),
         max_agg_limit=int(settings['spynl.mongo.max_agglimit']),
     )
+    if asbool(settings.get('spynl.mongo.document_cache_watch')):
+        db.document_cache.watch(db.pymongo_db)
 
     def add_db_property(request):
         # NOTE we do not set the callbacks for every request. So reset them to their
@@ -116,6 +124,12 @@ def includeme(config):
     # our custom db wrapper. Useful for internal logic.
     config.add_request_method(lambda r: db.pymongo_db, name='pymongo_db', reify=True)
 
+    # This is the same wrapped db object as request.db, but without setting the
+    # callbacks for this request. Only use it with methods that do not use the
+    # callbacks, like get_cached. Looking up the authenticated user cannot use
+    # request.db, because request.db needs the authenticated user itself.
+    config.add_request_method(lambda r: db, name='unscoped_db', reify=True)
+
     # we use this for pre spynl_data code with original db_access.
     config.add_settings({'spynl.mongo.db': db.pymongo_db})
 
@@ -3,6 +3,8 @@
 import time
 from copy import deepcopy
 
+from pyramid.settings import asbool
+
 from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.exceptions import IllegalParameter
@@ -169,12 +171,21 @@ def get_filter_keys(filtr):
     return set(keys)
 
 
+def unit_of_work(request):
+    """
+    Return a unit of work for the writes of the request, it commits them in one
+    transaction when spynl.mongo.transactions is set (this needs a replica set).
+    """
+    transaction = asbool(request.registry.settings.get('spynl.mongo.transactions'))
+    return request.db.unit_of_work(transaction=transaction)
+
+
 def insert_foxpro_events(
-    request, data, query_function, *args, check_empty=False, **kwargs
+    request, data, query_function, *args, check_empty=False, unit=None, **kwargs
 ):
     """
     Generate fpqueries using the data and function provided and save the events to the
-    database.
+    database. With a unit (of work) the events are added to it instead.
     """
     common_event_data = [
         ('token', request.session_or_token_id),
@@ -193,4 +204,7 @@ def insert_foxpro_events(
     ]
     if check_empty and not fpqueries:
         return
-    request.db.events.insert_many(fpqueries)
+    if unit is not None:
+        unit.insert_many('events', fpqueries)
+    else:
+        request.db.events.insert_many(fpqueries)
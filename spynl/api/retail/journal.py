@@ -7,10 +7,9 @@ from spynl_schemas import Nested, Schema
 from spynl.main.serial.file_responses import (
     METADATA_DESCRIPTION,
     ColumnMetadata,
-    export_csv,
     export_excel,
     export_header,
-    serve_csv_response,
+    serve_csv,
     serve_excel_response,
 )
 
@@ -612,8 +611,7 @@ def journal(request, format):
         temp_file = export_excel(header, result, data['columnMetadata'])
         return serve_excel_response(request.response, temp_file, 'journal.xlsx')
     elif format == 'csv':
-        temp_file = export_csv(header, result)
-        return serve_csv_response(request.response, temp_file)
+        return serve_csv(request.response, header, result)
 
 
 class JournalResponseDocumentation(Schema):
@@ -11,9 +11,8 @@ from marshmallow import (
 from spynl_schemas import Nested, ObjectIdField
 
 from spynl.main.serial.file_responses import (
-    export_csv,
     export_excel,
-    serve_csv_response,
+    serve_csv,
     serve_excel_response,
 )
 
@@ -303,8 +302,7 @@ def payment_report_csv(ctx, request):
         - data
     """
     data, header = prepare_for_export(payment_report(ctx, request))
-    temp_file = export_csv(header, data)
-    return serve_csv_response(request.response, temp_file)
+    return serve_csv(request.response, header, data)
 
 
 def payment_report_excel(ctx, request):
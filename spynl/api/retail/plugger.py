@@ -93,6 +93,9 @@ def includeme(config):
     )
 
     config.add_endpoint(sales.sale_cancel, 'cancel', context=Sales, permission='add')
+    config.add_endpoint(
+        sales.sale_add_batch, 'add-batch', context=Sales, permission='add'
+    )
 
     config.add_endpoint(
         sales.webshop_sale_add, 'add', context=WebshopSales, permission='add'
@@ -44,6 +44,7 @@ def get_new_pos_instance_id(request):
         return_document=ReturnDocument.AFTER,
         projection={'counters.posInstanceId': 1, '_id': 0},
     )
+    request.db.invalidate_document_cache('tenants', tid)
 
     return dict(status='ok', data=tenant['counters']['posInstanceId'])
 
@@ -5,6 +5,7 @@ import uuid
 import bson
 from marshmallow import (
     EXCLUDE,
+    INCLUDE,
     Schema,
     ValidationError,
     fields,
@@ -12,20 +13,24 @@ from marshmallow import (
     validate,
     validates,
 )
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 
 from spynl_schemas import ConsignmentSchema, Nested, SaleSchema
 
 from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.exceptions import IllegalAction
-from spynl.main.utils import required_args
+from spynl.main.utils import log_error, required_args
 
 from spynl.api.auth.utils import get_user_info
 from spynl.api.mongo.query_schemas import MongoQueryParamsSchema
-from spynl.api.mongo.utils import insert_foxpro_events
+from spynl.api.mongo.utils import insert_foxpro_events, unit_of_work
 from spynl.api.retail.exceptions import DuplicateTransaction
 from spynl.api.retail.utils import TransactionFilterSchema
 
+MAX_BATCH_SIZE = 200
+
 
 class SaleFilterSchema(TransactionFilterSchema):
     type = fields.Constant(2)
@@ -83,13 +88,38 @@ class ConsignmentGetSchema(MongoQueryParamsSchema):
     filter = Nested(ConsignmentFilterSchema, load_default=dict)
 
 
-def _deactivate_buffer(db, data):
+class BatchSaleSchema(Schema):
+    clientId = fields.String(
+        required=True,
+        validate=validate.Length(min=1),
+        metadata={
+            'description': 'The id the client gave the sale. Sending a sale with '
+            'the same clientId again does not add it twice. It is the nr of the '
+            'sale, unless the sale has a nr.'
+        },
+    )
+
+    class Meta:
+        # the other fields are the sale, which is loaded by the SaleSchema
+        unknown = INCLUDE
+
+
+class SaleAddBatchSchema(Schema):
+    data = fields.List(
+        fields.Nested(BatchSaleSchema),
+        required=True,
+        validate=validate.Length(min=1, max=MAX_BATCH_SIZE),
+        metadata={'description': 'The sales to add, at most 200.'},
+    )
+
+
+def _deactivate_buffer(unit, data):
     buffer_id = data.get('buffer_id')
     if buffer_id:
-        db.buffer.update_one({'_id': buffer_id}, {'$set': {'active': False}})
+        unit.update_one('buffer', {'_id': buffer_id}, {'$set': {'active': False}})
 
 
-def _update_loyalty_points(db, data):
+def _update_loyalty_points(unit, data):
     # in case customer is present but None
     customer = data.get('customer') or {}
     customer_id = customer.get('id')
@@ -101,7 +131,9 @@ def _update_loyalty_points(db, data):
 
         points = data.get('loyaltyPoints')
         if customer_id and points:
-            db.customers.update_one({'_id': customer_id}, {'$set': {'points': points}})
+            unit.update_one(
+                'customers', {'_id': customer_id}, {'$set': {'points': points}}
+            )
 
 
 def _add(ctx, request, transaction_schema=SaleSchema, webshop=False):
@@ -111,12 +143,15 @@ def _add(ctx, request, transaction_schema=SaleSchema, webshop=False):
     tenant_id = request.requested_tenant_id
     vat = request.db.tenants.find_one({'_id': tenant_id})['settings'].get('vat')
     user_info = get_user_info(request, purpose='stamp')['user']
+    unit = unit_of_work(request)
     context = {
         'vat_settings': vat,
         'tenant_id': tenant_id,
         'db': request.db,
         'user_info': user_info,
         'webshop': webshop,
+        # closing a linked consignment is part of the unit of work as well
+        'unit': unit,
     }
     schema = transaction_schema(context=context)
 
@@ -127,14 +162,16 @@ def _add(ctx, request, transaction_schema=SaleSchema, webshop=False):
     ):
         raise DuplicateTransaction()
 
-    # save the transaction and the events.
-    saved_transaction = request.db[ctx].insert_one(data)
-    _deactivate_buffer(request.db, data)
-    _update_loyalty_points(request.db, data)
-
-    insert_foxpro_events(request, data, transaction_schema.generate_fpqueries)
+    # save the transaction and the events, the transaction first.
+    inserted_id = unit.insert_one(ctx, data)
+    _deactivate_buffer(unit, data)
+    _update_loyalty_points(unit, data)
+    insert_foxpro_events(
+        request, data, transaction_schema.generate_fpqueries, unit=unit
+    )
+    unit.commit()
 
-    return dict(status='ok', data=[str(saved_transaction.inserted_id)])
+    return dict(status='ok', data=[str(inserted_id)])
 
 
 def sale_cancel(ctx, request):
@@ -208,10 +245,13 @@ def _save(ctx, request, transaction_schema=SaleSchema):
     )
 
     if result.upserted_id:
-        _deactivate_buffer(request.db, data)
-        _update_loyalty_points(request.db, data)
-
-        insert_foxpro_events(request, data, transaction_schema.generate_fpqueries)
+        unit = unit_of_work(request)
+        _deactivate_buffer(unit, data)
+        _update_loyalty_points(unit, data)
+        insert_foxpro_events(
+            request, data, transaction_schema.generate_fpqueries, unit=unit
+        )
+        unit.commit()
 
     return dict(status='ok', data=[str(result.upserted_id or data['_id'])])
 
@@ -347,6 +387,219 @@ def sale_add(ctx, request):
     return _add(ctx, request)
 
 
+def _batch_customers(request, sales):
+    """Look up the customers of all sales at once, by _id."""
+    ids = set()
+    for sale in sales:
+        customer_id = (sale.get('customer') or {}).get('id')
+        if customer_id:
+            try:
+                ids.add(uuid.UUID(customer_id))
+            except (TypeError, ValueError, AttributeError):
+                ids.add(customer_id)
+    if not ids:
+        return {}
+    return {
+        customer['_id']: customer
+        for customer in request.db.customers.find(
+            {'_id': {'$in': list(ids)}, 'tenant_id': request.requested_tenant_id}
+        )
+    }
+
+
+# the collections that have the clientId index, it is created once per process
+_indexed = set()
+
+
+def _ensure_client_id_index(collection):
+    """
+    A clientId is unique per tenant, also when the same batch is sent twice at
+    the same time. Only the sales of a batch have a clientId.
+    """
+    if collection.full_name not in _indexed:
+        collection.create_index(
+            [('tenant_id', ASCENDING), ('clientId', ASCENDING)],
+            unique=True,
+            partialFilterExpression={'clientId': {'$exists': True}},
+        )
+        _indexed.add(collection.full_name)
+
+
+def _is_duplicate_key(error):
+    if isinstance(error, DuplicateKeyError):
+        return True
+    if isinstance(error, BulkWriteError):
+        return any(
+            write_error.get('code') == 11000
+            for write_error in error.details.get('writeErrors', [])
+        )
+    return False
+
+
+def sale_add_batch(ctx, request):
+    """
+    Add a batch of new sales transactions.
+
+    ---
+    post:
+      description: >
+        Add many sales at once, for instance the sales a POS made while it was
+        offline. Every sale is validated and saved on its own like with
+        sales/add, a sale that is not valid or cannot be saved does not stop
+        the other sales from being added.
+
+        Every sale needs a clientId. A sale whose clientId was added before is
+        not added again, so a batch can safely be sent again when the response
+        did not arrive. The clientId is the nr of a sale without a nr.
+
+        ### Response
+
+        JSON keys    | Type   | Description\\n
+        ------------ | ------ | -----------\\n
+         status       | string | 'ok' or 'error'\\n
+         data         | list   | the result of every sale, in the order of the
+        request: the clientId, the status ('ok', 'duplicate' or 'error') and
+        the _id of the sale or the message and errors\\n
+      parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            $ref: 'sale_add_batch_parameters.json#/definitions/SaleAddBatchSchema'
+      tags:
+        - data
+    """
+    sales = SaleAddBatchSchema().load(request.json_payload)['data']
+    tenant_id = request.requested_tenant_id
+    _ensure_client_id_index(request.db[ctx].pymongo_collection)
+
+    client_ids = []
+    for sale in sales:
+        client_ids.append(sale.pop('clientId'))
+        sale.setdefault('nr', client_ids[-1])
+
+    # the sales that were added before, and their clientIds
+    added = {
+        sale['nr']: sale
+        for sale in request.db[ctx].find(
+            {
+                'tenant_id': tenant_id,
+                'type': 2,
+                'nr': {'$in': list({sale['nr'] for sale in sales})},
+            },
+            {'nr': 1, 'clientId': 1},
+        )
+    }
+    duplicate_message = DuplicateTransaction.message.translate(request.localizer)
+
+    results = [None] * len(sales)
+    todo = []
+    for i, (client_id, sale) in enumerate(zip(client_ids, sales)):
+        existing = added.get(sale['nr'])
+        if existing is None:
+            # the same sale can occur twice in a batch
+            added[sale['nr']] = {'clientId': client_id}
+            todo.append(i)
+        elif existing.get('clientId') == client_id:
+            results[i] = {'clientId': client_id, 'status': 'duplicate'}
+            if '_id' in existing:
+                results[i]['_id'] = str(existing['_id'])
+            else:
+                # added by this batch, the _id is known after saving it
+                results[i]['nr'] = sale['nr']
+        else:
+            results[i] = {
+                'clientId': client_id,
+                'status': 'error',
+                'message': duplicate_message,
+            }
+
+    vat = request.db.tenants.find_one({'_id': tenant_id})['settings'].get('vat')
+    # one context for all sales, with the customers looked up at once
+    context = {
+        'vat_settings': vat,
+        'tenant_id': tenant_id,
+        'db': request.db,
+        'user_info': get_user_info(request, purpose='stamp')['user'],
+        'customers': _batch_customers(request, [sales[i] for i in todo]),
+        'batch': True,
+    }
+    schema = SaleSchema(context=context)
+
+    loaded = []
+    for i in todo:
+        # every sale has its own unit of work, so a sale that cannot be saved
+        # does not take the writes of the other sales with it
+        unit = schema.context['unit'] = unit_of_work(request)
+        try:
+            loaded.append((i, unit, schema.load(sales[i])))
+        except ValidationError as e:
+            results[i] = {
+                'clientId': client_ids[i],
+                'status': 'error',
+                'message': _('validation-error').translate(request.localizer),
+                'errors': e.messages,
+            }
+
+    # the valid sales without a receipt number get one, reserved at once
+    unnumbered = [data for _i, _unit, data in loaded if not data.get('receiptNr')]
+    receipt_numbers = SaleSchema.reserve_receiptnrs(
+        request.db, tenant_id, len(unnumbered)
+    )
+    for data, receipt_number in zip(unnumbered, receipt_numbers):
+        data['receiptNr'] = receipt_number
+
+    inserted = {}
+    for i, unit, data in loaded:
+        data['clientId'] = client_ids[i]
+        _id = unit.insert_one(ctx, data)
+        _deactivate_buffer(unit, data)
+        _update_loyalty_points(unit, data)
+        insert_foxpro_events(request, data, SaleSchema.generate_fpqueries, unit=unit)
+        try:
+            unit.commit()
+        except PyMongoError as e:
+            if _is_duplicate_key(e):
+                # added at the same time by another request, or the nr is taken
+                existing = request.db[ctx].find_one(
+                    {'tenant_id': tenant_id, 'clientId': client_ids[i]}, {'_id': 1}
+                )
+                if existing is None:
+                    results[i] = {
+                        'clientId': client_ids[i],
+                        'status': 'error',
+                        'message': duplicate_message,
+                    }
+                else:
+                    inserted[data['nr']] = existing['_id']
+                    results[i] = {
+                        'clientId': client_ids[i],
+                        'status': 'duplicate',
+                        '_id': str(existing['_id']),
+                    }
+                continue
+            log_error(e, request, "Sale of a batch not saved ('%s'): '%s'.")
+            results[i] = {
+                'clientId': client_ids[i],
+                'status': 'error',
+                'message': _('internal-server-error').translate(request.localizer),
+            }
+            continue
+        inserted[data['nr']] = _id
+        results[i] = {'clientId': client_ids[i], 'status': 'ok', '_id': str(_id)}
+
+    for result in results:
+        nr = result.pop('nr', None)
+        if nr is not None:
+            # a duplicate within the batch of a sale that was not valid is an error
+            if nr in inserted:
+                result['_id'] = str(inserted[nr])
+            else:
+                result.update(status='error', message=duplicate_message)
+
+    return dict(status='ok', data=results)
+
+
 @required_args('data')
 def webshop_sale_add(ctx, request):
     """
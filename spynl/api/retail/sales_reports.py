@@ -23,9 +23,8 @@ from spynl.locale import SpynlTranslationString as _
 from spynl.main.dateutils import localize_date, now
 from spynl.main.exceptions import IllegalAction, IllegalParameter
 from spynl.main.serial.file_responses import (
-    export_csv,
     export_excel,
-    serve_csv_response,
+    serve_csv,
     serve_excel_response,
 )
 from spynl.main.utils import required_args
@@ -242,8 +241,7 @@ def period_csv(ctx, request):
         - reporting
     """
     data, header = prepare_for_export(period(ctx, request))
-    temp_file = export_csv(header, data)
-    return serve_csv_response(request.response, temp_file)
+    return serve_csv(request.response, header, data)
 
 
 def period_excel(ctx, request):
@@ -752,8 +750,7 @@ def per_warehouse_csv(ctx, request):
         - reporting
     """
     data, header = prepare_for_export(per_warehouse(ctx, request))
-    temp_file = export_csv(header, data)
-    return serve_csv_response(request.response, temp_file)
+    return serve_csv(request.response, header, data)
 
 
 def per_warehouse_excel(ctx, request):
@@ -980,8 +977,7 @@ def per_article_csv(ctx, request):
         - reporting
     """
     data, header = prepare_for_export(per_article(ctx, request))
-    temp_file = export_csv(header, data)
-    return serve_csv_response(request.response, temp_file)
+    return serve_csv(request.response, header, data)
 
 
 def per_article_excel(ctx, request):
@@ -1,4 +1,5 @@
 """The main package of Spynl."""
+
 import os
 
 import sentry_sdk
@@ -17,6 +18,7 @@ from spynl.main.docs.documentation import make_docs
 from spynl.main.error_views import error400, error500, spynl_error, validation_error
 from spynl.main.exceptions import SpynlException
 from spynl.main.utils import (
+    OriginMatcher,
     add_jinja2_filters,
     check_origin,
     get_logger,
@@ -99,6 +101,67 @@ class IniSettings(Schema):
         data_key='spynl.auth.otp.issuer',
         metadata={'description': '2FA issuer, shows up in Authenticator app.'},
     )
+    spynl_auth_pbkdf2_iterations = fields.String(
+        attribute='spynl.auth.pbkdf2_iterations',
+        data_key='spynl.auth.pbkdf2_iterations',
+        metadata={
+            'description': 'Number of pbkdf2 iterations of new password hashes '
+            '(hash type 4). Defaults to 100000. Passwords with fewer iterations or '
+            'an older hash type are hashed again when the user logs in.'
+        },
+    )
+    spynl_auth_session_cache_size = fields.String(
+        attribute='spynl.auth.session_cache_size',
+        data_key='spynl.auth.session_cache_size',
+        metadata={
+            'description': 'Maximum number of sessions that are cached between '
+            'requests. Defaults to 10000.'
+        },
+    )
+    spynl_auth_session_cache_ttl = fields.String(
+        attribute='spynl.auth.session_cache_ttl',
+        data_key='spynl.auth.session_cache_ttl',
+        metadata={
+            'description': 'Number of seconds sessions are cached, which is how '
+            'long a change to a session by another process can go unnoticed. '
+            'Defaults to 5, 0 disables the cache.'
+        },
+    )
+    spynl_auth_token_cache_size = fields.String(
+        attribute='spynl.auth.token_cache_size',
+        data_key='spynl.auth.token_cache_size',
+        metadata={
+            'description': 'Maximum number of api tokens that are cached between '
+            'requests. Defaults to 1000.'
+        },
+    )
+    spynl_auth_token_cache_ttl = fields.String(
+        attribute='spynl.auth.token_cache_ttl',
+        data_key='spynl.auth.token_cache_ttl',
+        metadata={
+            'description': 'Number of seconds api tokens are cached. Defaults to '
+            '30, 0 disables the cache.'
+        },
+    )
+    spynl_auth_token_cache_signal = fields.String(
+        attribute='spynl.auth.token_cache_signal',
+        data_key='spynl.auth.token_cache_signal',
+        metadata={
+            'description': 'Announce revoked tokens in the token_invalidations '
+            'collection, so other processes stop accepting them within a second '
+            'instead of after token_cache_ttl. Is read with Pyramid asbool '
+            'function.'
+        },
+    )
+    spynl_auth_trace_acl = fields.String(
+        attribute='spynl.auth.trace_acl',
+        data_key='spynl.auth.trace_acl',
+        metadata={
+            'description': 'Log the principals of every request and the ACE that '
+            'decides on its permission at debug level. Is read with Pyramid asbool '
+            'function.'
+        },
+    )
     spynl_mongo_url = fields.String(
         attribute='spynl.mongo.url',
         data_key='spynl.mongo.url',
@@ -145,6 +208,300 @@ class IniSettings(Schema):
             'description': 'Maximum number of returned documents for aggregation'
         },
     )
+    spynl_mongo_index_cache_ttl = fields.String(
+        attribute='spynl.mongo.index_cache_ttl',
+        data_key='spynl.mongo.index_cache_ttl',
+        metadata={
+            'description': 'Number of seconds the indexes of large collections are '
+            'cached before they are requested from the database again. Defaults to '
+            '300.'
+        },
+    )
+    spynl_mongo_document_cache_size = fields.String(
+        attribute='spynl.mongo.document_cache_size',
+        data_key='spynl.mongo.document_cache_size',
+        metadata={
+            'description': 'Maximum number of tenant and user documents that are '
+            'cached between requests. Defaults to 0, which disables the cache.'
+        },
+    )
+    spynl_mongo_document_cache_ttl = fields.String(
+        attribute='spynl.mongo.document_cache_ttl',
+        data_key='spynl.mongo.document_cache_ttl',
+        metadata={
+            'description': 'Number of seconds tenant and user documents are cached. '
+            'Defaults to 60.'
+        },
+    )
+    spynl_mongo_document_cache_watch = fields.String(
+        attribute='spynl.mongo.document_cache_watch',
+        data_key='spynl.mongo.document_cache_watch',
+        metadata={
+            'description': 'Follow a change stream to invalidate cached documents '
+            'that are changed by other processes. Requires a replica set. Is read '
+            'with Pyramid asbool function.'
+        },
+    )
+    spynl_mongo_counter_block_size = fields.String(
+        attribute='spynl.mongo.counter_block_size',
+        data_key='spynl.mongo.counter_block_size',
+        metadata={
+            'description': 'Number of receipt numbers and incremental ids a process '
+            'takes from a counter at once. Defaults to 1. Larger blocks save round '
+            'trips, but numbers are no longer given out in order, and unused '
+            'numbers of a block are lost when the process stops.'
+        },
+    )
+    spynl_mongo_transactions = fields.String(
+        attribute='spynl.mongo.transactions',
+        data_key='spynl.mongo.transactions',
+        metadata={
+            'description': 'Write a sale and the documents it changes (buffer, '
+            'customer, events) in one transaction. Requires a replica set. Without '
+            'it they are written one collection after the other. Is read with '
+            'Pyramid asbool function.'
+        },
+    )
+    spynl_redshift_stream_reports = fields.String(
+        attribute='spynl.redshift.stream_reports',
+        data_key='spynl.redshift.stream_reports',
+        metadata={
+            'description': 'Stream csv and json reports from a server side cursor '
+            'instead of loading the whole result in memory. Is read with Pyramid '
+            'asbool function.'
+        },
+    )
+    spynl_redshift_itersize = fields.String(
+        attribute='spynl.redshift.itersize',
+        data_key='spynl.redshift.itersize',
+        metadata={
+            'description': 'Number of rows a streamed report fetches at a time. '
+            'Defaults to 2000.'
+        },
+    )
+    spynl_redshift_result_cache = fields.String(
+        attribute='spynl.redshift.result_cache',
+        data_key='spynl.redshift.result_cache',
+        metadata={
+            'description': "Cache the results of report queries, either in 'memory' "
+            "of the process or in 'mongo', shared by all processes. Leave empty to "
+            'disable the cache.'
+        },
+    )
+    spynl_redshift_result_cache_size = fields.String(
+        attribute='spynl.redshift.result_cache_size',
+        data_key='spynl.redshift.result_cache_size',
+        metadata={
+            'description': 'Maximum number of results in the memory cache. Defaults '
+            'to 100.'
+        },
+    )
+    spynl_redshift_result_cache_ttl = fields.String(
+        attribute='spynl.redshift.result_cache_ttl',
+        data_key='spynl.redshift.result_cache_ttl',
+        metadata={
+            'description': 'Number of seconds results are cached. Defaults to 300.'
+        },
+    )
+    spynl_redshift_result_cache_max_rows = fields.String(
+        attribute='spynl.redshift.result_cache_max_rows',
+        data_key='spynl.redshift.result_cache_max_rows',
+        metadata={
+            'description': 'Results with more rows are not cached. Defaults to 50000.'
+        },
+    )
+    spynl_redshift_stock_page_size = fields.String(
+        attribute='spynl.redshift.stock_page_size',
+        data_key='spynl.redshift.stock_page_size',
+        metadata={
+            'description': 'Number of rows the stock report fetches per query. '
+            'Defaults to 5000, 0 fetches all rows in one query.'
+        },
+    )
+    spynl_redshift_min_connections = fields.String(
+        attribute='spynl.redshift.min_connections',
+        data_key='spynl.redshift.min_connections',
+        metadata={
+            'description': 'Number of redshift connections that are made at startup '
+            'and kept open. Defaults to 1.'
+        },
+    )
+    spynl_redshift_acquire_timeout = fields.String(
+        attribute='spynl.redshift.acquire_timeout',
+        data_key='spynl.redshift.acquire_timeout',
+        metadata={
+            'description': 'Number of seconds a request waits for a free redshift '
+            'connection before it fails. Defaults to 10.'
+        },
+    )
+    spynl_redshift_connection_max_age = fields.String(
+        attribute='spynl.redshift.connection_max_age',
+        data_key='spynl.redshift.connection_max_age',
+        metadata={
+            'description': 'Number of seconds after which a redshift connection is '
+            'closed and replaced. Defaults to 3600, 0 closes connections after '
+            'every request.'
+        },
+    )
+    spynl_redshift_pre_ping = fields.String(
+        attribute='spynl.redshift.pre_ping',
+        data_key='spynl.redshift.pre_ping',
+        metadata={
+            'description': 'Check if a redshift connection still works before it is '
+            'used. Defaults to true. Is read with Pyramid asbool function.'
+        },
+    )
+    spynl_jobs_enabled = fields.String(
+        attribute='spynl.jobs.enabled',
+        data_key='spynl.jobs.enabled',
+        metadata={
+            'description': 'Send report emails from a worker (spynl-cli services '
+            'worker) instead of within the request. Is read with Pyramid asbool '
+            'function.'
+        },
+    )
+    spynl_jobs_lease = fields.String(
+        attribute='spynl.jobs.lease',
+        data_key='spynl.jobs.lease',
+        metadata={
+            'description': 'Number of seconds after which a running job that was '
+            'not renewed by its worker is considered abandoned and can be run by '
+            'another worker. Workers renew it every lease / 3 seconds. Defaults to '
+            '600.'
+        },
+    )
+    spynl_jobs_max_attempts = fields.String(
+        attribute='spynl.jobs.max_attempts',
+        data_key='spynl.jobs.max_attempts',
+        metadata={
+            'description': 'Number of times a job is tried before it fails. '
+            'Defaults to 3.'
+        },
+    )
+    spynl_jobs_keep = fields.String(
+        attribute='spynl.jobs.keep',
+        data_key='spynl.jobs.keep',
+        metadata={
+            'description': 'Number of seconds finished jobs and their files are '
+            'kept. Defaults to 604800 (a week).'
+        },
+    )
+    spynl_mail_outbox = fields.String(
+        attribute='spynl.mail.outbox',
+        data_key='spynl.mail.outbox',
+        metadata={
+            'description': 'Add emails to the mail outbox, which is sent by a worker '
+            '(spynl-cli services mail-worker), instead of sending them within the '
+            'request. Is read with Pyramid asbool function.'
+        },
+    )
+    spynl_mail_connections = fields.String(
+        attribute='spynl.mail.connections',
+        data_key='spynl.mail.connections',
+        metadata={
+            'description': 'Number of connections to the mail server a mail worker '
+            'keeps open and sends over at the same time. Defaults to 2.'
+        },
+    )
+    spynl_mail_batch_size = fields.String(
+        attribute='spynl.mail.batch_size',
+        data_key='spynl.mail.batch_size',
+        metadata={
+            'description': 'Number of emails a mail worker claims at a time. '
+            'Defaults to 50.'
+        },
+    )
+    spynl_mail_max_attempts = fields.String(
+        attribute='spynl.mail.max_attempts',
+        data_key='spynl.mail.max_attempts',
+        metadata={
+            'description': 'Number of times sending an email is tried before it '
+            'fails. Defaults to 5.'
+        },
+    )
+    spynl_mail_retry_delay = fields.String(
+        attribute='spynl.mail.retry_delay',
+        data_key='spynl.mail.retry_delay',
+        metadata={
+            'description': 'Number of seconds before an email that could not be '
+            'sent is tried again, doubles with every attempt (at most an hour). '
+            'Defaults to 60.'
+        },
+    )
+    spynl_mail_keep = fields.String(
+        attribute='spynl.mail.keep',
+        data_key='spynl.mail.keep',
+        metadata={
+            'description': 'Number of seconds sent and failed emails are kept in '
+            'the outbox. Defaults to 604800 (a week).'
+        },
+    )
+    spynl_pdf_processes = fields.String(
+        attribute='spynl.pdf.processes',
+        data_key='spynl.pdf.processes',
+        metadata={
+            'description': 'Number of worker processes that render pdfs. Defaults '
+            'to 0, which renders pdfs in the request thread.'
+        },
+    )
+    spynl_pdf_timeout = fields.String(
+        attribute='spynl.pdf.timeout',
+        data_key='spynl.pdf.timeout',
+        metadata={
+            'description': 'Number of seconds after which a pdf worker that is '
+            'still rendering is stopped. Defaults to 60.'
+        },
+    )
+    spynl_pdf_max_timeout = fields.String(
+        attribute='spynl.pdf.max_timeout',
+        data_key='spynl.pdf.max_timeout',
+        metadata={
+            'description': 'Number of seconds after which a pdf worker that is '
+            'still rendering a merged pdf (the pdfs of a batch in one file) is '
+            'stopped. Such a pdf gets spynl.pdf.timeout seconds per document, up '
+            'to this. Defaults to 300.'
+        },
+    )
+    spynl_pdf_acquire_timeout = fields.String(
+        attribute='spynl.pdf.acquire_timeout',
+        data_key='spynl.pdf.acquire_timeout',
+        metadata={
+            'description': 'Number of seconds a request waits for a free pdf '
+            'worker. Defaults to 30.'
+        },
+    )
+    spynl_pdf_image_cache_dir = fields.String(
+        attribute='spynl.pdf.image_cache_dir',
+        data_key='spynl.pdf.image_cache_dir',
+        metadata={
+            'description': 'Directory of the cache of the images in pdfs. Defaults '
+            'to spynl-pdf-images in the temporary directory.'
+        },
+    )
+    spynl_pdf_image_cache_size = fields.String(
+        attribute='spynl.pdf.image_cache_size',
+        data_key='spynl.pdf.image_cache_size',
+        metadata={
+            'description': 'Maximum size in MB of the cache of the images in pdfs. '
+            'Defaults to 512, 0 turns the cache off.'
+        },
+    )
+    spynl_pdf_image_cache_ttl = fields.String(
+        attribute='spynl.pdf.image_cache_ttl',
+        data_key='spynl.pdf.image_cache_ttl',
+        metadata={
+            'description': 'Number of seconds after which a cached image of a pdf '
+            'is fetched again. Defaults to 86400 (a day).'
+        },
+    )
+    spynl_pdf_prefetch_threads = fields.String(
+        attribute='spynl.pdf.prefetch_threads',
+        data_key='spynl.pdf.prefetch_threads',
+        metadata={
+            'description': 'Number of images of a pdf that are fetched at the same '
+            'time before it is rendered. Defaults to 8.'
+        },
+    )
     spynl_pipe_fp_web_url = fields.String(
         attribute='spynl.pipe.fp_web_url',
         data_key='spynl.pipe.fp_web_url',
@@ -235,6 +592,10 @@ def main(global_config, config=None, **settings):
 
 def main_includeme(config):
     config.add_settings({'spynl.app.start_time': now()})
+    # origins are checked on every request, with a matcher made once
+    config.add_settings(
+        {'spynl.origin_matcher': OriginMatcher.from_settings(config.get_settings())}
+    )
 
     # Add spynl.main's view derivers
     config.add_view_deriver(handle_pre_flight_request, under=INGRESS)
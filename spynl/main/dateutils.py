@@ -2,7 +2,10 @@
 Functions for handling dates and times.
 """
 
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+from functools import lru_cache
 
 import dateutil.parser  # pylint: disable=E0611
 from pytz import timezone, utc
@@ -11,6 +14,13 @@ from spynl.main.utils import get_request, get_user_info
 
 SPYNL_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S%z'
 
+# pytz.timezone normalizes the name on every call
+_timezone = lru_cache(maxsize=64)(timezone)
+
+# the time zone of the user while a response is rendered (a list, so it is only
+# looked up when the first date is localized), see user_timezone.
+_user_tz = ContextVar('user_tz', default=None)
+
 
 def now(tz=None):
     """Current time, with timezone localised."""
@@ -51,11 +61,37 @@ def localize_date(when, user_specific=True, tz=None):
     if not tz:
         tz = 'UTC'
         if user_specific:
-            request = get_request()
-            if request:  # e.g. in testing there might be no request
-                user_info = get_user_info(request)
-                if user_info.get('tz'):
-                    tz = user_info.get('tz')
+            found = _user_tz.get()
+            if found is None:
+                tz = get_user_timezone()
+            else:
+                if not found:
+                    found.append(get_user_timezone())
+                tz = found[0]
     if not when.tzinfo:
         when = when.replace(tzinfo=utc)
-    return when.astimezone(timezone(tz))
+    return when.astimezone(_timezone(tz))
+
+
+def get_user_timezone():
+    """The time zone of the user of the current request, UTC if there is none."""
+    request = get_request()
+    if request:  # e.g. in testing there might be no request
+        user_info = get_user_info(request)
+        if user_info.get('tz'):
+            return user_info.get('tz')
+    return 'UTC'
+
+
+@contextmanager
+def user_timezone(tz=None):
+    """
+    Look up the time zone of the user once for all dates that are localized in
+    this block, instead of once per date. Used when responses are rendered.
+    With tz, that time zone is used, for when there is no request anymore.
+    """
+    token = _user_tz.set([tz] if tz else [])
+    try:
+        yield
+    finally:
+        _user_tz.reset(token)
@@ -10,6 +10,7 @@ def main(config):
     from spynl.api.mongo import plugger as mongo
     from spynl.api.retail import plugger as retail
 
+    from spynl.services.mail import plugger as mail
     from spynl.services.pdf import plugger as pdf
     from spynl.services.pipe import plugger as pipe
     from spynl.services.reports import plugger as reports
@@ -26,3 +27,4 @@ def main(config):
     config.include(upload)
     config.include(reports)
     config.include(pipe)
+    config.include(mail)
@@ -23,6 +23,8 @@ from pyramid.settings import asbool
 
 from spynl.locale import SpynlTranslationString
 
+from spynl.main.dateutils import user_timezone
+from spynl.main.serial import json
 from spynl.main.serial.exceptions import (
     DeserializationUnsupportedException,
     MalformedRequestException,
@@ -31,6 +33,7 @@ from spynl.main.serial.exceptions import (
     UnsupportedContentTypeException,
 )
 from spynl.main.serial.objects import (
+    TypeEncoder,
     add_decode_function,
     add_encode_function,
     decode_date,
@@ -40,6 +43,9 @@ from spynl.main.serial.objects import (
 )
 from spynl.main.serial.typing import handlers, negotiate_response_content_type
 
+# json and csv responses with more rows than this are written in chunks.
+CHUNKED_ROWS = 1000
+
 
 def parse_post_data(request):
     """Parse data according to the requests content type."""
@@ -73,6 +79,21 @@ def renderer(values, system):
         values['status'] = 'ok'
 
     pretty = asbool(r.registry.settings.get('spynl.pretty'))
+    iterdump = handlers.get(r.response.content_type, {}).get('iterdump')
+    if (
+        iterdump is not None
+        and not pretty
+        and isinstance(values.get('data'), list)
+        and len(values['data']) > CHUNKED_ROWS
+    ):
+        # the encoded chunks become the app_iter, so the response is never one
+        # big string next to its utf-8 encoded copy. Nothing is returned, so
+        # pyramid leaves the response as it is.
+        with user_timezone():
+            r.response.app_iter = list(iterdump(values))
+        r.response.content_length = sum(len(chunk) for chunk in r.response.app_iter)
+        return None
+
     try:
         response = dumps(values, r.response.content_type, pretty=pretty)
     except UnsupportedContentTypeException:
@@ -118,6 +139,18 @@ def loads(body, content_type, headers=None, context=None):
     return load(body, headers=headers, context=context)
 
 
+def compile_encoders(event):
+    """
+    Make the encoders once all encode functions are added, so they are not made
+    again for every response.
+    """
+    settings = event.config.registry.settings
+    settings['serial_type_encoder'] = TypeEncoder(
+        settings.get('serial_encode_functions', {})
+    )
+    settings['serial_json_encoders'] = json.make_encoders(settings)
+
+
 def main(config):
     """
     Add our main utility functions to be used in the config,
@@ -127,6 +160,7 @@ def main(config):
     config.add_settings(
         {'spynl.renderer': renderer, 'spynl.post_parser': parse_post_data}
     )
+    config.add_subscriber(compile_encoders, 'spynl.main.ConfigCommited')
     # define decode function for date fields:
     add_decode_function(config, decode_date, ['date'])
     # define encoding functions
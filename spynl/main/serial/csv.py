@@ -8,7 +8,10 @@ list of documents with the same structure and no nested documents.
 
 import csv
 import io
+import math
+from json.encoder import encode_basestring
 
+from spynl.main.dateutils import user_timezone
 from spynl.main.serial import json as spynl_json
 from spynl.main.serial import objects
 from spynl.main.serial.exceptions import MalformedRequestException
@@ -43,36 +46,51 @@ def loads(body, headers=None, context=None):
             quotechar = dialect.quotechar
 
     data = body.split("\n")
+    decoder = objects.SpynlDecoder(context=context)
     dict_data = [
-        objects.SpynlDecoder(context=context)(dic)
+        decoder(dic)
         for dic in csv.DictReader(data, delimiter=delimiter, quotechar=quotechar)
     ]
 
     return {'data': dict_data}
 
 
-class UnicodeStringCSVWriter:
-    """A CSV writer to write rows to a string, which is encoded in UTF-8."""
-
-    def __init__(self, dialect=csv.excel, **kwds):
-        # Redirect output to a queue
-        self.output = io.StringIO()
-        self.writer = csv.writer(self.output, dialect=dialect, **kwds)
-
-    def writerow(self, row):
-        """Write a row."""
-        self.writer.writerow([str(s) for s in row])
-
-    def release(self):
-        """Fetch the UTF-8 output from the `output` and decode it."""
-        data = self.output.getvalue()
-        self.output.truncate(0)  # empty queue
-        return data
-
-    def writerows(self, rows):
-        """Write rows."""
-        for row in rows:
-            self.writerow(row)
+def json_cell_encoder():
+    """
+    Return a function that encodes a value as json, with the functions for the
+    common types looked up by type instead of going through the json encoder.
+    """
+    encode = spynl_json.get_encoder().encode
+    functions = {
+        str: encode_basestring,
+        int: int.__repr__,
+        bool: lambda value: 'true' if value else 'false',
+        float: lambda value: (
+            float.__repr__(value) if math.isfinite(value) else encode(value)
+        ),
+        type(None): lambda value: 'null',
+    }
+
+    def encode_cell(value):
+        return functions.get(type(value), encode)(value)
+
+    return encode_cell
+
+
+def _iter_csv_text(body, chunk_size):
+    data = body['data']
+    keys = list(data[0].keys())
+    encode_cell = json_cell_encoder()
+    with io.StringIO() as output, user_timezone():
+        writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL, quotechar="'")
+        writer.writerow(keys)
+        for doc in data:
+            writer.writerow([encode_cell(doc.get(k, ' ')) for k in keys])
+            if output.tell() >= chunk_size:
+                yield output.getvalue()
+                output.seek(0)
+                output.truncate()
+        yield output.getvalue()
 
 
 def dumps(body, pretty=False):  # pylint: disable=unused-argument
@@ -87,17 +105,19 @@ def dumps(body, pretty=False):  # pylint: disable=unused-argument
     If there is no "data" key, we render the whole response as JSON.
     """
     if body.get('data'):
-        csv_writer = UnicodeStringCSVWriter(quoting=csv.QUOTE_MINIMAL, quotechar="'")
-        json_data = body.get('data')
-        keys = list(json_data[0].keys())
-        csv_writer.writerow(keys)
-        for doc in json_data:
-            row = [spynl_json.dumps(doc.get(k, ' ')) for k in keys]
-            csv_writer.writerow(row)
-        return csv_writer.release()
+        return ''.join(_iter_csv_text(body, math.inf))
     return spynl_json.dumps(body, pretty)
 
 
+def iterdumps(body, pretty=False, chunk_size=spynl_json.CHUNK_SIZE):
+    """Return the csv of dumps as utf-8 encoded chunks of about chunk_size bytes."""
+    if not body.get('data'):
+        yield spynl_json.dumps(body, pretty).encode()
+        return
+    for text in _iter_csv_text(body, chunk_size):
+        yield text.encode()
+
+
 def sniff(body):
     """Not implemented for csv."""
     return False
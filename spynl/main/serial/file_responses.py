@@ -1,6 +1,8 @@
 import csv
 import datetime
 import os
+import shutil
+import zipfile
 from copy import copy
 from io import StringIO
 from tempfile import NamedTemporaryFile
@@ -8,10 +10,31 @@ from tempfile import NamedTemporaryFile
 import pytz
 from marshmallow import fields
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.worksheet.cell_range import CellRange
 from pyramid.response import FileIter
 
 from spynl_schemas import Schema, lookup
 
+from spynl.main.dateutils import get_user_timezone, user_timezone
+from spynl.main.serial.json import get_encoder
+
+# streamed responses are written in chunks of roughly this many characters
+STREAM_CHUNK_SIZE = 64 * 1024
+# csv rows are handed to the csv writer this many at a time
+CSV_BATCH_SIZE = 100
+
+EXCEL_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CELL_FORMATS = {
+    'money': '€ #,##0.00',
+    'quantity': '0',
+    'datetime': 'dd-mm-yy h:mm',
+    'number': '0{}{}',
+    'percentage': '0{}{}%',
+}
+DEFAULT_TIMEZONE = 'Europe/Amsterdam'
+
 METADATA_DESCRIPTION = (
     'A way to describe which labels the pdf should use for the columns, and how to '
     'format the values. Any unapplicable data will be ignored, so there is no need to '
@@ -67,80 +90,148 @@ def export_data(data, header):
     return [[row[k] for k in header] for row in data]
 
 
-def export_excel(header, data, metadata={}, request=None):
-    """Export the data as an excel attachment."""
-    tmp = NamedTemporaryFile()
-    wb = Workbook()
-    ws = wb.active
-
-    # copy style from the first field, because using Font(bold=True) uses different
-    # defaults for font name etc
-    bold = copy(ws['A1'].font)
-    bold.bold = True
-    for i, value in enumerate(header, start=1):
-        ws.cell(
-            row=1, column=i, value=lookup(metadata, f'{value}.label', value)
-        ).font = bold
-
-    # start from 2, 1 is the header row
-    for row_idx, row in enumerate(data, start=2):
-        for column_idx, key in enumerate(header, start=1):
-            value, format_ = format_value(
-                metadata, key, row.get(key, ''), request=request
+def export_excel(header, data, metadata=None, request=None):
+    """
+    Export the data as an excel attachment.
+
+    data can be any iterable of dictionaries, it is consumed lazily. Returns the
+    rewound temporary file the workbook was saved to.
+    """
+    metadata = metadata or {}
+    writer = ExcelWriter()
+    writer.append_labels(header, metadata)
+    formatters = column_formatters(header, metadata, request=request)
+    rows = ([row.get(key, '') for key in header] for row in data)
+    writer.append_rows(rows, formatters)
+    return writer.save()
+
+
+class ExcelWriter:
+    """
+    A workbook of one sheet in openpyxl's write-only mode.
+
+    Rows are written to disk when they are appended instead of being kept in
+    memory as cells until the workbook is saved, so the memory used does not
+    depend on the number of rows.
+    """
+
+    def __init__(self, title=None):
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(title)
+        # Font(bold=True) uses different defaults for font name etc
+        self.bold = copy(DEFAULT_FONT)
+        self.bold.bold = True
+        self.rows = 0
+
+    def cell(self, value, number_format='', font=None):
+        """Only values with a format or font need a cell."""
+        if not number_format and font is None:
+            return value
+        cell = WriteOnlyCell(self.sheet, value=value)
+        if number_format:
+            cell.number_format = number_format
+        if font is not None:
+            cell.font = font
+        return cell
+
+    def append(self, row):
+        """Append a row of values and cells."""
+        self.sheet.append(row)
+        self.rows += 1
+
+    def append_labels(self, header, metadata, offset=0):
+        """Append the labels of the columns in bold."""
+        self.append(
+            [None] * offset
+            + [
+                self.cell(lookup(metadata, f'{key}.label', key), font=self.bold)
+                for key in header
+            ]
+        )
+
+    def append_rows(self, rows, formatters, offset=0):
+        """
+        Append rows of values, formatted with the function of their column (see
+        column_formatters).
+        """
+        padding = [None] * offset
+        cell = self.cell
+        append = self.append
+        for values in rows:
+            append(
+                padding
+                + [cell(*format_(value)) for format_, value in zip(formatters, values)]
             )
-            ws.cell(row=row_idx, column=column_idx, value=value).number_format = format_
 
-    wb.save(tmp.name + '.xlsx')
-    tmp.seek(0)
+    def merge_last_row(self, columns):
+        """Merge the first columns of the last row."""
+        self.sheet.merged_cells.add(
+            CellRange(min_col=1, min_row=self.rows, max_col=columns, max_row=self.rows)
+        )
 
-    if os.getenv('DEBUG'):
-        wb.save('test.xlsx')
+    def save(self):
+        """Save the workbook to a temporary file and return it, rewound."""
+        tmp = NamedTemporaryFile(suffix='.xlsx')
+        self.workbook.save(tmp)
+        tmp.seek(0)
 
-    return tmp
+        if os.getenv('DEBUG'):
+            with open('test.xlsx', 'wb') as file:
+                shutil.copyfileobj(tmp, file)
+            tmp.seek(0)
 
+        return tmp
 
-def format_value(metadata, key, value, request=None):
-    cell_formats = {
-        'money': '€ #,##0.00',
-        'quantity': '0',
-        'datetime': 'dd-mm-yy h:mm',
-        'number': '0{}{}',
-        'percentage': '0{}{}%',
-    }
-    # Excel does not allow tz aware datetimes, so we need to make them naive:
-    if isinstance(value, datetime.datetime):
-        if request:
-            tz = request.cached_user.get('tz', 'Europe/Amsterdam')
-        else:
-            tz = 'Europe/Amsterdam'
-        value = value.astimezone(pytz.timezone(tz))
-        value = value.replace(tzinfo=None)
-        metadata.setdefault(key, {'type': 'datetime'})
-    try:
-        column_metadata = metadata[key]
-        decimals = column_metadata.get('decimals', 2)
-        if (
-            value
-            and column_metadata['type'] == 'percentage'
-            and not isinstance(value, str)
-        ):
+
+def excel_timezone(request=None):
+    if request:
+        return pytz.timezone(request.cached_user.get('tz', DEFAULT_TIMEZONE))
+    return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def column_formatters(header, metadata, request=None):
+    """Return the function that formats the values of each column of the header."""
+    tz = excel_timezone(request)
+    return [column_formatter(metadata.get(key), tz) for key in header]
+
+
+def column_formatter(column_metadata, tz):
+    """
+    Return a function that returns the value to write and its number format for a
+    value of the column.
+
+    The metadata is looked up once for the column instead of for every value.
+    Datetimes are converted to the timezone tz, and get the datetime format if the
+    column has no metadata.
+    """
+    column_metadata = column_metadata or {}
+    decimals = column_metadata.get('decimals', 2)
+    number_format = CELL_FORMATS.get(column_metadata.get('type'), '').format(
+        '.' if decimals else '', '0' * decimals
+    )
+    datetime_format = number_format if column_metadata else CELL_FORMATS['datetime']
+    percentage = column_metadata.get('type') == 'percentage'
+
+    def format_(value):
+        # Excel does not allow tz aware datetimes, so we need to make them naive:
+        if isinstance(value, datetime.datetime):
+            return value.astimezone(tz).replace(tzinfo=None), datetime_format
+        if percentage and value and not isinstance(value, str):
             # Excel wants percentages to be fractions:
             value = value / 100
-        return (
-            value,
-            cell_formats[column_metadata['type']].format(
-                '.' if decimals else '', '0' * decimals
-            ),
-        )
-    except KeyError:
-        return value, ''
+        return value, number_format
+
+    return format_
+
+
+def format_value(metadata, key, value, request=None):
+    """Format a single value, see column_formatter."""
+    return column_formatter(metadata.get(key), excel_timezone(request))(value)
 
 
 def serve_excel_response(response, file, filename):
     response.content_disposition = 'attachment; filename=%s' % filename
-    response.content_type = (
-        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    )
+    response.content_type = EXCEL_CONTENT_TYPE
     response.app_iter = FileIter(file)
     return response
 
@@ -162,6 +253,89 @@ def serve_csv_response(response, data):
     return response
 
 
+def serve_csv(response, header, data, formatters=None):
+    """
+    Serve the data as csv, written while the response is sent (see iter_csv).
+    """
+    response.content_type = 'text/csv'
+    response.app_iter = iter_csv(header, data, formatters=formatters)
+    return response
+
+
+def iter_csv(header, data, formatters=None, **fmtparams):
+    """
+    Export the data as csv, one chunk at a time.
+
+    data can be any iterable of dictionaries, it is consumed lazily. formatters
+    maps columns to a function that makes the value to write of the values of
+    that column that are not None. Other values are written as csv.DictWriter
+    would, missing values and None as an empty string. Yields utf-8 encoded
+    chunks, so the result can be used as an app_iter.
+    """
+    formatters = [
+        (i, formatters[column])
+        for i, column in enumerate(header)
+        if formatters and column in formatters
+    ]
+    with StringIO() as tmp:
+        writer = csv.writer(tmp, **fmtparams)
+        writer.writerow(header)
+        batch = []
+        for row in data:
+            values = list(map(row.get, header))
+            for i, format_ in formatters:
+                if values[i] is not None:
+                    values[i] = format_(values[i])
+            batch.append(values)
+            if len(batch) == CSV_BATCH_SIZE:
+                writer.writerows(batch)
+                batch.clear()
+                if tmp.tell() >= STREAM_CHUNK_SIZE:
+                    yield tmp.getvalue().encode()
+                    tmp.seek(0)
+                    tmp.truncate()
+        writer.writerows(batch)
+        yield tmp.getvalue().encode()
+
+
+def iter_json(data, encoder=None, tz=None, **extra):
+    """
+    Export {'data': data, **extra, 'status': 'ok'} as json, one chunk at a time.
+
+    data can be any iterable, it is consumed lazily. This is the same document
+    the spynl renderer would make of the dictionary. Yields utf-8 encoded chunks, so
+    the result can be used as an app_iter.
+
+    The app_iter is consumed after the request was handled, when the settings and
+    the user are gone. So the JSONEncoder (encoder) and the time zone of the user
+    (tz) are looked up now, if they are not given.
+    """
+    if encoder is None:
+        encoder = get_encoder()
+    if tz is None:
+        tz = get_user_timezone()
+    return _iter_json(data, encoder.encode, tz, extra)
+
+
+def _iter_json(data, encode, tz, extra):
+    chunk = ['{"data": [']
+    size = 0
+    for i, row in enumerate(data):
+        with user_timezone(tz):
+            part = encode(row)
+        chunk.append(', ' + part if i else part)
+        size += len(part)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk).encode()
+            chunk, size = [], 0
+    chunk.append(']')
+    with user_timezone(tz):
+        for key, value in {**extra, 'status': 'ok'}.items():
+            chunk.append(', {}: {}'.format(encode(key), encode(value)))
+    chunk.append('}')
+    yield ''.join(chunk).encode()
+
+
 def make_pdf_file_response(request, file, filename=None):
     """rewind file and set correct headers"""
     # rewind filepointer to start of the file
@@ -172,3 +346,25 @@ def make_pdf_file_response(request, file, filename=None):
         response.content_disposition = 'filename="{}.pdf"'.format(filename)
     response.app_iter = FileIter(file)
     return response
+
+
+def export_zip(files):
+    """
+    Export files, an iterable of (filename, contents) pairs, as a zip file.
+
+    The files are stored without compressing them (pdfs and images already are).
+    Returns the rewound temporary file.
+    """
+    tmp = NamedTemporaryFile(suffix='.zip')
+    with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED) as archive:
+        for filename, contents in files:
+            archive.writestr(filename, contents)
+    tmp.seek(0)
+    return tmp
+
+
+def serve_zip_response(response, file, filename):
+    response.content_disposition = 'attachment; filename=%s' % filename
+    response.content_type = 'application/zip'
+    response.app_iter = FileIter(file)
+    return response
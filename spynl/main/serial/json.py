@@ -4,34 +4,107 @@ import json
 import re
 from decimal import Decimal
 
+from spynl.main.dateutils import user_timezone
 from spynl.main.serial import objects
 from spynl.main.serial.exceptions import MalformedRequestException
+from spynl.main.utils import get_settings
 
 
 def loads(body, context=None, **kwargs):
     """Return body as JSON."""
     try:
         decoder = objects.SpynlDecoder(context)
-        return json.loads(body, object_hook=decoder)
+        return json.loads(body, object_hook=decoder.object_hook)
     except ValueError as err:
         raise MalformedRequestException('application/json', error_cause=str(err))
 
 
+# types the json module can not encode, but that have a json counterpart.
+NATIVE_TYPES = {Decimal: float, set: list}
+CHUNK_SIZE = 64 * 1024
+
+
+class JSONEncoder(json.JSONEncoder):
+    """Custom JSONEncoder to encode the object."""
+
+    def __init__(self, *args, type_encoder=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.type_encoder = type_encoder
+
+    def default(self, obj):  # pylint: disable=method-hidden
+        convert = NATIVE_TYPES.get(type(obj))
+        if convert is not None:
+            return convert(obj)
+        if isinstance(obj, Decimal):
+            return float(obj)
+        if isinstance(obj, set):
+            return list(obj)
+        if self.type_encoder is None:
+            return objects.encode(obj)
+        return self.type_encoder(obj)
+
+
+def make_encoders(settings):
+    """Return a compact and a pretty JSONEncoder for the encode functions."""
+    type_encoder = objects.get_type_encoder(settings)
+    return {
+        pretty: JSONEncoder(
+            indent=4 if pretty else None,
+            ensure_ascii=False,
+            type_encoder=type_encoder,
+        )
+        for pretty in (False, True)
+    }
+
+
+def get_encoder(pretty=False):
+    """
+    Return the JSONEncoder, it is made at config commit (see compile_encoders in
+    spynl.main.serial).
+    """
+    settings = get_settings()
+    encoders = settings.get('serial_json_encoders')
+    if encoders is None:
+        encoders = make_encoders(settings)
+    return encoders[bool(pretty)]
+
+
 def dumps(body, pretty=False):
     """Return JSON body as string."""
-    indent = 4 if pretty else None
+    with user_timezone():
+        return get_encoder(pretty).encode(body)
 
-    class JSONEncoder(json.JSONEncoder):
-        """Custom JSONEncoder to encode the object."""
 
-        def default(self, obj):  # pylint: disable=method-hidden
-            if isinstance(obj, Decimal):
-                return float(obj)
-            if isinstance(obj, set):
-                return list(obj)
-            return objects.encode(obj)
+def iterdumps(body, pretty=False, chunk_size=CHUNK_SIZE):
+    """
+    Return JSON body as utf-8 encoded chunks of about chunk_size bytes.
+
+    The rows of a list under 'data' are encoded one at a time, so the document is
+    never in memory as one string. The chunks together are the same as dumps.
+    """
+    encoder = get_encoder(pretty)
+    if pretty or not isinstance(body, dict):
+        yield encoder.encode(body).encode()
+        return
 
-    return json.dumps(body, indent=indent, ensure_ascii=False, cls=JSONEncoder)
+    encode = encoder.encode
+    chunk, size = ['{'], 0
+    for i, (key, value) in enumerate(body.items()):
+        chunk.append('{}{}: '.format(', ' if i else '', encode(key)))
+        if key != 'data' or not isinstance(value, list):
+            chunk.append(encode(value))
+            continue
+        chunk.append('[')
+        for j, row in enumerate(value):
+            part = encode(row)
+            chunk.append(', ' + part if j else part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(chunk).encode()
+                chunk, size = [], 0
+        chunk.append(']')
+    chunk.append('}')
+    yield ''.join(chunk).encode()
 
 
 def sniff(body):
@@ -4,6 +4,7 @@ Here, we do text/unicode(utf-8) conversions.
 Furthermore, we apply (de)serialisation which plugins can define for object
 types like IDs or dates.
 """
+
 from pyramid import threadlocal
 
 from spynl.locale import SpynlTranslationString as _
@@ -24,9 +25,18 @@ class SpynlDecoder(object):
     decoders for certain fields.
     """
 
-    def __init__(self, context=None):
-        """Enable the decoding functions to be context-aware."""
+    def __init__(self, context=None, decode_functions=None):
+        """
+        Enable the decoding functions to be context-aware.
+
+        The decode functions are looked up once, so a decoder is meant for one
+        request body.
+        """
         self.context = context
+        if decode_functions is None:
+            decode_functions = get_settings().get('serial_decode_functions', {})
+        self.decode_functions = decode_functions
+        self.fields = frozenset(decode_functions)
 
     def __call__(self, dic):
         """
@@ -34,28 +44,103 @@ class SpynlDecoder(object):
         In the setting serial_decode_functions, decoding functions are defined
         for specific fields. We use those functions for those fields.
 
-        In the end, all keys that are still a string, are decoded as unicode.
-
         All the custom decode functions need to get the dic as an argument,
         so they change the dic and not a copy.
         They also get the context of the request.
         """
-        settings = get_settings()
-        decode_functions = settings.get('serial_decode_functions', {})
-        for fieldname in dic:
-            if fieldname in decode_functions:
-                decode_functions[fieldname](
-                    dic, fieldname=fieldname, context=self.context
-                )
+        # most objects do not have any of the fields
+        if self.fields.isdisjoint(dic):
+            return dic
 
-        # All remaining strings: we use unicode internally
-        # & we expect incoming strings to be UTF-8 encoded
-        for k in dic:
-            if isinstance(dic[k], bytes):
-                dic[k] = str(dic[k], errors='strict', encoding='utf-8')
+        for fieldname in dic:
+            function = self.decode_functions.get(fieldname)
+            if function is not None:
+                function(dic, fieldname=fieldname, context=self.context)
 
         return dic
 
+    @property
+    def object_hook(self):
+        """The decoder as object_hook for json.loads, None if there are no fields."""
+        return self if self.fields else None
+
+    def decode(self, value):
+        """
+        Decode all dictionaries in value, inner dictionaries first, like
+        json.loads with this decoder as object_hook would.
+        """
+        if not self.fields:
+            return value
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if isinstance(item, (dict, list)):
+                    self.decode(item)
+            return self(value)
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, (dict, list)):
+                    self.decode(item)
+        return value
+
+
+class TypeEncoder:
+    """
+    (Outgoing) Encodes Python objects to str with the serial_encode_functions.
+
+    The function for an object is looked up by its exact type in a dispatch
+    table. A type that is not in the table yet (a subclass of a registered type,
+    or a type without a function) is resolved once by checking the registered
+    types in the order they were added, like isinstance would, and then added
+    to the table.
+    """
+
+    def __init__(self, encode_functions):
+        self._functions = list(encode_functions.items())
+        # type -> tuple of (position, function) of the matching functions
+        self._dispatch = {}
+        for obj_type in encode_functions:
+            if isinstance(obj_type, type):
+                self._resolve(obj_type)
+
+    def _resolve(self, cls):
+        matches = tuple(
+            (position, function)
+            for position, (obj_type, function) in enumerate(self._functions)
+            if issubclass(cls, obj_type)
+        )
+        self._dispatch[cls] = matches
+        return matches
+
+    def __call__(self, obj):
+        # A function can return an object another function is registered for,
+        # so keep going with the functions that were registered after it.
+        position = -1
+        while True:
+            cls = type(obj)
+            matches = self._dispatch.get(cls)
+            if matches is None:
+                matches = self._resolve(cls)
+            for index, function in matches:
+                if index > position:
+                    obj = function(obj)
+                    position = index
+                    break
+            else:
+                return str(obj)
+
+
+def get_type_encoder(settings=None):
+    """
+    Return the TypeEncoder for the serial_encode_functions, it is made at config
+    commit (see compile_encoders in spynl.main.serial).
+    """
+    if settings is None:
+        settings = get_settings()
+    encoder = settings.get('serial_type_encoder')
+    if encoder is None:
+        encoder = TypeEncoder(settings.get('serial_encode_functions', {}))
+    return encoder
+
 
 def encode(obj):
     """
@@ -64,14 +149,7 @@ def encode(obj):
     In serial_encode_functions, functions are defined for specific object
     types. We use those specific functions to encode those types.
     """
-    # type specific casting:
-    settings = get_settings()
-    encode_functions = settings.get('serial_encode_functions', {})
-    for obj_type in encode_functions:
-        if isinstance(obj, obj_type):
-            obj = encode_functions[obj_type](obj)
-
-    return str(obj)
+    return get_type_encoder()(obj)
 
 
 def add_decode_function(config, function, fields):
@@ -109,7 +187,12 @@ def add_encode_function(config, function, obj_type):
         log.warning('You are replacing the encoding function for type %s', obj_type)
     encode_functions[obj_type] = function
     # line below needed if setting was not initialised before
-    config.add_settings(serial_encode_functions=encode_functions)
+    # (and forget the compiled encoders, they are made again at commit)
+    config.add_settings(
+        serial_encode_functions=encode_functions,
+        serial_type_encoder=None,
+        serial_json_encoders=None,
+    )
 
 
 def decode_date(dic, fieldname, context):
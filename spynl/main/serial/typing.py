@@ -10,9 +10,19 @@ from spynl.main.serial.exceptions import (
 )
 
 handlers = {
-    'application/json': {'dump': json.dumps, 'load': json.loads, 'sniff': json.sniff},
+    'application/json': {
+        'dump': json.dumps,
+        'iterdump': json.iterdumps,
+        'load': json.loads,
+        'sniff': json.sniff,
+    },
     'application/x-yaml': {'dump': yaml.dumps, 'load': yaml.loads, 'sniff': yaml.sniff},
-    'text/csv': {'dump': csv.dumps, 'load': csv.loads, 'sniff': csv.sniff},
+    'text/csv': {
+        'dump': csv.dumps,
+        'iterdump': csv.iterdumps,
+        'load': csv.loads,
+        'sniff': csv.sniff,
+    },
     'text/html': {'dump': html.dumps},
     'text/x-python': {'dump': py.dumps},
 }
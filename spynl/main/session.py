@@ -43,22 +43,17 @@ def main(config):
             if 'sid' in params:
                 sid = params['sid']
 
-        return mksession(sid)
-
-    config.set_session_factory(session_factory)
-
-    def new_response(event):
-        """
-        Make sure new and pristine sessions are saved.
-        Changes to sessions should save them automatically
-        and set session.new to False.
-        """
-        session = event.request.session
-        if session:
-            if hasattr(session, 'new'):
-                if session.new is True:
-                    session.save()
-            else:
+        session = mksession(sid)
+
+        def save_session(request, response):
+            """
+            Save the session once per request. Sessions keep track of their
+            changes, so this writes nothing if the session was only read.
+            """
+            if session:
                 session.save()
 
-    config.add_subscriber(new_response, 'pyramid.events.NewResponse')
+        request.add_response_callback(save_session)
+        return session
+
+    config.set_session_factory(session_factory)
@@ -1,7 +1,9 @@
 """Helper functions for tests to use."""
 
-
 import json
+import socket
+import socketserver
+import threading
 
 
 def post(
@@ -52,3 +54,114 @@ def get(application, path, expect_errors=False, return_headers=False, headers=No
             return rtext
     if return_headers:
         return response.headers
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP for smtplib, see DebuggingSMTPServer."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server.debugging_server
+        with server.lock:
+            server.connections += 1
+            server._open.add(self.connection)
+        try:
+            self.converse(server)
+        except OSError:
+            pass
+        finally:
+            with server.lock:
+                server._open.discard(self.connection)
+
+    def converse(self, server):
+        self.reply('220 localhost debugging SMTP server')
+        sender, recipients = None, []
+        for line in self.rfile:
+            command, _sep, argument = line.decode().strip().partition(' ')
+            command = command.upper()
+            if command == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif command == 'MAIL':
+                sender, recipients = argument.partition(':')[2].strip('<> '), []
+                self.reply('250 OK')
+            elif command == 'RCPT':
+                recipient = argument.partition(':')[2].strip('<> ')
+                code = server.refuse.get(recipient)
+                if code:
+                    self.reply('{} refused'.format(code))
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                with server.lock:
+                    code = server.replies.pop(0) if server.replies else 250
+                    if code == 250:
+                        server.messages.append((sender, recipients, b''.join(lines)))
+                self.reply('{} {}'.format(code, 'OK' if code == 250 else 'failed'))
+            elif command in ('HELO', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class DebuggingSMTPServer:
+    """
+    A local SMTP server that keeps the messages it receives, to use instead of a
+    real mail server in tests:
+
+        with DebuggingSMTPServer() as server:
+            settings['mail.port'] = server.port
+            ...
+        sender, recipients, data = server.messages[0]
+
+    refuse maps recipients to the code to refuse them with, replies are the codes
+    to answer the next messages with (250 if there are none left). connections
+    counts the connections that were made, drop_connections closes them like a
+    server closes idle connections.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.messages = []
+        self.refuse = {}
+        self.replies = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._open = set()
+        self._server = socketserver.ThreadingTCPServer((host, port), _SMTPHandler)
+        self._server.daemon_threads = True
+        self._server.debugging_server = self
+        self.host, self.port = self._server.server_address
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def drop_connections(self):
+        with self.lock:
+            for connection in self._open:
+                connection.shutdown(socket.SHUT_RDWR)
+
+    def stop(self):
+        self.drop_connections()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -1,13 +1,12 @@
 """Helper functions and view derivers for spynl.main."""
 
-
 import contextlib
 import json
 import logging
 import os
 import sys
 import traceback
-from functools import wraps
+from functools import lru_cache, wraps
 from inspect import getfullargspec, isclass
 
 import sentry_sdk
@@ -100,7 +99,6 @@ def validate_locale(locale):
 
 
 def handle_pre_flight_request(endpoint, info):
-
     """
     "pre-flight-request": return custom response with some information on
     what we allow. Used by browsers before they send XMLHttpRequests.
@@ -142,6 +140,51 @@ def handle_pre_flight_request(endpoint, info):
     return wrapper
 
 
+# number of origins whose decision an OriginMatcher keeps
+ORIGIN_CACHE_SIZE = 1024
+
+
+class OriginMatcher:
+    """
+    Decides if requests from an origin are allowed, see is_origin_allowed.
+
+    It is made once from the whitelist settings (see main_includeme). The
+    complete urls of the dev whitelist are kept in a set, and so are its
+    protocols (e.g. "chrome-extension://"), by their scheme. Decisions are kept
+    in an LRU cache, so checking an origin that was seen before does not
+    resolve its top-level domain again.
+    """
+
+    def __init__(self, dev_whitelist='', tld_whitelist='', cache_size=None):
+        dev_whitelist = [url for url in parse_csv_list(dev_whitelist) if url]
+        self.urls = frozenset(url for url in dev_whitelist if not url.endswith('://'))
+        self.protocols = frozenset(
+            url[: -len('://')] for url in dev_whitelist if url.endswith('://')
+        )
+        self.tlds = frozenset(tld for tld in parse_csv_list(tld_whitelist) if tld)
+        self.allowed = lru_cache(maxsize=cache_size or ORIGIN_CACHE_SIZE)(self._allowed)
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('spynl.dev_origin_whitelist', ''),
+            settings.get('spynl.tld_origin_whitelist', ''),
+        )
+
+    def _allowed(self, origin):
+        if origin in self.urls:
+            return True
+        # a protocol ends with the first ://
+        protocol, separator, _rest = origin.partition('://')
+        if separator and protocol in self.protocols:
+            return True
+        try:
+            tld = get_tld(origin)
+        except (TldBadUrl, TldDomainNotFound):
+            tld = origin  # dev domains like e.g. 0.0.0.0:9000 will fall here
+        return tld in self.tlds
+
+
 def is_origin_allowed(origin):
     """
     Check request origin for matching our whitelists.
@@ -155,22 +198,11 @@ def is_origin_allowed(origin):
         return True
 
     settings = get_settings()
-    dev_whitelist = parse_csv_list(settings.get('spynl.dev_origin_whitelist', ''))
-    dev_list_urls = [url for url in dev_whitelist if not url.endswith('://')]
-    origin_allowed = origin in dev_list_urls
-    dev_list_protocols = [url for url in dev_whitelist if url.endswith('://')]
-    for protocol in dev_list_protocols:
-        if origin.startswith(protocol):
-            origin_allowed = True
-    if not origin_allowed:
-        try:
-            tld = get_tld(origin)
-        except (TldBadUrl, TldDomainNotFound):
-            tld = origin  # dev domains like e.g. 0.0.0.0:9000 will fall here
-        tld_whitelist = parse_csv_list(settings.get('spynl.tld_origin_whitelist', ''))
-        if tld in tld_whitelist:
-            origin_allowed = True
-    return origin_allowed
+    matcher = settings.get('spynl.origin_matcher')
+    if matcher is None:
+        # the configuration did not make one (e.g. in tests)
+        matcher = OriginMatcher.from_settings(settings)
+    return matcher.allowed(origin)
 
 
 def get_header_args(request):
@@ -223,18 +255,13 @@ def unify_args(request):
     # get POST data
     args.update(get_parsed_body(request))
     # get GET args, can be written in JSON style
-    # args.update(urlson.loads_dict(request.GET))
     # TODO: needs some refactoring - maybe urlson can actually do this parsing
     # for us. We don't know the context yet.
     from spynl.main.serial import objects
 
     context = hasattr(request, 'context') and request.context or None
-    args.update(
-        json.loads(
-            json.dumps(urlson.loads_dict(request.GET)),
-            object_hook=objects.SpynlDecoder(context=context),
-        )
-    )
+    decoder = objects.SpynlDecoder(context=context)
+    args.update(decoder.decode(urlson.loads_dict(request.GET)))
 
     request.endpoint_method = find_view_name(request)
 
@@ -0,0 +1,8 @@
+"""
+A queue of jobs that are run in the background by a worker process.
+
+Endpoints that take too long to handle within the request (rendering and sending
+large reports for example) add a job to the queue and return its id. The worker
+(spynl-cli services worker) runs the jobs, and the job-status and job-download
+endpoints tell the user if the job is done and serve the file it made.
+"""
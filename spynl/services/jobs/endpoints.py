@@ -0,0 +1,110 @@
+"""Endpoints to follow the jobs of the job queue."""
+
+from bson import ObjectId
+from gridfs import GridFS
+from pyramid.response import FileIter
+
+from spynl.main.dateutils import date_to_str
+
+from spynl.services.jobs.exceptions import JobNotFinished, JobNotFound
+from spynl.services.jobs.queue import COLLECTION, DONE, FILES_COLLECTION
+
+
+def _get_job(request):
+    job_id = request.args.get('jobId')
+    if not ObjectId.is_valid(job_id):
+        raise JobNotFound(job_id)
+    # users only get to see their own jobs
+    job = request.pymongo_db[COLLECTION].find_one(
+        {
+            '_id': ObjectId(job_id),
+            'tenant_id': request.requested_tenant_id,
+            'user_id': request.cached_user['_id'],
+        }
+    )
+    if job is None:
+        raise JobNotFound(job_id)
+    return job
+
+
+def job_status(ctx, request):
+    """
+    The status of a job.
+
+    ---
+    get:
+      tags:
+        - services
+      description: >
+        Returns the status of a job that was added by an endpoint that does its
+        work in the background (for example article-status-email).
+        \n
+        Located in spynl-services.
+
+        ### Parameters
+
+        Parameter | Type   | Req.     | Description\n
+        --------- | ------ | -------- | -----------\n
+        jobId     | string | &#10004; | The id the endpoint returned.\n
+
+        ### Response
+
+        JSON keys | Type | Description\n
+        --------- | ------------ | -----------\n
+        status    | string | 'ok' or 'error'\n
+        data      | object | jobId, type, status ('queued', 'running', 'done'
+        or 'failed'), created, finished, error (if the job failed) and filename
+        (if the job made a file, see job-download).\n
+    """
+    job = _get_job(request)
+    data = {
+        'jobId': str(job['_id']),
+        'type': job['type'],
+        'status': job['status'],
+        'created': date_to_str(job['created']),
+    }
+    if job.get('finished'):
+        data['finished'] = date_to_str(job['finished'])
+    for key in ('error', 'filename'):
+        if job.get(key):
+            data[key] = job[key]
+    return {'data': data}
+
+
+def job_download(ctx, request):
+    """
+    Download the file a job made.
+
+    ---
+    get:
+      tags:
+        - services
+      description: >
+        Download the file a job made, when its status (see job-status) is done.
+        \n
+        Located in spynl-services.
+
+        ### Parameters
+
+        Parameter | Type   | Req.     | Description\n
+        --------- | ------ | -------- | -----------\n
+        jobId     | string | &#10004; | The id the endpoint returned.\n
+      produces:
+        - application/octet-stream
+      responses:
+        200:
+          description: The file the job made.
+          schema:
+            type: file
+    """
+    job = _get_job(request)
+    if job['status'] != DONE or not job.get('file_id'):
+        raise JobNotFinished(job['status'])
+
+    file = GridFS(request.pymongo_db, collection=FILES_COLLECTION).get(job['file_id'])
+    response = request.response
+    response.content_type = file.content_type
+    response.content_disposition = 'attachment; filename="{}"'.format(file.filename)
+    response.content_length = file.length
+    response.app_iter = FileIter(file)
+    return response
@@ -0,0 +1,27 @@
+"""Exceptions for spynl.services.jobs."""
+
+from pyramid.httpexceptions import HTTPNotFound
+
+from spynl.locale import SpynlTranslationString as _
+
+from spynl.main.exceptions import SpynlException
+
+
+class JobNotFound(SpynlException):
+    """The job does not exist, or belongs to another user."""
+
+    http_escalate_as = HTTPNotFound
+
+    def __init__(self, job_id):
+        message = _('job-not-found', mapping={'job_id': job_id})
+        super().__init__(message=message)
+
+
+class JobNotFinished(SpynlException):
+    """The job has not made its file (yet)."""
+
+    monitor = False
+
+    def __init__(self, status):
+        message = _('job-not-finished', mapping={'status': status})
+        super().__init__(message=message)
@@ -0,0 +1,235 @@
+"""
+The job queue, a mongo collection of jobs, and the worker that runs them.
+
+A job goes from queued to running to done or failed. A worker claims the oldest
+queued job with find_one_and_update, so several workers can run next to each
+other. While a job runs, the worker renews its lease every lease / 3 seconds. A
+job that was not renewed for `lease` seconds belongs to a worker that died, and
+can be claimed again, at most `max_attempts` times. Only the worker that claimed
+the job last can mark it as done or failed.
+
+A failed job is only queued again if the error is temporary (an instance of one
+of TEMPORARY_ERRORS), any other error would fail again.
+
+Job types are added to JOB_HANDLERS by the plugins (see reports/plugger.py). A
+handler is called with a request for the tenant and user that added the job, and
+returns an Attachment (the file the job made) or None. Plugins add the exceptions
+their handlers raise for temporary failures to TEMPORARY_ERRORS.
+"""
+
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from gridfs import GridFS
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import ConnectionFailure
+from pyramid.request import Request
+from pyramid.scripting import prepare
+from pyramid.settings import asbool
+
+from spynl.main.dateutils import now
+from spynl.main.utils import get_logger
+
+COLLECTION = 'jobs'
+FILES_COLLECTION = 'job_files'
+
+# job type -> handler(request, job)
+JOB_HANDLERS = {}
+
+# errors after which a job is queued again
+TEMPORARY_ERRORS = {
+    ConnectionError,
+    TimeoutError,
+    ConnectionFailure,
+    smtplib.SMTPConnectError,
+    smtplib.SMTPServerDisconnected,
+}
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+logger = get_logger(__name__)
+
+
+def jobs_enabled(request):
+    """Return True if endpoints should add jobs instead of doing the work."""
+    return asbool(request.registry.settings.get('spynl.jobs.enabled', False))
+
+
+def enqueue(request, job_type, payload=None):
+    """Add a job for the tenant and user of the request and return its id."""
+    job = {
+        'type': job_type,
+        'status': QUEUED,
+        'payload': request.json_payload if payload is None else payload,
+        'tenant_id': request.requested_tenant_id,
+        'user_id': request.cached_user['_id'],
+        'locale': getattr(request, '_LOCALE_', 'en'),
+        'attempts': 0,
+        'created': now(),
+    }
+    return request.pymongo_db[COLLECTION].insert_one(job).inserted_id
+
+
+def ensure_indexes(db):
+    db[COLLECTION].create_index([('status', ASCENDING), ('created', ASCENDING)])
+    db[COLLECTION].create_index([('finished', ASCENDING)])
+
+
+def claim(db, lease=600, max_attempts=3):
+    """Mark the oldest job that can be run as running and return it."""
+    started = now()
+    return db[COLLECTION].find_one_and_update(
+        {
+            '$or': [
+                {'status': QUEUED},
+                {
+                    'status': RUNNING,
+                    'started': {'$lt': started - timedelta(seconds=lease)},
+                },
+            ],
+            'attempts': {'$lt': max_attempts},
+        },
+        {'$set': {'status': RUNNING, 'started': started}, '$inc': {'attempts': 1}},
+        sort=[('created', ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _claimed(job):
+    """Match the job only if nobody claimed it after us."""
+    return {'_id': job['_id'], 'status': RUNNING, 'attempts': job['attempts']}
+
+
+@contextmanager
+def keep_lease(db, job, lease=600):
+    """Renew the lease of the job until the block is done."""
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(lease / 3):
+            db[COLLECTION].update_one(_claimed(job), {'$set': {'started': now()}})
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def finish(db, job, attachment=None):
+    """Mark the job as done and store the file it made."""
+    update = {'status': DONE, 'finished': now()}
+    files = GridFS(db, collection=FILES_COLLECTION)
+    if attachment is not None:
+        data = attachment.data
+        if hasattr(data, 'read'):
+            data.seek(0)
+            data = data.read()
+        update['file_id'] = files.put(
+            data,
+            filename=attachment.filename,
+            content_type=attachment.content_type,
+            job_id=job['_id'],
+        )
+        update['filename'] = attachment.filename
+    result = db[COLLECTION].update_one(_claimed(job), {'$set': update})
+    if not result.matched_count and 'file_id' in update:
+        # another worker claimed the job, its file is the one that is kept
+        files.delete(update['file_id'])
+
+
+def is_temporary(error):
+    return isinstance(error, tuple(TEMPORARY_ERRORS))
+
+
+def fail(db, job, error, max_attempts=3):
+    """
+    Queue the job again if the error is temporary and it was not tried
+    max_attempts times already, fail it otherwise.
+    """
+    if is_temporary(error) and job['attempts'] < max_attempts:
+        update = {'status': QUEUED, 'error': str(error)}
+    else:
+        update = {'status': FAILED, 'finished': now(), 'error': str(error)}
+    db[COLLECTION].update_one(_claimed(job), {'$set': update})
+
+
+def cleanup(db, keep=7 * 24 * 3600, lease=600, max_attempts=3):
+    """
+    Fail jobs that ran out of attempts and remove jobs (and their files) that
+    finished more than keep seconds ago.
+    """
+    db[COLLECTION].update_many(
+        {
+            'status': RUNNING,
+            'started': {'$lt': now() - timedelta(seconds=lease)},
+            'attempts': {'$gte': max_attempts},
+        },
+        {'$set': {'status': FAILED, 'finished': now(), 'error': 'timeout'}},
+    )
+    files = GridFS(db, collection=FILES_COLLECTION)
+    query = {'finished': {'$lt': now() - timedelta(seconds=keep)}}
+    for job in db[COLLECTION].find(query, {'file_id': 1}):
+        if job.get('file_id'):
+            files.delete(job['file_id'])
+    db[COLLECTION].delete_many(query)
+
+
+def run_job(registry, job):
+    """
+    Call the handler of the job with a request for the tenant and user that added
+    the job.
+    """
+    handler = JOB_HANDLERS[job['type']]
+    db = registry.settings['spynl.mongo.db']
+    with prepare(request=Request.blank('/'), registry=registry) as env:
+        request = env['request']
+        request._LOCALE_ = job['locale']
+        request.context = None
+        request.matchdict = {'tenant_id': job['tenant_id']}
+        request.cached_user = db.users.find_one({'_id': job['user_id']})
+        request.json_payload = job['payload']
+        return handler(request, job)
+
+
+def work(registry, poll_interval=2, burst=False):
+    """
+    Run jobs until stopped. With burst the worker stops when there are no jobs.
+    """
+    settings = registry.settings
+    db = settings['spynl.mongo.db']
+    lease = int(settings.get('spynl.jobs.lease', 600))
+    max_attempts = int(settings.get('spynl.jobs.max_attempts', 3))
+    keep = int(settings.get('spynl.jobs.keep', 7 * 24 * 3600))
+
+    ensure_indexes(db)
+    cleaned = None
+    while True:
+        if cleaned is None or time.monotonic() - cleaned > lease:
+            cleanup(db, keep=keep, lease=lease, max_attempts=max_attempts)
+            cleaned = time.monotonic()
+
+        job = claim(db, lease=lease, max_attempts=max_attempts)
+        if job is None:
+            if burst:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        logger.info('Running job %s (%s)', job['_id'], job['type'])
+        try:
+            with keep_lease(db, job, lease=lease):
+                attachment = run_job(registry, job)
+        except Exception as e:
+            logger.exception('Job %s failed', job['_id'])
+            fail(db, job, e, max_attempts=max_attempts)
+        else:
+            finish(db, job, attachment)
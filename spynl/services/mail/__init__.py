@@ -0,0 +1,7 @@
+"""
+The mail outbox, mail that is sent in the background by a worker process.
+
+Connecting to the mail server within the request makes the request as slow as
+the mail server. With spynl.mail.outbox set, mail is added to the outbox and the
+worker (spynl-cli services mail-worker) sends it, see outbox.py.
+"""
@@ -0,0 +1,407 @@
+"""
+The mail outbox, a mongo collection of messages that a worker sends.
+
+When spynl.mail.outbox is set, the mail plugin registers an OutboxMailer as the
+mailer (see plugger.py), so _sendmail (see spynl.main.mail) adds a message to
+the outbox instead of connecting to the mail server within the request. The
+worker (spynl-cli services mail-worker) claims a batch of messages at a time and
+sends them over a pool of SMTP connections that stay open between messages.
+
+A message goes from queued to sending to sent or failed. A message that could
+not be sent because of a temporary error (the connection dropped, the server
+answered with a 4xx code) is queued again, after a delay that doubles with every
+attempt. A permanent error (a 5xx code) or running out of attempts fails it. The
+outbox keeps the status, the number of attempts and the last error of every
+message for `keep` seconds after it was sent or failed.
+"""
+
+import queue
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from email.utils import formatdate, make_msgid
+from functools import partial
+from uuid import uuid4
+
+from bson import Binary
+from gridfs import GridFS
+from pymongo import ASCENDING
+from pyramid.settings import asbool
+from repoze.sendmail.encoding import encode_message
+
+from spynl.main.dateutils import now
+from spynl.main.utils import get_logger
+
+COLLECTION = 'mail_outbox'
+FILES_COLLECTION = 'mail_outbox_files'
+# messages that are larger (attachments) are stored in gridfs
+MAX_INLINE_SIZE = 8 * 1024 * 1024
+# the delay before a retry doubles with every attempt, up to this many seconds
+MAX_RETRY_DELAY = 3600
+
+QUEUED = 'queued'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+logger = get_logger(__name__)
+
+
+def outbox_enabled(settings):
+    """Return True if mail should be added to the outbox instead of sent."""
+    return asbool(settings.get('spynl.mail.outbox', False))
+
+
+def enqueue(db, message):
+    """Add a (validated) pyramid_mailer Message to the outbox and return its id."""
+    mime = message.to_message()
+    # set these now, so every attempt sends the same message
+    mime['Date'] = formatdate()
+    mime['Message-Id'] = make_msgid('spynl')
+    data = encode_message(mime)
+
+    document = {
+        'status': QUEUED,
+        'sender': message.sender,
+        'recipients': sorted(message.send_to),
+        'subject': message.subject,
+        'message_id': mime['Message-Id'],
+        'attempts': 0,
+        'created': now(),
+        'next_attempt': now(),
+    }
+    if len(data) > MAX_INLINE_SIZE:
+        document['file_id'] = GridFS(db, collection=FILES_COLLECTION).put(data)
+    else:
+        document['data'] = Binary(data)
+    return db[COLLECTION].insert_one(document).inserted_id
+
+
+class OutboxMailer:
+    """A pyramid_mailer mailer that adds the messages to the outbox."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def send_immediately(self, message, fail_silently=False):
+        message.validate()
+        enqueue(self.db, message)
+
+    send = send_immediately
+
+    def bind(self, **kwargs):
+        return self
+
+
+def ensure_indexes(db):
+    db[COLLECTION].create_index([('status', ASCENDING), ('next_attempt', ASCENDING)])
+    db[COLLECTION].create_index([('finished', ASCENDING)])
+
+
+def claim(db, worker_id, batch_size=50, lease=300, max_attempts=5):
+    """
+    Mark at most batch_size messages that are due as sending and return them.
+    Messages that are sending for more than lease seconds belong to a worker that
+    died, and are claimed again if they have attempts left.
+    """
+    claimed = now()
+    due = {
+        '$or': [
+            {'status': QUEUED, 'next_attempt': {'$lte': claimed}},
+            {
+                'status': SENDING,
+                'claimed': {'$lt': claimed - timedelta(seconds=lease)},
+                'attempts': {'$lt': max_attempts},
+            },
+        ]
+    }
+    ids = [
+        message['_id']
+        for message in db[COLLECTION].find(
+            due, {'_id': 1}, sort=[('next_attempt', ASCENDING)], limit=batch_size
+        )
+    ]
+    if not ids:
+        return []
+    # another worker can claim some of these in between, the worker_id tells
+    # which ones are ours
+    db[COLLECTION].update_many(
+        {'_id': {'$in': ids}, **due},
+        {
+            '$set': {'status': SENDING, 'claimed': claimed, 'worker': worker_id},
+            '$inc': {'attempts': 1},
+        },
+    )
+    return list(
+        db[COLLECTION].find(
+            {'_id': {'$in': ids}, 'status': SENDING, 'worker': worker_id}
+        )
+    )
+
+
+def is_temporary(error):
+    """Return True if sending the message again later can succeed."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _msg in error.recipients.values())
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        # the settings are wrong, which is not the fault of the message
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    # other SMTPExceptions are OSErrors too, but are about the message
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def retry_delay(attempts, delay=60):
+    """Seconds to wait before the next attempt, doubling with every attempt."""
+    return min(delay * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+
+
+def _response(code, response):
+    if isinstance(response, bytes):
+        response = response.decode(errors='replace')
+    return '{} {}'.format(code, response)
+
+
+def finish(db, message, refused=None):
+    """Mark the message as sent, refused are the recipients the server refused."""
+    update = {'status': SENT, 'finished': now()}
+    if refused:
+        update['refused'] = [
+            {'recipient': recipient, 'error': _response(code, response)}
+            for recipient, (code, response) in refused.items()
+        ]
+    db[COLLECTION].update_one(
+        {'_id': message['_id']}, {'$set': update, '$unset': {'worker': ''}}
+    )
+
+
+def fail(db, message, error, max_attempts=5, delay=60):
+    """
+    Queue the message again after a delay, unless the error is permanent or the
+    message was tried max_attempts times already.
+    """
+    if is_temporary(error) and message['attempts'] < max_attempts:
+        next_attempt = now() + timedelta(
+            seconds=retry_delay(message['attempts'], delay)
+        )
+        update = {'status': QUEUED, 'next_attempt': next_attempt, 'error': str(error)}
+    else:
+        update = {'status': FAILED, 'finished': now(), 'error': str(error)}
+    db[COLLECTION].update_one(
+        {'_id': message['_id']}, {'$set': update, '$unset': {'worker': ''}}
+    )
+
+
+def cleanup(db, keep=7 * 24 * 3600, lease=300, max_attempts=5):
+    """
+    Fail messages that ran out of attempts and remove messages (and their files)
+    that were sent or failed more than keep seconds ago.
+    """
+    db[COLLECTION].update_many(
+        {
+            'status': SENDING,
+            'claimed': {'$lt': now() - timedelta(seconds=lease)},
+            'attempts': {'$gte': max_attempts},
+        },
+        {'$set': {'status': FAILED, 'finished': now(), 'error': 'timeout'}},
+    )
+    query = {'finished': {'$lt': now() - timedelta(seconds=keep)}}
+    query_files = {**query, 'file_id': {'$exists': True}}
+    for message in db[COLLECTION].find(query_files, {'file_id': 1}):
+        GridFS(db, collection=FILES_COLLECTION).delete(message['file_id'])
+    db[COLLECTION].delete_many(query)
+
+
+def message_data(db, message):
+    """Return the message as bytes, as it is sent to the mail server."""
+    if message.get('file_id'):
+        return GridFS(db, collection=FILES_COLLECTION).get(message['file_id']).read()
+    return bytes(message['data'])
+
+
+class SMTPPool:
+    """
+    Thread-safe pool of open connections to the mail server, there are as many
+    connections as threads that send at the same time.
+
+    A connection is reused for the next message, unless it was idle for more than
+    max_idle seconds (servers close idle connections). A reused connection that
+    turns out to be closed is replaced once, a connection that failed in another
+    way is closed.
+    """
+
+    def __init__(
+        self,
+        host='localhost',
+        port=25,
+        username=None,
+        password=None,
+        ssl=False,
+        tls=False,
+        timeout=30,
+        max_idle=60,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.ssl = ssl
+        self.tls = tls
+        self.timeout = timeout
+        self.max_idle = max_idle
+        # (connection, time it was last used)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.sent = 0
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Use the settings of pyramid_mailer (mail.host etc.)."""
+        return cls(
+            host=settings.get('mail.host', 'localhost'),
+            port=int(settings.get('mail.port', 25)),
+            username=settings.get('mail.username') or None,
+            password=settings.get('mail.password') or None,
+            ssl=asbool(settings.get('mail.ssl', False)),
+            tls=asbool(settings.get('mail.tls', False)),
+        )
+
+    def sendmail(self, sender, recipients, data):
+        """Send the message, return the recipients that were refused."""
+        smtp, reused = self._acquire()
+        try:
+            refused = self._send(smtp, sender, recipients, data)
+        except smtplib.SMTPServerDisconnected:
+            if not reused:
+                raise
+            # the server closed the connection while it was idle
+            refused = self._send(self._connect(), sender, recipients, data)
+        with self._lock:
+            self.sent += 1
+        return refused
+
+    def _acquire(self):
+        """Return an open connection and if it was used before."""
+        while True:
+            try:
+                smtp, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(), False
+            if time.monotonic() - last_used <= self.max_idle:
+                return smtp, True
+            self._close(smtp)
+
+    def _send(self, smtp, sender, recipients, data):
+        try:
+            refused = smtp.sendmail(sender, recipients, data)
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+            # the server refused the message, the connection can be used again
+            self._idle.put((smtp, time.monotonic()))
+            raise
+        except BaseException:
+            self._close(smtp)
+            raise
+        self._idle.put((smtp, time.monotonic()))
+        return refused
+
+    def _connect(self):
+        if self.ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        smtp.ehlo()
+        if self.tls:
+            smtp.starttls()
+            smtp.ehlo()
+        if self.username and self.password:
+            smtp.login(self.username, self.password)
+        with self._lock:
+            self.connects += 1
+        return smtp
+
+    @staticmethod
+    def _close(smtp):
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            smtp.close()
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                smtp, _last_used = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(smtp)
+
+
+def deliver(db, pool, message, max_attempts=5, delay=60):
+    """Send a claimed message and record the result."""
+    try:
+        refused = pool.sendmail(
+            message['sender'], message['recipients'], message_data(db, message)
+        )
+    except Exception as e:
+        logger.warning(
+            'Sending email %s (attempt %s) failed: %s',
+            message['_id'],
+            message['attempts'],
+            e,
+        )
+        fail(db, message, e, max_attempts=max_attempts, delay=delay)
+        return False
+    finish(db, message, refused)
+    logger.info(
+        'Sent email titled "%s" to %s', message['subject'], message['recipients']
+    )
+    return True
+
+
+def work(registry, poll_interval=2, burst=False):
+    """
+    Send the messages of the outbox until stopped. With burst the worker stops
+    when there are no messages to send.
+    """
+    settings = registry.settings
+    db = settings['spynl.mongo.db']
+    connections = int(settings.get('spynl.mail.connections', 2))
+    batch_size = int(settings.get('spynl.mail.batch_size', 50))
+    max_attempts = int(settings.get('spynl.mail.max_attempts', 5))
+    delay = int(settings.get('spynl.mail.retry_delay', 60))
+    keep = int(settings.get('spynl.mail.keep', 7 * 24 * 3600))
+    lease = 300
+
+    worker_id = uuid4().hex
+    pool = SMTPPool.from_settings(settings)
+    send = partial(deliver, db, pool, max_attempts=max_attempts, delay=delay)
+    ensure_indexes(db)
+    cleaned = None
+    try:
+        with ThreadPoolExecutor(connections) as executor:
+            while True:
+                if cleaned is None or time.monotonic() - cleaned > lease:
+                    cleanup(db, keep=keep, lease=lease, max_attempts=max_attempts)
+                    cleaned = time.monotonic()
+
+                messages = claim(
+                    db,
+                    worker_id,
+                    batch_size=batch_size,
+                    lease=lease,
+                    max_attempts=max_attempts,
+                )
+                if not messages:
+                    if burst:
+                        return
+                    time.sleep(poll_interval)
+                    continue
+                list(executor.map(send, messages))
+    finally:
+        pool.close()
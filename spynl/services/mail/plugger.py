@@ -0,0 +1,18 @@
+"""
+plugger.py is used by spynl Plugins to say
+which endpoints and resources it will use.
+"""
+
+from pyramid_mailer.interfaces import IMailer
+
+from spynl.services.mail.outbox import OutboxMailer, outbox_enabled
+
+
+def includeme(config):
+    """Add the mail to the outbox instead of sending it, if it is enabled."""
+    settings = config.get_settings()
+    if outbox_enabled(settings):
+        # _sendmail uses the mailer of the registry, unless it is given one
+        config.registry.registerUtility(
+            OutboxMailer(settings['spynl.mongo.db']), IMailer
+        )
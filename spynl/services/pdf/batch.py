@@ -0,0 +1,215 @@
+"""
+Endpoints that make the pdfs of many documents in one request.
+
+The tenant and its settings are looked up once for all documents, the pdfs are
+rendered by the pdf pool (see pool.py), whose workers keep the stylesheets
+parsed. A batch is returned as one pdf with the pages of all documents, or as a
+zip file with a pdf per document. The pdfs of a zip file are rendered in
+parallel, by as many workers as the pool has.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from marshmallow import fields, validate
+
+from spynl_schemas import ObjectIdField, SaleSchema, Schema
+
+from spynl.locale import SpynlTranslationString as _
+
+from spynl.main.exceptions import SpynlException
+from spynl.main.serial.file_responses import (
+    export_zip,
+    make_pdf_file_response,
+    serve_zip_response,
+)
+
+from spynl.api.auth.utils import lookup_tenant
+
+from spynl.services.pdf.endpoints import SalesReceiptOptionsSchema
+from spynl.services.pdf.pdf import (
+    generate_merged_pdf,
+    generate_packing_list_html_css,
+    generate_pdf,
+    generate_receipt_html_css,
+    get_image_location,
+)
+from spynl.services.pdf.pool import PDF_POOL
+
+MAX_BATCH_SIZE = 200
+
+
+class BatchFormatSchema(Schema):
+    format = fields.String(
+        load_default='pdf',
+        validate=validate.OneOf(['pdf', 'zip']),
+        metadata={
+            'description': "'pdf' for one pdf with the pages of all documents, "
+            "'zip' for a zip file with a pdf per document."
+        },
+    )
+
+
+class PackingListBatchSchema(BatchFormatSchema):
+    _ids = fields.List(
+        fields.UUID(),
+        required=True,
+        validate=validate.Length(min=1, max=MAX_BATCH_SIZE),
+        metadata={'description': 'The _ids of the packing lists.'},
+    )
+
+
+class SalesReceiptBatchSchema(BatchFormatSchema, SalesReceiptOptionsSchema):
+    _ids = fields.List(
+        ObjectIdField(),
+        required=True,
+        validate=validate.Length(min=1, max=MAX_BATCH_SIZE),
+        metadata={
+            'description': 'The objectIds of the sales or consignment transactions.'
+        },
+    )
+
+
+def _find_documents(request, ctx, ids, query):
+    """Return the documents in the order of the ids, all of them must exist."""
+    ids = list(dict.fromkeys(ids))
+    documents = {
+        document['_id']: document
+        for document in request.db[ctx].find(
+            {'_id': {'$in': ids}, 'tenant_id': request.requested_tenant_id, **query}
+        )
+    }
+    missing = [str(_id) for _id in ids if _id not in documents]
+    if missing:
+        raise SpynlException(
+            message=_('document-does-not-exist'),
+            developer_message='These documents do not exist: {}'.format(
+                ', '.join(missing)
+            ),
+        )
+    return [documents[_id] for _id in ids]
+
+
+def _unique_filenames(filenames):
+    """Number filenames that occur more than once: order.pdf, order-2.pdf"""
+    seen = {}
+    for filename in filenames:
+        count = seen[filename] = seen.get(filename, 0) + 1
+        if count > 1:
+            name, _sep, extension = filename.rpartition('.')
+            filename = '{}-{}.{}'.format(name, count, extension)
+        yield filename
+
+
+def _serve_batch(request, documents, format, name):
+    """documents is a list of (filename, html, css) tuples."""
+    if format == 'pdf':
+        result = generate_merged_pdf(
+            [(html, css) for _filename, html, css in documents]
+        )
+        return make_pdf_file_response(request, result, name)
+
+    def render(document):
+        _filename, html, css = document
+        return generate_pdf(html, css).getvalue()
+
+    with ThreadPoolExecutor(max(PDF_POOL.processes, 1)) as executor:
+        pdfs = executor.map(render, documents)
+        filenames = _unique_filenames(document[0] for document in documents)
+        file = export_zip(zip(filenames, pdfs))
+    return serve_zip_response(request.response, file, name + '.zip')
+
+
+def download_packing_lists_batch(ctx, request):
+    """
+    Returns the pdfs of several packing lists for downloading.
+
+    ---
+    post:
+      tags:
+        - services
+      description: >
+        Generate the pdfs of several packing lists (at most 200), as one pdf or
+        as a zip file with a pdf per packing list.
+        \n
+        Located in spynl-services.
+      parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            $ref: download_packing_lists_batch.json#/definitions/PackingListBatchSchema
+      produces:
+        - application/pdf
+        - application/zip
+      responses:
+        200:
+          description: A pdf or zip file of the packing lists.
+          schema:
+            type: file
+    """
+    parameters = PackingListBatchSchema().load(request.json_payload)
+    orders = _find_documents(request, ctx, parameters['_ids'], {'type': 'packing-list'})
+
+    customers = {
+        customer['_id']: customer
+        for customer in request.pymongo_db.wholesale_customers.find(
+            {'_id': {'$in': list({order['customer']['_id'] for order in orders})}},
+            {'employee': 1},
+        )
+    }
+    tenant_settings = request.db.tenants.find_one(
+        {'_id': request.requested_tenant_id}, {'settings': 1}
+    ).get('settings', {})
+    image_location = get_image_location(tenant_settings, sales=True)
+
+    documents = []
+    for order in orders:
+        customer = customers.get(order['customer']['_id'], {})
+        order['customer']['employee'] = customer.get('employee', False)
+        html, css = generate_packing_list_html_css(request, order, image_location)
+        documents.append(('{}.pdf'.format(order['orderNumber']), html, css))
+
+    return _serve_batch(request, documents, parameters['format'], 'packing-lists')
+
+
+def download_sales_receipts_batch(ctx, request):
+    """
+    Returns the pdfs of several sales receipts for downloading.
+
+    ---
+    post:
+      tags:
+        - services
+      description: >
+        Generate the pdfs of several sales receipts (at most 200), as one pdf or
+        as a zip file with a pdf per receipt.
+        \n
+        Located in spynl-services.
+      parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            $ref: download_receipts_batch.json#/definitions/SalesReceiptBatchSchema
+      produces:
+        - application/pdf
+        - application/zip
+      responses:
+        200:
+          description: A pdf or zip file of the sales receipts.
+          schema:
+            type: file
+    """
+    parameters = SalesReceiptBatchSchema().load(request.json_payload)
+    sales = _find_documents(request, ctx, parameters['_ids'], {'type': {'$in': [2, 9]}})
+
+    user = request.cached_user
+    tenant = lookup_tenant(request.db, request.requested_tenant_id)
+
+    documents = []
+    for sale in sales:
+        sale = SaleSchema().prepare_for_pdf(sale)
+        html, css = generate_receipt_html_css(request, sale, parameters, user, tenant)
+        documents.append((sale['nr'] + '.pdf', html, css))
+
+    return _serve_batch(request, documents, parameters['format'], 'receipts')
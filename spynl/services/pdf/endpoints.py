@@ -45,13 +45,7 @@ from spynl.services.pdf.preview_sales_order import PREVIEW_ORDER
 from spynl.services.pdf.utils import get_email_settings, non_babel_translate
 
 
-class SalesReceiptDownloadSchema(Schema):
-    _id = ObjectIdField(
-        required=True,
-        metadata={
-            'description': 'The objectId of the sales or consignment transaction'
-        },
-    )
+class SalesReceiptOptionsSchema(Schema):
     footer = BleachedHTMLField(
         load_default='',
         metadata={
@@ -73,6 +67,15 @@ class SalesReceiptDownloadSchema(Schema):
         ordered = True
 
 
+class SalesReceiptDownloadSchema(SalesReceiptOptionsSchema):
+    _id = ObjectIdField(
+        required=True,
+        metadata={
+            'description': 'The objectId of the sales or consignment transaction'
+        },
+    )
+
+
 class SalesReceiptEmailSchema(SalesReceiptDownloadSchema):
     # TODO: or should it default this to the email in the transaction?
     email = fields.Email(
@@ -0,0 +1,250 @@
+"""
+A disk cache for the images in pdfs.
+
+Weasyprint fetches the images of a pdf one at a time while it does the layout,
+so a sales order with hundreds of articles waits for hundreds of requests to the
+CDN. The Renderer (see pool.py) uses a CachingURLFetcher instead: before the
+layout starts, the images of the html are fetched concurrently into an
+ImageCache, and weasyprint then reads them from disk.
+
+The cache is content addressed: the contents of an image are stored under their
+sha256, and for every url a small entry refers to the contents (or says that
+the image does not exist, most articles without a picture have no image). Entries
+expire after ttl seconds, and when the images take more than max_size bytes the
+least recently used ones are removed. The worker processes of the pdf pool share
+the cache directory, files are written to a temporary file first and then moved
+in place, so a process never reads a half written file.
+"""
+
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+from spynl.main.utils import get_logger
+
+logger = get_logger(__name__)
+
+IMG_SRC = re.compile(r'<img\b[^>]*?\ssrc\s*=\s*"([^"]+)"', re.IGNORECASE)
+# these statuses mean the image does not exist, which is cached as well
+MISSING_STATUSES = {403, 404, 410}
+# when the cache is full, images are removed until it is this full
+EVICT_TO = 0.9
+
+
+def image_urls(html_string):
+    """Return the http(s) urls of the images in the html."""
+    return {
+        url
+        for url in map(html.unescape, IMG_SRC.findall(html_string))
+        if url.startswith(('http://', 'https://'))
+    }
+
+
+class ImageMissing(Exception):
+    """The image does not exist (according to the cache)."""
+
+
+class ImageCache:
+    """See the module docstring."""
+
+    def __init__(self, directory, max_size=512 * 1024 * 1024, ttl=86400):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        # the size of the images, it is computed the first time it is needed.
+        # Other processes add images too, so this is only an estimate between
+        # evictions, which compute it again.
+        self._size = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        directory = settings.get('spynl.pdf.image_cache_dir') or os.path.join(
+            tempfile.gettempdir(), 'spynl-pdf-images'
+        )
+        return cls(
+            directory,
+            max_size=int(settings.get('spynl.pdf.image_cache_size', 512)) * 1024 * 1024,
+            ttl=int(settings.get('spynl.pdf.image_cache_ttl', 86400)),
+        )
+
+    def _url_path(self, url):
+        return os.path.join(
+            self.directory, 'urls', hashlib.sha256(url.encode()).hexdigest()
+        )
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, 'blobs', digest[:2], digest)
+
+    def _entry(self, url):
+        try:
+            with open(self._url_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['time'] > self.ttl:
+            return None
+        return entry
+
+    def __contains__(self, url):
+        entry = self._entry(url)
+        if entry is None:
+            return False
+        return entry.get('missing') or os.path.exists(self._blob_path(entry['digest']))
+
+    def get(self, url):
+        """
+        Return the contents and content type of the image of the url, or None if
+        it is not cached. Raises ImageMissing if the image does not exist.
+        """
+        entry = self._entry(url)
+        if entry is None:
+            return None
+        if entry.get('missing'):
+            raise ImageMissing(url)
+
+        path = self._blob_path(entry['digest'])
+        try:
+            with open(path, 'rb') as f:
+                contents = f.read()
+            # the modification time is used for evicting the least recently used
+            os.utime(path)
+        except OSError:
+            # evicted
+            return None
+        return contents, entry['content_type']
+
+    def put(self, url, contents, content_type):
+        digest = hashlib.sha256(contents).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            self._write(path, contents)
+            self._add_size(len(contents))
+        self._write_entry(url, {'digest': digest, 'content_type': content_type})
+
+    def put_missing(self, url):
+        self._write_entry(url, {'missing': True})
+
+    def _write_entry(self, url, entry):
+        entry['time'] = time.time()
+        self._write(self._url_path(url), json.dumps(entry).encode())
+
+    def _write(self, path, contents):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(contents)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _blobs(self):
+        for root, _dirs, files in os.walk(os.path.join(self.directory, 'blobs')):
+            for name in files:
+                if name.startswith('.tmp'):
+                    continue
+                try:
+                    yield os.stat(os.path.join(root, name)), os.path.join(root, name)
+                except OSError:
+                    # removed by another process
+                    pass
+
+    def _add_size(self, size):
+        if self._size is None:
+            self._size = sum(stat.st_size for stat, _path in self._blobs())
+        else:
+            self._size += size
+        if self._size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used images until the cache is not full."""
+        blobs = sorted(self._blobs(), key=lambda blob: blob[0].st_mtime)
+        size = sum(stat.st_size for stat, _path in blobs)
+        for stat, path in blobs:
+            if size <= self.max_size * EVICT_TO:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            size -= stat.st_size
+        # url entries of removed images are found out when they are used.
+        self._size = size
+
+
+class CachingURLFetcher(URLFetcher):
+    """
+    A weasyprint url fetcher that gets http(s) urls from an ImageCache, and can
+    fetch the images of a document concurrently before weasyprint needs them.
+    """
+
+    def __init__(self, cache, threads=8, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self.threads = threads
+        self._kwargs = kwargs
+        self._local = threading.local()
+
+    def fetch(self, url, headers=None):
+        if not url.startswith(('http://', 'https://')):
+            return super().fetch(url, headers)
+        try:
+            cached = self.cache.get(url)
+        except ImageMissing:
+            raise ValueError('Image not found: {}'.format(url))
+        if cached is None:
+            cached = self._download(url)
+        contents, content_type = cached
+        return URLFetcherResponse(url, contents, {'Content-Type': content_type})
+
+    def _fetcher(self):
+        """
+        Return the URLFetcher of this thread. A URLFetcher keeps the request it
+        is redirecting, so the prefetch threads cannot share one.
+        """
+        fetcher = getattr(self._local, 'fetcher', None)
+        if fetcher is None:
+            fetcher = self._local.fetcher = URLFetcher(**self._kwargs)
+        return fetcher
+
+    def _download(self, url):
+        try:
+            response = self._fetcher().fetch(url)
+        except HTTPError as e:
+            if e.code in MISSING_STATUSES:
+                self.cache.put_missing(url)
+            raise
+        try:
+            contents = response.read()
+        finally:
+            response.close()
+        self.cache.put(url, contents, response.content_type)
+        return contents, response.content_type
+
+    def prefetch(self, urls):
+        """Download the urls that are not cached, threads at a time."""
+        urls = [url for url in urls if url not in self.cache]
+        if not urls:
+            return
+        with ThreadPoolExecutor(min(self.threads, len(urls))) as executor:
+            for _ in executor.map(self._prefetch, urls):
+                pass
+
+    def _prefetch(self, url):
+        try:
+            self._download(url)
+        except Exception as e:
+            # weasyprint tries again when it needs the image, and logs the error
+            logger.debug('Could not prefetch %s: %s', url, e)
@@ -8,7 +8,6 @@ import os
 from collections import OrderedDict
 
 from pyramid.renderers import render
-from weasyprint import CSS, HTML
 
 from spynl_schemas import (
     EOSSchema,
@@ -21,40 +20,42 @@ from spynl.main.utils import get_settings
 
 from spynl.api.auth.utils import lookup_tenant
 
-from spynl.services.pdf.utils import get_pdf_template_absolute_path
+from spynl.services.pdf.pool import PDF_POOL
+from spynl.services.pdf.utils import read_pdf_stylesheet
 
 
 def generate_pdf(html, css=None):
     """
     Make a PDF from HTML (and CSS if provided).
 
-    This function returns a StringIO object, and strings that contain
-    any errors/warnings that were given by weasyprint or insert_barcodes.
-    css can be a CSS string or a list of CSS strings
+    This function returns a BytesIO object. css can be a CSS string or a list of
+    CSS strings. The pdf is rendered by the pdf pool, see pool.py.
     """
-    default_css = CSS(
-        string='body { font-family: DejaVuSans, sans-serif; font-size: 8pt }'
-    )
+    result = io.BytesIO(PDF_POOL.render(html, _css_list(css)))
 
-    css_sheets = [default_css]
-    if isinstance(css, str):
-        css_sheets.append(CSS(string=css))
-    elif isinstance(css, list):
-        [css_sheets.append(CSS(string=i)) for i in css]
+    if os.getenv('DEBUG'):
+        with open('test.pdf', 'wb') as f:
+            f.write(result.getvalue())
+
+    return result
 
-    result = io.BytesIO()
-    HTML(string=html).write_pdf(
-        result, stylesheets=css_sheets, presentational_hints=True
+
+def generate_merged_pdf(documents):
+    """
+    Make one PDF of the pages of several documents.
+
+    documents is a list of (html, css) pairs, css as for generate_pdf. Returns a
+    BytesIO object.
+    """
+    return io.BytesIO(
+        PDF_POOL.render_merged([(html, _css_list(css)) for html, css in documents])
     )
-    result.seek(0)
 
-    if os.getenv('DEBUG'):
-        filename = 'test.pdf'
-        HTML(string=html).write_pdf(
-            filename, stylesheets=css_sheets, presentational_hints=True
-        )
 
-    return result
+def _css_list(css):
+    if isinstance(css, str):
+        return [css]
+    return list(css or ())
 
 
 def generate_sales_order_pdf(request, order, settings, image_location, load_order=True):
@@ -75,8 +76,7 @@ def generate_sales_order_pdf(request, order, settings, image_location, load_orde
 
     html = render('sales_order.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('order.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('order.css')
 
     return generate_pdf(html, css=css)
 
@@ -85,6 +85,12 @@ def generate_packing_list_pdf(request, order, image_location):
     """
     generate a pdf for a packing list
     """
+    html, css = generate_packing_list_html_css(request, order, image_location)
+    return generate_pdf(html, css=css)
+
+
+def generate_packing_list_html_css(request, order, image_location):
+    """generate the html and css for a packing list"""
     order = PackingListSchema.prepare_for_pdf(
         order, request.db, request.requested_tenant_id
     )
@@ -92,10 +98,9 @@ def generate_packing_list_pdf(request, order, image_location):
 
     html = render('packing_list.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('packing_list.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('packing_list.css')
 
-    return generate_pdf(html, css=css)
+    return html, css
 
 
 def generate_receiving_pdf(request, receiving, image_location):
@@ -118,8 +123,7 @@ def generate_receiving_pdf(request, receiving, image_location):
 
     html = render('receivings.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('receivings.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('receivings.css')
 
     return generate_pdf(html, css=css)
 
@@ -154,8 +158,7 @@ def generate_article_status_html_css(request, parameters, tenant, data):
     }
     html = render('reports/article_status.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('reports/report.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('reports/report.css')
 
     return html, css
 
@@ -193,8 +196,7 @@ def generate_stock_html_css(request, parameters, tenant, data):
     }
     html = render('reports/stock.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('reports/report.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('reports/report.css')
 
     return html, css
 
@@ -215,10 +217,8 @@ def generate_eos_pdf(request, eos):
 
     html = generate_eos_pdf_html(eos, request, locale, currency, tz)
 
-    with open(get_pdf_template_absolute_path('base.css')) as f:
-        base_css = f.read()
-    with open(get_pdf_template_absolute_path('eos.css')) as f:
-        css = f.read()
+    base_css = read_pdf_stylesheet('base.css')
+    css = read_pdf_stylesheet('eos.css')
 
     return generate_pdf(html, css=[base_css, css])
 
@@ -255,11 +255,9 @@ def generate_receipt_html_css(request, sale, parameters, user, tenant):
     }
     html = render('receipt.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('base.css')) as f:
-        base_css = f.read()
+    base_css = read_pdf_stylesheet('base.css')
 
-    with open(get_pdf_template_absolute_path('receipt.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('receipt.css')
 
     return html, [base_css, css]
 
@@ -279,10 +277,8 @@ def generate_transit_html_css(
     }
     html = render('transit.jinja2', replacements, request=request)
 
-    with open(get_pdf_template_absolute_path('base.css')) as f:
-        base_css = f.read()
+    base_css = read_pdf_stylesheet('base.css')
 
-    with open(get_pdf_template_absolute_path('transit.css')) as f:
-        css = f.read()
+    css = read_pdf_stylesheet('transit.css')
 
     return html, [base_css, css]
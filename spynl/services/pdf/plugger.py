@@ -3,11 +3,16 @@ plugger.py is used by spynl Plugins to say
 which endspoints and resources it will use.
 """
 
+from spynl.main.about import AboutResource
 from spynl.main.utils import add_jinja2_filters
 
 from spynl.api.logistics.resources import PackingLists, SalesOrders
 from spynl.api.retail.resources import EOS, Receiving, Sales, Transit
 
+from spynl.services.pdf.batch import (
+    download_packing_lists_batch,
+    download_sales_receipts_batch,
+)
 from spynl.services.pdf.endpoints import (
     download_eos_pdf,
     download_packing_list_pdf,
@@ -20,6 +25,7 @@ from spynl.services.pdf.endpoints import (
     email_transit_pdf,
     preview_sales_order_receipt,
 )
+from spynl.services.pdf.pool import PDF_POOL, pdf_pool_status
 
 
 def includeme(config):
@@ -42,6 +48,18 @@ def includeme(config):
     config.add_endpoint(
         download_packing_list_pdf, 'download', context=PackingLists, permission='read'
     )
+    config.add_endpoint(
+        download_packing_lists_batch,
+        'download-batch',
+        context=PackingLists,
+        permission='read',
+    )
+    config.add_endpoint(
+        download_sales_receipts_batch,
+        'download-batch',
+        context=Sales,
+        permission='read',
+    )
 
     config.add_endpoint(
         download_receivings_pdf, 'download', context=Receiving, permission='read'
@@ -50,6 +68,13 @@ def includeme(config):
     config.add_endpoint(download_eos_pdf, 'download', context=EOS, permission='read')
     config.add_endpoint(email_eos_document, 'email', context=EOS, permission='read')
 
+    # the workers are started when the configuration is commited, see pool.py
+    PDF_POOL.configure_from_settings(config.get_settings())
+    config.add_subscriber(PDF_POOL.warm_up, 'spynl.main.ConfigCommited')
+    config.add_endpoint(
+        pdf_pool_status, 'pdf-status', context=AboutResource, permission='read'
+    )
+
     config.add_jinja2_search_path('spynl.services.pdf:email-templates')
     config.add_jinja2_search_path('spynl.services.pdf:pdf-templates')
 
@@ -0,0 +1,399 @@
+"""
+The pool of processes that render pdfs.
+
+Weasyprint is CPU bound, so a pdf that is rendered in the request thread keeps
+that thread (and the GIL) busy for as long as rendering takes. When
+spynl.pdf.processes is set, generate_pdf sends the html and css to one of that
+many worker processes instead. Every worker keeps a Renderer: the default and
+template stylesheets are parsed once when the worker starts, and all pdfs share
+one FontConfiguration.
+
+The workers are started when the configuration is commited. When all workers
+are busy a request waits at most acquire_timeout seconds for one, a pdf that
+takes longer than timeout seconds is stopped by killing its worker, which is
+replaced for the next pdf. Without spynl.pdf.processes pdfs are rendered in the
+request thread, by a Renderer per thread. Renderers get the images of a pdf
+from a disk cache, see images.py.
+"""
+
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from pyramid.httpexceptions import HTTPInternalServerError, HTTPServiceUnavailable
+from weasyprint import CSS, HTML
+from weasyprint.text.fonts import FontConfiguration
+
+from spynl.locale import SpynlTranslationString as _
+
+from spynl.main.dateutils import date_to_str, now
+from spynl.main.exceptions import SpynlException
+from spynl.main.utils import get_logger
+
+from spynl.services.pdf.images import CachingURLFetcher, ImageCache, image_urls
+from spynl.services.pdf.utils import read_pdf_stylesheet
+
+logger = get_logger(__name__)
+
+DEFAULT_CSS = 'body { font-family: DejaVuSans, sans-serif; font-size: 8pt }'
+# the stylesheets of the pdf templates, these are parsed when a worker starts
+TEMPLATE_STYLESHEETS = (
+    'base.css',
+    'eos.css',
+    'order.css',
+    'packing_list.css',
+    'receipt.css',
+    'receivings.css',
+    'transit.css',
+    'reports/report.css',
+)
+# number of parsed stylesheets a renderer keeps
+STYLESHEET_CACHE_SIZE = 32
+# number of seconds a new worker gets to start and parse the stylesheets
+STARTUP_TIMEOUT = 60
+
+
+class PdfRenderError(SpynlException):
+    """Weasyprint could not render the pdf."""
+
+    http_escalate_as = HTTPInternalServerError
+
+    def __init__(self, developer_message=None):
+        message = _('pdf-render-error')
+        super().__init__(message=message, developer_message=developer_message)
+
+
+class PdfRenderTimeout(SpynlException):
+    """No worker was available in time, or rendering took too long."""
+
+    http_escalate_as = HTTPServiceUnavailable
+
+    def __init__(self):
+        message = _('pdf-render-timeout')
+        super().__init__(message=message)
+
+
+class Renderer:
+    """
+    Renders pdfs with one FontConfiguration and keeps the stylesheets it parsed.
+
+    Stylesheets are kept by their contents, the least recently used are dropped
+    when there are more than STYLESHEET_CACHE_SIZE. A renderer should only be used
+    by one thread.
+    """
+
+    def __init__(self, image_cache=None, prefetch_threads=8):
+        self.font_config = FontConfiguration()
+        self.default_css = CSS(string=DEFAULT_CSS, font_config=self.font_config)
+        self._stylesheets = OrderedDict()
+        self.url_fetcher = None
+        if image_cache is not None:
+            self.url_fetcher = CachingURLFetcher(image_cache, threads=prefetch_threads)
+
+    def warm_up(self):
+        for name in TEMPLATE_STYLESHEETS:
+            self.stylesheet(read_pdf_stylesheet(name))
+
+    def stylesheet(self, css):
+        try:
+            self._stylesheets.move_to_end(css)
+            return self._stylesheets[css]
+        except KeyError:
+            pass
+        stylesheet = CSS(string=css, font_config=self.font_config)
+        self._stylesheets[css] = stylesheet
+        if len(self._stylesheets) > STYLESHEET_CACHE_SIZE:
+            self._stylesheets.popitem(last=False)
+        return stylesheet
+
+    def render(self, html, css=()):
+        """Return the pdf of the html as bytes, css is a sequence of strings."""
+        return self._document(html, css).write_pdf()
+
+    def render_merged(self, documents):
+        """
+        Return one pdf of the pages of all documents, which is a sequence of
+        (html, css) pairs.
+        """
+        rendered = [self._document(html, css) for html, css in documents]
+        pages = [page for document in rendered for page in document.pages]
+        return rendered[0].copy(pages).write_pdf()
+
+    def _document(self, html, css):
+        stylesheets = [self.default_css, *map(self.stylesheet, css)]
+        if self.url_fetcher is not None:
+            self.url_fetcher.prefetch(image_urls(html))
+        return HTML(string=html, url_fetcher=self.url_fetcher).render(
+            stylesheets=stylesheets,
+            presentational_hints=True,
+            font_config=self.font_config,
+        )
+
+
+def _serve(conn, renderer_factory):
+    """The main loop of a worker process."""
+    renderer = renderer_factory()
+    renderer.warm_up()
+    conn.send(True)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        method, args = job
+        try:
+            result = True, getattr(renderer, method)(*args)
+        except Exception as e:
+            result = False, '{}: {}'.format(type(e).__name__, e)
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, context, renderer_factory):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_serve,
+            args=(child_conn, renderer_factory),
+            name='spynl-pdf-worker',
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self):
+        """Wait for the worker to have started, this is not part of the timeout."""
+        if not self.ready and self.conn.poll(STARTUP_TIMEOUT):
+            self.ready = self.conn.recv()
+        return self.ready
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class PdfPool:
+    """
+    Thread-safe pool of worker processes that render pdfs, see the module
+    docstring.
+    """
+
+    def __init__(
+        self,
+        processes=0,
+        timeout=60,
+        acquire_timeout=30,
+        max_timeout=300,
+        renderer_factory=Renderer,
+    ):
+        self.renderer_factory = renderer_factory
+        self.configure(processes, timeout, acquire_timeout, max_timeout)
+
+        # workers are started with spawn, forking a process with threads (the
+        # ones of the server) is not safe.
+        self._context = multiprocessing.get_context('spawn')
+        self._local = threading.local()
+        self._idle = []
+        self._lock = threading.Lock()
+
+        self.in_use = 0
+        self.waiting = 0
+        self.rendered = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.render_time = 0.0
+        self.max_render_time = 0.0
+
+    def configure(self, processes=0, timeout=60, acquire_timeout=30, max_timeout=300):
+        self.processes = processes
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_timeout = max_timeout
+        self._slots = threading.BoundedSemaphore(max(processes, 1))
+
+    def configure_from_settings(self, settings):
+        image_cache = None
+        if int(settings.get('spynl.pdf.image_cache_size', 512)) > 0:
+            image_cache = ImageCache.from_settings(settings)
+        self.renderer_factory = partial(
+            Renderer,
+            image_cache=image_cache,
+            prefetch_threads=int(settings.get('spynl.pdf.prefetch_threads', 8)),
+        )
+        self.configure(
+            processes=int(settings.get('spynl.pdf.processes', 0)),
+            timeout=float(settings.get('spynl.pdf.timeout', 60)),
+            acquire_timeout=float(settings.get('spynl.pdf.acquire_timeout', 30)),
+            max_timeout=float(settings.get('spynl.pdf.max_timeout', 300)),
+        )
+
+    def warm_up(self, event=None):
+        """Start the workers when the configuration is commited, see plugger.py."""
+        with self._lock:
+            while len(self._idle) < self.processes:
+                self._idle.append(self._start_worker())
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+    def render(self, html, css=()):
+        """Return the pdf of the html as bytes, css is a sequence of strings."""
+        return self._call('render', (html, tuple(css)), self.timeout)
+
+    def render_merged(self, documents):
+        """
+        Return one pdf of the pages of all documents, which is a sequence of
+        (html, css) pairs. The documents are rendered by one worker, which gets
+        timeout seconds per document, but no more than max_timeout seconds, a
+        worker should not be kept busy for ever by one request.
+        """
+        documents = [(html, tuple(css)) for html, css in documents]
+        timeout = min(self.timeout * len(documents), self.max_timeout)
+        return self._call('render_merged', (documents,), timeout)
+
+    def _call(self, method, args, timeout):
+        if not self.processes:
+            return getattr(self._local_renderer(), method)(*args)
+
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.timeouts += 1
+        if not acquired:
+            logger.warning(
+                'No pdf worker available after %s seconds', self.acquire_timeout
+            )
+            raise PdfRenderTimeout
+
+        start = time.monotonic()
+        try:
+            ok, result = self._run((method, args), timeout)
+        finally:
+            self._slots.release()
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            if ok:
+                self.rendered += 1
+                self.render_time += elapsed
+                self.max_render_time = max(self.max_render_time, elapsed)
+            else:
+                self.failures += 1
+        if not ok:
+            raise PdfRenderError(developer_message=result)
+        return result
+
+    def _run(self, job, timeout):
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+            self.in_use += 1
+        try:
+            if worker is None or not worker.process.is_alive():
+                worker = self._start_worker()
+            try:
+                if not worker.wait_ready():
+                    self._replace(worker)
+                    logger.error(
+                        'A pdf worker did not start in %s seconds', STARTUP_TIMEOUT
+                    )
+                    return False, 'The pdf worker did not start'
+                worker.conn.send(job)
+                if not worker.conn.poll(timeout):
+                    self._replace(worker)
+                    with self._lock:
+                        self.timeouts += 1
+                    logger.warning('Rendering a pdf took over %s seconds', timeout)
+                    raise PdfRenderTimeout
+                result = worker.conn.recv()
+            except (EOFError, OSError):
+                self._replace(worker)
+                logger.exception('A pdf worker stopped')
+                return False, 'The pdf worker stopped'
+        finally:
+            with self._lock:
+                self.in_use -= 1
+        with self._lock:
+            self._idle.append(worker)
+        return result
+
+    def _replace(self, worker):
+        """Kill the worker and start a new one, so it is ready for the next pdf."""
+        worker.kill()
+        new_worker = self._start_worker()
+        with self._lock:
+            self._idle.append(new_worker)
+
+    def _start_worker(self):
+        return _Worker(self._context, self.renderer_factory)
+
+    def _local_renderer(self):
+        try:
+            return self._local.renderer
+        except AttributeError:
+            self._local.renderer = self.renderer_factory()
+            return self._local.renderer
+
+    def stats(self):
+        with self._lock:
+            return {
+                'processes': self.processes,
+                'idle': len(self._idle),
+                'inUse': self.in_use,
+                'waiting': self.waiting,
+                'rendered': self.rendered,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'renderTimeAvgMs': round(
+                    1000 * self.render_time / self.rendered if self.rendered else 0,
+                    3,
+                ),
+                'renderTimeMaxMs': round(1000 * self.max_render_time, 3),
+            }
+
+
+PDF_POOL = PdfPool()
+
+
+def pdf_pool_status(request):
+    """
+    Returns the statistics of the pdf pool of this process.
+
+    ---
+    get:
+      description: >
+        Returns the statistics of the pool of processes that render pdfs.
+        processes is 0 if pdfs are rendered in the request.
+
+        ### Response
+
+        JSON keys | Type | Description\n
+        --------- | ------------ | -----------\n
+        status    | string | 'ok'\n
+        time      | string | time\n
+        pool      | object | processes, idle, inUse and waiting (the number of
+        workers and the number of pdfs waiting for one), rendered, failures,
+        timeouts (counters since the start of the process) and renderTimeAvgMs
+        and renderTimeMaxMs.\n
+
+      tags:
+        - about
+    """
+    return {'time': date_to_str(now()), 'pool': PDF_POOL.stats()}
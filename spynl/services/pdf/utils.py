@@ -3,6 +3,7 @@ Util functions for spynl.services.pdf.
 """
 
 import os
+from functools import lru_cache
 from sys import platform
 
 from babel.dates import Locale
@@ -68,6 +69,13 @@ def get_pdf_template_absolute_path(extra_path):
     return split_char.join([path, 'pdf-templates', extra_path])
 
 
+@lru_cache(maxsize=None)
+def read_pdf_stylesheet(extra_path):
+    """Return the contents of a stylesheet of the pdf templates, read only once."""
+    with open(get_pdf_template_absolute_path(extra_path)) as f:
+        return f.read()
+
+
 def check_value_is_empty(value):
     return value in (None, '') or isinstance(value, Undefined)
 
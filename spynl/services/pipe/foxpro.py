@@ -53,9 +53,8 @@ def get(request):
         raise SpynlException('"query" should be an object')
     # check if we need to fetch the barcode from latest collection
     fetchBarcodeFromLatestCollection = lookup(
-        request.db.tenants.find_one(
-            {'_id': request.current_tenant_id}, {'settings': 1}
-        ),
+        # the find callback used to turn this into the requested tenant.
+        request.db.tenants.get_cached(request.requested_tenant_id),
         'settings.fetchBarcodeFromLatestCollection',
     )
     if fetchBarcodeFromLatestCollection and request.args.get('function') == 'raptorsku':
@@ -11,7 +11,6 @@ from marshmallow import (
     validate,
     validates_schema,
 )
-from psycopg2 import sql
 from pyramid_mailer.message import Attachment
 
 from spynl_schemas import BleachedHTMLField, Nested
@@ -24,14 +23,17 @@ from spynl.main.serial.file_responses import (
     ColumnMetadata,
     export_csv,
     export_header,
+    iter_csv,
+    iter_json,
     make_pdf_file_response,
-    serve_csv_response,
+    serve_csv,
     serve_excel_response,
 )
 
 from spynl.api.retail.exceptions import NoDataToExport
 from spynl.api.retail.utils import round_results
 
+from spynl.services.jobs.queue import enqueue, jobs_enabled
 from spynl.services.pdf.pdf import generate_article_status_html_css, generate_pdf
 from spynl.services.pdf.utils import format_datetime
 from spynl.services.reports.article_status_query_builder import (
@@ -39,13 +41,19 @@ from spynl.services.reports.article_status_query_builder import (
     build,
     build_filter_values,
 )
+from spynl.services.reports.cache import fetch_rows
 from spynl.services.reports.utils import (
     CollectionSchema,
     debug_query,
     default_filter_values,
     generate_excel_report,
+    latest_timestamp,
     prepare_filter_response,
     revert_back_to_camelcase,
+    serve_stream,
+    split_totals,
+    stream_rows,
+    streaming_enabled,
 )
 
 # Report types
@@ -437,9 +445,7 @@ class ArticleStatusQuery(Schema):
             )
 
     @staticmethod
-    def to_query(data, totals=False):
-        if totals:
-            data = {**data, 'sort': [], 'groups': []}
+    def to_query(data, with_totals=False):
         fields_ = {ALIAS_TO_COLUMN[f] for f in data['fields_'] + data['groups']}
 
         filter_ = {
@@ -456,6 +462,7 @@ class ArticleStatusQuery(Schema):
             t2,
             COLUMN_TO_ALIAS,
             filter_sales=data['sales_only'],
+            with_totals=with_totals,
         )
 
     class Meta:
@@ -613,51 +620,88 @@ def article_status_pdf(ctx, request):
     return serve_report(ctx, request, 'pdf', ArticleStatusQuery)
 
 
-def generate_report_data(ctx, request, schema):
-    schema = schema(context={'tenant_id': request.requested_tenant_id})
-    parameters = schema.load(request.json_payload)
-    query = schema.to_query(parameters)
-
-    with request.redshift.cursor() as cursor:
-        debug_query(cursor, query)
-        cursor.execute(query)
-        result = cursor.fetchall()
-
-    if not result:
-        raise NoDataToExport()
+def prepare_row(row):
+    """Revert the column names to camelcase and round the values of a row."""
+    row = revert_back_to_camelcase(row, LOWER_TO_CAMEL)
+    round_results([row], 2)
+    return row
 
-    result = revert_back_to_camelcase(result, LOWER_TO_CAMEL)
-    round_results(result, 2)
-
-    # NOTE totals are not always sums. So execute the query without
-    # grouping by anything to get the total for each aggregate field.
-    totals_query = schema.to_query(parameters, totals=True)
-    with request.redshift.cursor() as cursor:
-        debug_query(cursor, totals_query)
-        cursor.execute(totals_query)
-        totals = cursor.fetchall()
 
+def prepare_totals(parameters, totals, columns):
+    """Return the totals row, with an empty value for each column without a total."""
     totals = revert_back_to_camelcase(totals, LOWER_TO_CAMEL)
-    totals = totals[0]
-    for key in result[0]:
-        totals.setdefault(key, '')
+    for key in columns:
+        if key not in totals or key in parameters['groups']:
+            totals[key] = ''
         if parameters.get('sales_only'):
             if key not in SALES_ONLY_TOTAL_COLUMNS:
                 totals[key] = ''
+    return totals
+
 
+def report_header(parameters, row):
     reference_order = [
         i
         for i in parameters['groups'] + parameters['fields_']
         if i in COLUMN_TO_ALIAS.values()
     ]
+    return export_header([row], reference_order)
 
-    header = export_header(result, reference_order)
+
+def generate_report_data(ctx, request, schema):
+    schema = schema(context={'tenant_id': request.requested_tenant_id})
+    parameters = schema.load(request.json_payload)
+    # NOTE totals are not always sums, so the query calculates them as well.
+    query = schema.to_query(parameters, with_totals=True)
+    result = fetch_rows(request, query)
+
+    totals = split_totals(result)
+    if not result:
+        raise NoDataToExport()
+    if totals is None:
+        # nothing was grouped by, so the only row is the totals row.
+        totals = dict(result[0])
+
+    result = revert_back_to_camelcase(result, LOWER_TO_CAMEL)
+    round_results(result, 2)
+
+    totals = prepare_totals(parameters, totals, result[0])
+    header = report_header(parameters, result[0])
 
     return parameters, result, totals, header
 
 
+def serve_streamed_report(ctx, request, format, schema):
+    """
+    Stream the csv or json report from a server side cursor.
+
+    The rows are fetched, transformed and written in batches while the response
+    is sent, so memory use does not depend on the size of the report.
+    """
+    schema = schema(context={'tenant_id': request.requested_tenant_id})
+    parameters = schema.load(request.json_payload)
+    query = schema.to_query(parameters, with_totals=format == 'json')
+    rows = stream_rows(request, query, transform=prepare_row)
+    if not rows:
+        rows.close()
+        raise NoDataToExport()
+
+    first = revert_back_to_camelcase(dict(rows.first), LOWER_TO_CAMEL)
+    if format == 'json':
+        totals = rows.totals if rows.totals is not None else dict(rows.first)
+        totals = prepare_totals(parameters, totals, first)
+        app_iter = iter_json(rows, totals=totals)
+        return serve_stream(request.response, rows, app_iter, 'application/json')
+
+    header = report_header(parameters, first)
+    return serve_stream(request.response, rows, iter_csv(header, rows), 'text/csv')
+
+
 def serve_report(ctx, request, format, schema):
     """format the data for file responses"""
+    if format in ('json', 'csv') and streaming_enabled(request):
+        return serve_streamed_report(ctx, request, format, schema)
+
     parameters, result, totals, header = generate_report_data(ctx, request, schema)
 
     if format == 'json':
@@ -680,8 +724,7 @@ def serve_report(ctx, request, format, schema):
         return serve_excel_response(request.response, temp_file, filename)
 
     elif format == 'csv':
-        temp_file = export_csv(header, result)
-        return serve_csv_response(request.response, temp_file)
+        return serve_csv(request.response, header, result)
 
 
 def generate_report_attachment(request, parameters, result, totals, header):
@@ -712,6 +755,16 @@ def generate_report_attachment(request, parameters, result, totals, header):
         return Attachment(filename, 'text/csv', temp_file)
 
 
+class ArticleStatusExportQuery(ArticleStatusQuery):
+    format = fields.String(
+        required=True,
+        validate=validate.OneOf(
+            ('pdf', 'excel', 'csv'), error='Must be one of {choices}, got {input}.'
+        ),
+        metadata={'description': 'The format of the file.'},
+    )
+
+
 class ArticleStatusEmailQuery(ArticleStatusQuery):
     recipients = fields.List(
         fields.Email,
@@ -732,6 +785,54 @@ class ArticleStatusEmailQuery(ArticleStatusQuery):
     )
 
 
+# job types, see spynl.services.jobs
+EMAIL_JOB = 'article-status-email'
+EXPORT_JOB = 'article-status-export'
+
+
+def send_report_email(request):
+    """Generate the report and email it to the recipients."""
+    parameters, result, totals, header = generate_report_data(
+        None, request, ArticleStatusEmailQuery
+    )
+    attachment = generate_report_attachment(request, parameters, result, totals, header)
+
+    tz = request.cached_user.get('tz', 'Europe/Amsterdam')
+    locale = request.cached_user.get('language', 'nl-nl')[0:2]
+    user = request.cached_user
+    replacements = {
+        'tz': tz,
+        'locale': locale,
+        'parameters': parameters,
+        'username': user['username'],
+        'now': format_datetime(
+            datetime.datetime.now(datetime.timezone.utc), locale=locale, tzinfo=tz
+        ),
+    }
+
+    send_template_email(
+        request,
+        parameters['recipients'],
+        template_file='article_status',
+        replacements=replacements,
+        attachments=[attachment],
+        fail_silently=False,
+    )
+
+
+def email_report_job(request, job):
+    with request.redshift_pool.connection() as request.redshift:
+        send_report_email(request)
+
+
+def export_report_job(request, job):
+    with request.redshift_pool.connection() as request.redshift:
+        parameters, result, totals, header = generate_report_data(
+            None, request, ArticleStatusExportQuery
+        )
+        return generate_report_attachment(request, parameters, result, totals, header)
+
+
 def article_status_email(ctx, request):
     """
     Email the article status report.
@@ -744,6 +845,9 @@ def article_status_email(ctx, request):
       description: >
         Email an article status report.
         \n
+        When jobs are enabled the report is generated and sent in the background,
+        and the response contains the jobId, see job-status.
+        \n
         Located in spynl-services.
       parameters:
         - name: body
@@ -761,35 +865,58 @@ def article_status_email(ctx, request):
             properties:
               status:
                 type: string
+              jobId:
+                type: string
     """
-    parameters, result, totals, header = generate_report_data(
-        ctx, request, ArticleStatusEmailQuery
-    )
-    attachment = generate_report_attachment(request, parameters, result, totals, header)
+    if jobs_enabled(request):
+        # validate now, so the user gets the errors
+        ArticleStatusEmailQuery(
+            context={'tenant_id': request.requested_tenant_id}
+        ).load(request.json_payload)
+        return {'jobId': str(enqueue(request, EMAIL_JOB))}
+
+    send_report_email(request)
+    return {}
 
-    tz = request.cached_user.get('tz', 'Europe/Amsterdam')
-    locale = request.cached_user.get('language', 'nl-nl')[0:2]
-    user = request.cached_user
-    replacements = {
-        'tz': tz,
-        'locale': locale,
-        'parameters': parameters,
-        'username': user['username'],
-        'now': format_datetime(
-            datetime.datetime.now(datetime.timezone.utc), locale=locale, tzinfo=tz
-        ),
-    }
 
-    send_template_email(
-        request,
-        parameters['recipients'],
-        template_file='article_status',
-        replacements=replacements,
-        attachments=[attachment],
-        fail_silently=False,
-    )
+def article_status_export(ctx, request):
+    """
+    Generate the article status report file in the background.
 
-    return {}
+    ---
+    post:
+      tags:
+        - services
+        - reporting
+      description: >
+        Start generating a pdf, excel or csv file of an article status report.
+        Use job-status with the jobId to see if it is done, and job-download to
+        download the file.
+        \n
+        Located in spynl-services.
+      parameters:
+        - name: body
+          in: body
+          required: true
+          schema:
+            $ref: 'article_status_export.json#/definitions/ArticleStatusExportQuery'
+      produces:
+        - application/json
+      responses:
+        200:
+          description: The id of the job
+          schema:
+            type: object
+            properties:
+              status:
+                type: string
+              jobId:
+                type: string
+    """
+    ArticleStatusExportQuery(context={'tenant_id': request.requested_tenant_id}).load(
+        request.json_payload
+    )
+    return {'jobId': str(enqueue(request, EXPORT_JOB))}
 
 
 def article_status_filter(ctx, request):
@@ -890,22 +1017,12 @@ def latest_data(ctx, request):
         data      | object | {"date": DATETIME, "has_date": True}
 
     """
-    query = sql.SQL(
-        'SELECT "timestamp" from "transactions" WHERE "tenant" = {tenant_id} '
-        'ORDER BY "timestamp" DESC LIMIT 1'
-    ).format(tenant_id=sql.Literal(int(request.requested_tenant_id)))
-
     with request.redshift.cursor() as cursor:
-        debug_query(cursor, query)
-        cursor.execute(query)
-        result = cursor.fetchall()
+        latest_date = latest_timestamp(cursor, request.requested_tenant_id)
 
-    if result:
-        latest_date = result[0]['timestamp']
-        has_data = True
-    else:
+    has_data = latest_date is not None
+    if not has_data:
         latest_date = T0
-        has_data = False
     return {
         'data': {
             'latestDate': datetime.datetime.utcfromtimestamp(latest_date),
@@ -10,10 +10,12 @@ from psycopg2 import sql
 
 from spynl.services.reports.utils import build_filter_values  # noqa: F401
 from spynl.services.reports.utils import (
+    TOTALS_COLUMN,
     _build_dependencies,
     _build_group_by,
     _build_select_column,
     _build_sort,
+    _build_totals_flag,
     _build_where,
 )
 
@@ -370,7 +372,9 @@ def _build_outer_selects(columns, t1, t2, aliases=None):
     return sql.SQL('SELECT ') + sql.SQL(', ').join(selects)
 
 
-def _build_middle_query(columns, where, t1, t2, aliases=None, filter_sales=False):
+def _build_middle_query(
+    columns, where, t1, t2, aliases=None, filter_sales=False, with_totals=False
+):
     """
     Build the middle query
 
@@ -415,6 +419,8 @@ def _build_middle_query(columns, where, t1, t2, aliases=None, filter_sales=False
     """
     # Start generating the query starting with the top level selects.
     query = _build_outer_selects(columns - REQUIRE_SUPERQUERY, t1, t2, aliases)
+    if with_totals:
+        query += sql.SQL(', {}').format(sql.Identifier(TOTALS_COLUMN))
     where = _build_where(where) if where else sql.SQL('')
 
     if columns & REQUIRE_SUBQUERY:
@@ -423,7 +429,9 @@ def _build_middle_query(columns, where, t1, t2, aliases=None, filter_sales=False
         if filter_sales:
             inner_columns.add('n_sold')
 
-        inner_query = _build_inner_query(inner_columns, where, t1, t2)
+        inner_query = _build_inner_query(
+            inner_columns, where, t1, t2, with_totals=with_totals
+        )
 
         query += sql.SQL(' FROM ({}) as "inner"').format(inner_query)
 
@@ -431,13 +439,18 @@ def _build_middle_query(columns, where, t1, t2, aliases=None, filter_sales=False
     else:
         query += sql.SQL(' FROM "transactions"') + where
 
-    if filter_sales:
+    if filter_sales and with_totals:
+        # the totals row is kept, even if nothing was sold in total
+        query += sql.SQL(' WHERE ("n_sold" != 0 OR {} = 1) ').format(
+            sql.Identifier(TOTALS_COLUMN)
+        )
+    elif filter_sales:
         query += sql.SQL(' WHERE "n_sold" != 0 ')
 
     return query
 
 
-def _build_inner_query(columns, where, t1, t2):
+def _build_inner_query(columns, where, t1, t2, with_totals=False):
     """
     Build the inner query
 
@@ -468,25 +481,40 @@ def _build_inner_query(columns, where, t1, t2):
     """
     inner_columns = _build_dependencies(columns, COMPUTED)
 
-    query = (
-        _build_inner_selects(inner_columns, t1, t2)
-        + sql.SQL(' FROM "transactions"')
-        + where
-    )
-
     # any keys not aggregated or computed need to be part of
     # the group by clause.
     group_by = inner_columns - (AGGREGATED | COMPUTED.keys())
+
+    query = _build_inner_selects(inner_columns, t1, t2)
+    if with_totals:
+        query += sql.SQL(', ') + _build_totals_flag(group_by)
+    query += sql.SQL(' FROM "transactions"') + where
+
     if group_by:
-        query += _build_group_by(group_by)
+        query += _build_group_by(group_by, with_totals=with_totals)
 
     return query
 
 
-def build(columns, where, sort, t1, t2, aliases=None, limit=None, filter_sales=False):
+def build(
+    columns,
+    where,
+    sort,
+    t1,
+    t2,
+    aliases=None,
+    limit=None,
+    filter_sales=False,
+    with_totals=False,
+):
     """
     Build the full query.
 
+    with_totals adds the totals row to the result, as the first row (see
+    TOTALS_COLUMN). The totals are not always sums, so they are calculated over
+    the inner sums of all rows. with_totals is ignored if there is nothing to
+    group by, then the only row is the totals row.
+
     The query is at max three tiered
 
     * the innermost query calculates sums over columns within a specific
@@ -550,8 +578,15 @@ def build(columns, where, sort, t1, t2, aliases=None, limit=None, filter_sales=F
     if isinstance(t2, datetime):
         t2 = int(t2.timestamp())
 
+    group_by = _build_dependencies(columns, COMPUTED) - (AGGREGATED | COMPUTED.keys())
+    with_totals = with_totals and bool(group_by) and bool(columns & REQUIRE_SUBQUERY)
+    if with_totals:
+        sort = [(TOTALS_COLUMN, 'DESC'), *sort]
+
     if REQUIRE_SUPERQUERY & columns:
         query = _build_super_selects(columns, t1, t2, aliases)
+        if with_totals:
+            query += sql.SQL(', {}').format(sql.Identifier(TOTALS_COLUMN))
         # the middle query needs to query everything that is not strictly an
         # aggregration on the outermost level (meaning actual columns, and mid
         # level computations)
@@ -560,12 +595,23 @@ def build(columns, where, sort, t1, t2, aliases=None, limit=None, filter_sales=F
         )
 
         middle_query = _build_middle_query(
-            middle_columns, where, t1, t2, filter_sales=filter_sales
+            middle_columns,
+            where,
+            t1,
+            t2,
+            filter_sales=filter_sales,
+            with_totals=with_totals,
         )
         query += sql.SQL(' FROM ({}) as "middle"').format(middle_query)
     else:
         query = _build_middle_query(
-            columns, where, t1, t2, aliases=aliases, filter_sales=filter_sales
+            columns,
+            where,
+            t1,
+            t2,
+            aliases=aliases,
+            filter_sales=filter_sales,
+            with_totals=with_totals,
         )
 
     # Append the sort
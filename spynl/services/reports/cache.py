@@ -0,0 +1,227 @@
+"""
+Cache for the results of Redshift report queries.
+
+Users refresh the same reports with the same parameters over and over again. The
+results are cached by tenant, the timestamp of the latest transaction of the
+tenant and the full (mogrified) sql of the query. When new transactions for the
+tenant arrive in Redshift the key changes, so stale results are never returned,
+they just age out of the backend.
+
+The backend is chosen with the spynl.redshift.result_cache setting:
+
+* memory: an LRU cache in the process (MEMORY_BACKEND).
+* mongo: a collection that is shared by all processes.
+
+A backend has a get(key) method that returns the cached rows or None, and a
+set(key, rows) method. A request can skip the cache by sending the
+Cache-Control: no-cache header.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from bson.errors import InvalidDocument
+from pymongo.errors import DocumentTooLarge
+
+from spynl.services.reports.utils import debug_query, latest_timestamp
+
+MONGO_COLLECTION = 'report_cache'
+
+
+class MemoryBackend:
+    """
+    Thread-safe LRU cache of query results, that expire after ttl seconds.
+
+    A maxsize of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=0, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, rows):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+# values of these types are stored as {type: isoformat or str}, so they come
+# back exactly as they were (mongo stores datetimes in milliseconds and in UTC).
+DECODERS = {
+    'decimal': Decimal,
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+}
+
+
+def encode_value(value):
+    """Return the value as it is stored by the MongoBackend."""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return {'decimal': str(value)}
+    # datetime is a subclass of date
+    if isinstance(value, datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'date': value.isoformat()}
+    raise TypeError('Can not cache a value of type %s' % type(value).__name__)
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        ((kind, text),) = value.items()
+        return DECODERS[kind](text)
+    return value
+
+
+class MongoBackend:
+    """
+    Store query results in a mongo collection, so they are shared by processes.
+
+    The rows are stored as plain values (see encode_value), one list of values per
+    row, and the names of the columns once. The documents get an expires date, a
+    TTL index on it makes mongo remove them. Results that are too large for a
+    document, or that have values of other types, are not cached.
+    """
+
+    _indexed = set()
+
+    def __init__(self, collection, ttl=300):
+        self.collection = collection
+        self.ttl = ttl
+        if collection.full_name not in self._indexed:
+            collection.create_index('expires', expireAfterSeconds=0)
+            self._indexed.add(collection.full_name)
+
+    def get(self, key):
+        document = self.collection.find_one(
+            {'_id': key, 'expires': {'$gt': datetime.now(timezone.utc)}}
+        )
+        # documents without columns were stored by an older version
+        if document is None or 'columns' not in document:
+            return None
+        columns = document['columns']
+        return [
+            dict(zip(columns, map(decode_value, values)))
+            for values in document['values']
+        ]
+
+    def set(self, key, rows):
+        expires = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+        columns = list(rows[0]) if rows else []
+        try:
+            values = [[encode_value(row[column]) for column in columns] for row in rows]
+            self.collection.replace_one(
+                {'_id': key},
+                {'columns': columns, 'values': values, 'expires': expires},
+                upsert=True,
+            )
+        except (TypeError, KeyError, InvalidDocument, DocumentTooLarge, OverflowError):
+            pass
+
+
+MEMORY_BACKEND = MemoryBackend()
+
+
+class ReportCache:
+    """
+    Run report queries through a backend.
+
+    Only results with at most max_rows rows are stored. The timestamp of the
+    latest transaction is looked up once per ReportCache, so make a new one for
+    every request (see get_report_cache).
+    """
+
+    def __init__(self, backend, tenant_id, max_rows=50000):
+        self.backend = backend
+        self.tenant_id = tenant_id
+        self.max_rows = max_rows
+        self._latest = None
+
+    def key(self, cursor, query):
+        if self._latest is None:
+            self._latest = latest_timestamp(cursor, self.tenant_id)
+        data = '{}:{}:'.format(self.tenant_id, self._latest).encode()
+        return hashlib.sha256(data + cursor.mogrify(query)).hexdigest()
+
+    def fetchall(self, cursor, query, execute):
+        key = self.key(cursor, query)
+        rows = self.backend.get(key)
+        if rows is None:
+            rows = [dict(row) for row in execute(cursor, query)]
+            if len(rows) <= self.max_rows:
+                self.backend.set(key, rows)
+        # the callers modify the rows, so never hand out the cached dictionaries
+        return [dict(row) for row in rows]
+
+
+def get_report_cache(request):
+    """Return the ReportCache for this request, or None if it is disabled."""
+    settings = request.registry.settings
+    backend = settings.get('spynl.redshift.result_cache')
+    if not backend or request.cache_control.no_cache:
+        return None
+
+    if backend == 'mongo':
+        backend = MongoBackend(
+            request.pymongo_db[MONGO_COLLECTION],
+            ttl=int(settings.get('spynl.redshift.result_cache_ttl', 300)),
+        )
+    else:
+        backend = MEMORY_BACKEND
+
+    return ReportCache(
+        backend,
+        request.requested_tenant_id,
+        max_rows=int(settings.get('spynl.redshift.result_cache_max_rows', 50000)),
+    )
+
+
+def _execute(cursor, query):
+    cursor.execute(query)
+    return cursor.fetchall()
+
+
+def fetch_rows(request, query, execute=_execute):
+    """
+    Return all rows of the query, from the report cache if possible.
+
+    execute(cursor, query) returns the rows of the query, pass another function
+    to fetch them in a different way (in pages for example).
+    """
+    with request.redshift.cursor() as cursor:
+        debug_query(cursor, query)
+        if request.report_cache is None:
+            return execute(cursor, query)
+        return request.report_cache.fetchall(cursor, query, execute)
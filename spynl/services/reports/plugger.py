@@ -2,31 +2,28 @@
 plugger.py is used by spynl Plugins to say
 which endpoints and resources it will use.
 """
-import logging
 
-from psycopg2 import OperationalError
-from psycopg2.extras import RealDictCursor
-from psycopg2.pool import ThreadedConnectionPool
+from functools import partial
+
+from spynl.main.about import AboutResource
 
 from spynl.api.retail.resources import Reports
 
+from spynl.services.jobs.endpoints import job_download, job_status
+from spynl.services.jobs.queue import JOB_HANDLERS, TEMPORARY_ERRORS
 from spynl.services.reports import (
     article_status,
     retail_customer_sales,
     stock,
     wholesale_customer_sales,
 )
-from spynl.services.reports.utils import (
-    BadRedshiftURI,
-    RedshiftConnectionError,
-    parse_connection_string,
-)
+from spynl.services.reports.cache import MEMORY_BACKEND, get_report_cache
+from spynl.services.reports.pool import RedshiftPool, redshift_connection_health
+from spynl.services.reports.utils import ClosingAppIter, RedshiftConnectionError
 
 
 def includeme(config):
     """Update the configurator with the endpoints."""
-    log = logging.getLogger(__name__)
-
     config.add_endpoint(
         article_status.article_status_excel,
         'article-status-excel',
@@ -67,6 +64,22 @@ def includeme(config):
         redshift=True,
     )
 
+    config.add_endpoint(
+        article_status.article_status_export,
+        'article-status-export',
+        context=Reports,
+        permission='read',
+    )
+
+    # jobs run by the worker, see spynl.services.jobs
+    JOB_HANDLERS[article_status.EMAIL_JOB] = article_status.email_report_job
+    JOB_HANDLERS[article_status.EXPORT_JOB] = article_status.export_report_job
+    TEMPORARY_ERRORS.add(RedshiftConnectionError)
+    config.add_endpoint(job_status, 'job-status', context=Reports, permission='read')
+    config.add_endpoint(
+        job_download, 'job-download', context=Reports, permission='read'
+    )
+
     config.add_endpoint(
         article_status.article_status_filter,
         'article-status-filter',
@@ -185,38 +198,30 @@ def includeme(config):
         redshift=True,
     )
 
-    redshift_uri = config.get_settings().get('spynl.redshift.url')
-    redshift_max_connections = config.get_settings().get(
-        'spynl.redshift.max_connections'
+    # results of report queries can be cached, see cache.py
+    settings = config.get_settings()
+    MEMORY_BACKEND.maxsize = int(settings.get('spynl.redshift.result_cache_size', 100))
+    MEMORY_BACKEND.ttl = int(settings.get('spynl.redshift.result_cache_ttl', 300))
+    config.add_request_method(get_report_cache, name='report_cache', reify=True)
+
+    # the connections are made when the configuration is commited, see pool.py
+    connection_pool = RedshiftPool.from_settings(settings)
+    config.add_subscriber(connection_pool.warm_up, 'spynl.main.ConfigCommited')
+    config.add_request_method(
+        lambda r: connection_pool, name='redshift_pool', reify=True
+    )
+    config.add_endpoint(
+        redshift_connection_health,
+        'redshift-status',
+        context=AboutResource,
+        permission='read',
     )
-    connection_pool = None
 
     def add_redshift_connection(view, info):
         if not info.options.get('redshift'):
             return view
 
         def wrapper(ctx, request):
-            nonlocal connection_pool
-
-            if not connection_pool:
-                try:
-                    dsn = parse_connection_string(redshift_uri)
-                    connection_pool = ThreadedConnectionPool(
-                        1,
-                        int(redshift_max_connections),
-                        cursor_factory=RealDictCursor,
-                        connect_timeout=10,
-                        **dsn
-                    )
-                except BadRedshiftURI as e:
-                    log.exception(
-                        'Could not parse connection string: %s' % redshift_uri
-                    )
-                    raise RedshiftConnectionError from e
-                except OperationalError as e:
-                    log.exception('Could not connect to: %s' % redshift_uri)
-                    raise RedshiftConnectionError from e
-
             conn = connection_pool.getconn()
             request.redshift = conn
 
@@ -225,6 +230,12 @@ def includeme(config):
             except Exception:
                 connection_pool.putconn(conn)
                 raise
+
+            # streamed reports still read from the connection while the response
+            # is sent, so return it to the pool only when the app_iter is closed.
+            app_iter = getattr(resp, 'app_iter', None)
+            if isinstance(app_iter, ClosingAppIter):
+                app_iter.on_close.append(partial(connection_pool.putconn, conn))
             else:
                 connection_pool.putconn(conn)
 
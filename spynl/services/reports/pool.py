@@ -0,0 +1,275 @@
+"""
+The pool of redshift connections used by the report endpoints.
+
+The pool is made when the plugin is included and opened (the first connections
+are made) when the configuration is commited, so the first report does not have
+to wait for it. If redshift cannot be reached at that time, the pool is opened by
+the first request that needs a connection.
+
+Connections that were closed by the server (redshift closes idle connections) are
+replaced when they are taken from the pool, and connections older than max_age
+seconds are closed when they are returned. When all connections are in use a
+request waits at most acquire_timeout seconds for one, after that
+RedshiftConnectionError is raised.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import Error, OperationalError
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from pyramid.settings import asbool
+
+from spynl.main.dateutils import date_to_str, now
+from spynl.main.utils import get_logger
+
+from spynl.services.reports.utils import (
+    BadRedshiftURI,
+    RedshiftConnectionError,
+    parse_connection_string,
+)
+
+logger = get_logger(__name__)
+
+
+class RedshiftPool:
+    """
+    Thread-safe pool of redshift connections with a maximum of maxconn connections.
+    """
+
+    def __init__(
+        self,
+        uri,
+        minconn=1,
+        maxconn=1,
+        acquire_timeout=10,
+        max_age=3600,
+        pre_ping=True,
+        connect_timeout=10,
+    ):
+        self.uri = uri
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.acquire_timeout = acquire_timeout
+        self.max_age = max_age
+        self.pre_ping = pre_ping
+        self.connect_timeout = connect_timeout
+
+        self._pool = None
+        self._open_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        # id(connection) -> time.monotonic() of when the connection was made
+        self._born = {}
+
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.recycled = 0
+        self.acquire_time = 0.0
+        self.max_acquire_time = 0.0
+        # the name of the error of the last connection that could not be made,
+        # None after a connection was made (see redshift_connection_health)
+        self.last_error = None
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.get('spynl.redshift.url'),
+            minconn=int(settings.get('spynl.redshift.min_connections', 1)),
+            maxconn=int(settings.get('spynl.redshift.max_connections', 1)),
+            acquire_timeout=float(settings.get('spynl.redshift.acquire_timeout', 10)),
+            max_age=float(settings.get('spynl.redshift.connection_max_age', 3600)),
+            pre_ping=asbool(settings.get('spynl.redshift.pre_ping', True)),
+        )
+
+    def open(self):
+        """Make the first minconn connections, if that was not done yet."""
+        with self._open_lock:
+            if self._pool is not None:
+                return self._pool
+            try:
+                dsn = parse_connection_string(self.uri)
+                self._pool = ThreadedConnectionPool(
+                    min(self.minconn, self.maxconn),
+                    self.maxconn,
+                    cursor_factory=RealDictCursor,
+                    connect_timeout=self.connect_timeout,
+                    **dsn
+                )
+            except BadRedshiftURI as e:
+                logger.exception('Could not parse connection string: %s', self.uri)
+                self.last_error = type(e).__name__
+                raise RedshiftConnectionError from e
+            except OperationalError as e:
+                logger.exception('Could not connect to: %s', self.uri)
+                self.last_error = type(e).__name__
+                raise RedshiftConnectionError from e
+            self.last_error = None
+            for conn in self._pool._pool:
+                self._born[id(conn)] = time.monotonic()
+            return self._pool
+
+    def warm_up(self, event=None):
+        """Open the pool when the configuration is commited, see plugger.py."""
+        if not self.uri:
+            return
+        try:
+            self.open()
+        except RedshiftConnectionError:
+            # already logged, the first request will try again.
+            pass
+
+    def getconn(self):
+        start = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=self.acquire_timeout)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.timeouts += 1
+        if not acquired:
+            logger.warning(
+                'No redshift connection available after %s seconds',
+                self.acquire_timeout,
+            )
+            raise RedshiftConnectionError
+
+        try:
+            conn = self._checkout()
+        except Exception:
+            self._slots.release()
+            raise
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.acquire_time += elapsed
+            self.max_acquire_time = max(self.max_acquire_time, elapsed)
+        return conn
+
+    def putconn(self, conn):
+        close = conn.closed or self._expired(conn)
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            if conn.closed:
+                self._born.pop(id(conn), None)
+            with self._lock:
+                self.in_use -= 1
+                if close:
+                    self.recycled += 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def _checkout(self):
+        pool = self.open()
+        # every try either returns a connection or closes one of the idle ones,
+        # so this ends with a new connection at the latest.
+        for _ in range(self.maxconn + 1):
+            try:
+                conn = pool.getconn()
+            except OperationalError as e:
+                logger.exception('Could not connect to: %s', self.uri)
+                self.last_error = type(e).__name__
+                raise RedshiftConnectionError from e
+            if id(conn) not in self._born:
+                self._born[id(conn)] = time.monotonic()
+                self.last_error = None
+                return conn
+            if not self._expired(conn) and self._alive(conn):
+                self.last_error = None
+                return conn
+            pool.putconn(conn, close=True)
+            self._born.pop(id(conn), None)
+            with self._lock:
+                self.recycled += 1
+        raise RedshiftConnectionError
+
+    def _expired(self, conn):
+        born = self._born.get(id(conn))
+        return born is None or time.monotonic() - born >= self.max_age
+
+    def _alive(self, conn):
+        if conn.closed:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+        except Error:
+            return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'maxConnections': self.maxconn,
+                'open': self._pool is not None,
+                'idle': len(self._pool._pool) if self._pool is not None else 0,
+                'inUse': self.in_use,
+                'waiting': self.waiting,
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'recycled': self.recycled,
+                'acquireLatencyAvgMs': round(
+                    1000 * self.acquire_time / self.acquired if self.acquired else 0,
+                    3,
+                ),
+                'acquireLatencyMaxMs': round(1000 * self.max_acquire_time, 3),
+            }
+
+
+def redshift_connection_health(request):
+    """
+    Returns current health of the redshift connection pool.
+
+    If there is no connection, give error code 503 (Service Unavailable)
+    ---
+    get:
+      description: >
+        Returns status 'healthy' if the connection pool of this process is open
+        and its last connection was made without errors, and status 'error' if
+        not. If redshift is out, **error code 503** is given (Service
+        Unavailable). The statistics of the connection pool of this process are
+        always included. No connection is taken from the pool, so this never
+        waits for one.
+
+        ### Response
+
+        JSON keys | Type | Description\n
+        --------- | ------------ | -----------\n
+        status    | string | 'healthy' or 'error'\n
+        time      | string | time\n
+        message   | string | the error (not present if status is healthy)\n
+        pool      | object | maxConnections, open, idle, inUse and waiting (the
+        number of connections and requests waiting for one), acquired,
+        timeouts, recycled (counters since the start of the process) and
+        acquireLatencyAvgMs and acquireLatencyMaxMs.\n
+
+      tags:
+        - about
+    """
+    pool = request.redshift_pool
+    response = dict(time=date_to_str(now()), pool=pool.stats())
+    if response['pool']['open'] and pool.last_error is None:
+        response['status'] = 'healthy'
+    else:
+        response['status'] = 'error'
+        response['message'] = pool.last_error or RedshiftConnectionError.__name__
+        request.response.status_int = 503
+    return response
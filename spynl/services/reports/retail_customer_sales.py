@@ -260,15 +260,20 @@ class RetailCustomerSalesQuery(ArticleStatusQuery):
         return data
 
     @staticmethod
-    def to_query(data, totals=False):
-        if totals:
-            data = {**data, 'sort': [], 'groups': []}
-
+    def to_query(data, with_totals=False):
         fields_ = {ALIAS_TO_COLUMN[f] for f in data['fields_'] + data['groups']}
 
         sort = SortSchema.build_implicit_sort(data['sort'], data['groups'])
         t1, t2 = data['filter'].get('startDate'), data['filter'].get('endDate')
-        return build(fields_, data['filter'], sort, t1, t2, COLUMN_TO_ALIAS)
+        return build(
+            fields_,
+            data['filter'],
+            sort,
+            t1,
+            t2,
+            COLUMN_TO_ALIAS,
+            with_totals=with_totals,
+        )
 
     class Meta:
         exclude = ('sales_only',)
@@ -1,6 +1,7 @@
 from collections import namedtuple
 from copy import deepcopy
 from datetime import datetime, timezone
+from functools import partial
 
 from marshmallow import (
     ValidationError,
@@ -24,8 +25,8 @@ from spynl.main.serial.file_responses import (
 from spynl.main.utils import get_logger
 
 from spynl.services.pdf.pdf import generate_pdf, generate_stock_html_css
+from spynl.services.reports.cache import fetch_rows
 from spynl.services.reports.stock_query_builder import (
-    add_limit_offset,
     build,
     build_filter_values,
     build_stock_return_value,
@@ -279,7 +280,7 @@ class StockQuery(Schema):
         return data
 
     @staticmethod
-    def to_query(data):
+    def to_query(data, page_size=None, after=None):
         t1, t2 = data['filter'].pop('startDate'), data['filter'].pop('endDate')
 
         return build(
@@ -289,6 +290,8 @@ class StockQuery(Schema):
             t1,
             t2,
             history=data['history'],
+            page_size=page_size,
+            after=after,
         )
 
 
@@ -307,25 +310,37 @@ class StockFilter(Schema):
         return build_filter_values(fields_, data['filter'], COLUMNS_TO_ALIAS)
 
 
+def _fetch_pages(schema, parameters, page_size, c, query):
+    """Fetch the report in pages of page_size rows, using keyset pagination."""
+    result = []
+    after = None
+
+    while True:
+        page = schema.to_query(deepcopy(parameters), page_size=page_size, after=after)
+        debug_query(c, page)
+        c.execute(page)
+        rows = c.fetchall()
+        result.extend(rows)
+        if len(rows) < page_size:
+            break
+        after = rows[-1]
+    return result
+
+
 def generate_report_data(request, schema, **kwargs):
     parameters = schema(context={'tenant_id': request.requested_tenant_id}).load(
         request.json_payload
     )
     query = schema.to_query(deepcopy(parameters))
-    result = []
-    with request.redshift.cursor() as c:
-        limit = 5000
-        offset = 0
-
-        while True:
-            debug_query(c, query)
-            c.execute(add_limit_offset(query, limit, offset))
-            rows = c.fetchall()
-            if not rows:
-                break
-
-            result.extend(rows)
-            offset += limit
+    page_size = int(
+        request.registry.settings.get('spynl.redshift.stock_page_size', 5000)
+    )
+    if page_size > 0:
+        result = fetch_rows(
+            request, query, execute=partial(_fetch_pages, schema, parameters, page_size)
+        )
+    else:
+        result = fetch_rows(request, query)
 
     if result:
         matrices = build_stock_return_value(
@@ -8,6 +8,9 @@ from spynl.services.reports.utils import build_filter_values  # noqa: F401
 from spynl.services.reports.utils import COLLECTION_SQL, _build_sort, _build_where
 
 N_STOCK = 'n_stock'
+COLLECTION_EXPRESSION = sql.SQL(
+    "COALESCE(\"season\",'') || '-' || COALESCE(\"_year\",'')"
+)
 LABEL_SEPARATOR = '-LABEL_SEPARATOR-'
 
 
@@ -45,6 +48,12 @@ TYPE_INDEX = 4
 
 
 def _select_label(history=False):
+    return sql.SQL('{} as {}').format(
+        _label_expression(history=history), sql.Identifier('label')
+    )
+
+
+def _label_expression(history=False):
     # Note any changes here also have to be taken into in the above constants
     if not history:
         return sql.SQL(
@@ -56,8 +65,7 @@ def _select_label(history=False):
             "|| ' ' "
             "|| COALESCE({kl_lev},'') "
             "|| '{seperator}' "
-            "|| COALESCE({warehouse},' ') "
-            "as {alias}"
+            "|| COALESCE({warehouse},' ')"
         ).format(
             color=sql.Identifier('color'),
             scolor=sql.Identifier('scolor'),
@@ -65,7 +73,6 @@ def _select_label(history=False):
             klcode_lev=sql.Identifier('klcode_lev'),
             seperator=sql.SQL(LABEL_SEPARATOR),
             warehouse=sql.Identifier('warehouse'),
-            alias=sql.Identifier('label'),
         )
     else:
         return sql.SQL(
@@ -86,8 +93,7 @@ def _select_label(history=False):
             "|| '{seperator}' "
             "|| COALESCE({trtype}, 0) "
             "|| '{seperator}' "
-            "|| COALESCE({reference}, ' ') "
-            "as {alias}"
+            "|| COALESCE({reference}, ' ')"
         ).format(
             color=sql.Identifier('color'),
             scolor=sql.Identifier('scolor'),
@@ -101,7 +107,6 @@ def _select_label(history=False):
             agent=sql.Identifier('agent'),
             trtype=sql.Identifier('trtype'),
             reference=sql.Identifier('reference'),
-            alias=sql.Identifier('label'),
         )
 
 
@@ -160,7 +165,91 @@ def _build_group_by(columns, history=False):
     return sql.SQL(' GROUP BY ') + sql.SQL(', ').join(group_by)
 
 
-def build(columns, where, sort, t1, t2, aliases=None, limit=None, history=False):
+def _column_expression(column, history=False):
+    """The expression of a grouped column, as it can be used in a WHERE clause."""
+    if column == 'collection':
+        return sql.SQL('({})').format(COLLECTION_EXPRESSION)
+    elif column == 'label':
+        return sql.SQL('({})').format(_label_expression(history=history))
+    return sql.Identifier(column)
+
+
+def _keyset_sort(columns, sort):
+    """
+    Extend the sort with the other grouped columns, so the order of the rows is
+    fixed, which keyset pagination needs.
+    """
+    sort = [(s, 'ASC') if isinstance(s, str) else tuple(s) for s in sort]
+    sorted_columns = {s[0] for s in sort}
+    return sort + [
+        (c, 'ASC') for c in columns if c != N_STOCK and c not in sorted_columns
+    ]
+
+
+def _build_keyset(sort, after, aliases=None, history=False):
+    """
+    Format the condition for the rows that come after the row `after`.
+
+    (a > 1) OR (a = 1 AND b < 'x') OR ...
+
+    The conditions are on the grouped columns, so they go in the WHERE clause and
+    redshift does not have to aggregate the rows of the previous pages again.
+    NULLS are sorted like redshift does: last when ascending and first when
+    descending.
+    """
+    aliases = aliases or {}
+    conditions, equal = [], []
+    for column, direction in sort:
+        expression = _column_expression(column, history)
+        value = after[aliases.get(column, column)]
+        if value is None:
+            greater = (
+                sql.SQL('{} IS NOT NULL').format(expression)
+                if direction == 'DESC'
+                else None
+            )
+        elif direction == 'DESC':
+            greater = sql.SQL('{} < {}').format(expression, sql.Literal(value))
+        else:
+            greater = sql.SQL('({0} > {1} OR {0} IS NULL)').format(
+                expression, sql.Literal(value)
+            )
+        if greater is not None and equal:
+            conditions.append(
+                sql.SQL('(') + sql.SQL(' AND ').join(equal + [greater]) + sql.SQL(')')
+            )
+        elif greater is not None:
+            conditions.append(greater)
+        if value is None:
+            equal.append(sql.SQL('{} IS NULL').format(expression))
+        else:
+            equal.append(sql.SQL('{} = {}').format(expression, sql.Literal(value)))
+
+    if not conditions:
+        return sql.SQL('FALSE')
+    return sql.SQL('(') + sql.SQL(' OR ').join(conditions) + sql.SQL(')')
+
+
+def build(
+    columns,
+    where,
+    sort,
+    t1,
+    t2,
+    aliases=None,
+    limit=None,
+    history=False,
+    page_size=None,
+    after=None,
+):
+    """
+    Build the stock query.
+
+    With a page_size the query returns one page of the report, the page after the
+    row `after` (the last row of the previous page), or the first page if after is
+    None. Unlike LIMIT/OFFSET this does not make redshift evaluate the rows of all
+    previous pages again for every page.
+    """
     if not where:
         where = {}
     if history:
@@ -176,6 +265,12 @@ def build(columns, where, sort, t1, t2, aliases=None, limit=None, history=False)
         t1=sql.Literal(t1), t2=sql.Literal(t2)
     )
 
+    if page_size:
+        sort = _keyset_sort(columns, sort)
+        limit = page_size
+        if after is not None:
+            where += sql.SQL(' AND ') + _build_keyset(sort, after, aliases, history)
+
     query = (
         _build_select(columns, aliases, history)
         + sql.SQL(' FROM {} ').format(sql.Identifier('transactions'))
@@ -354,9 +449,3 @@ def build_stock_return_value(
             rv.append({'header': header, 'products': list(group)})
 
     return rv
-
-
-def add_limit_offset(query, limit, offset):
-    return query + sql.SQL(' LIMIT {} OFFSET {}').format(
-        sql.Literal(limit), sql.Literal(offset)
-    )
@@ -1,20 +1,20 @@
 import os
-from copy import copy
 from datetime import datetime
-from tempfile import NamedTemporaryFile
+from itertools import chain
 from urllib.parse import urlparse
+from uuid import uuid4
 
 from marshmallow import ValidationError, fields, pre_load
-from openpyxl import Workbook
 from psycopg2 import sql
 from pyramid.httpexceptions import HTTPInternalServerError
+from pyramid.settings import asbool
 
-from spynl_schemas import Schema, lookup
+from spynl_schemas import Schema
 
 from spynl.locale import SpynlTranslationString as _
 
 from spynl.main.exceptions import SpynlException
-from spynl.main.serial.file_responses import format_value
+from spynl.main.serial.file_responses import ExcelWriter, column_formatters
 
 
 class BadRedshiftURI(Exception):
@@ -47,6 +47,141 @@ def parse_connection_string(uri):
     return dsn
 
 
+# number of rows fetched at a time by a streamed report
+DEFAULT_ITERSIZE = 2000
+
+# Queries that are built with totals group by GROUPING SETS ((<groups>), ()). This
+# column tells the totals row (grouped by nothing) apart from the other rows, and
+# is sorted on, so the totals row is always the first row.
+TOTALS_COLUMN = 'totals_row'
+
+
+def _drop_totals_flag(row):
+    row.pop(TOTALS_COLUMN, None)
+    return row
+
+
+def split_totals(rows):
+    """
+    Remove the totals row from the rows of a query that was built with totals,
+    and return it. Return None if the query was built without totals (then the
+    rows have no totals flag). If the totals row is missing from a query with
+    totals, return empty totals, so a row is never taken for the totals.
+
+    Removes the totals flag from all rows.
+    """
+    totals = None
+    if rows and TOTALS_COLUMN in rows[0]:
+        totals = _drop_totals_flag(rows.pop(0)) if rows[0][TOTALS_COLUMN] else {}
+    for row in rows:
+        _drop_totals_flag(row)
+    return totals
+
+
+class RowStream:
+    """
+    The rows of a query, fetched from a named (server side) cursor.
+
+    The query is executed and the first batch of rows is fetched on creation, so
+    an empty result can be detected before a response is made. The other rows are
+    fetched `itersize` at a time while iterating, and are passed through
+    `transform` one by one, so only one batch is in memory at a time.
+
+    If the query was built with totals, the totals row is split off and
+    available as `totals`.
+
+    The stream can only be iterated once. Because the cursor lives in a
+    transaction of the connection, close the stream before the connection is
+    returned to the pool (see ClosingAppIter).
+    """
+
+    def __init__(self, connection, query, itersize=DEFAULT_ITERSIZE, transform=None):
+        self._cursor = connection.cursor(name='report_%s' % uuid4().hex)
+        self._cursor.itersize = itersize
+        debug_query(self._cursor, query)
+        self._cursor.execute(query)
+        self._transform = transform or (lambda row: row)
+        self._first = self._cursor.fetchmany(itersize)
+        self.totals = split_totals(self._first)
+        if self.totals is not None and not self._first:
+            self._first = self._cursor.fetchmany(itersize)
+            split_totals(self._first)
+
+    def __bool__(self):
+        return bool(self._first)
+
+    @property
+    def first(self):
+        """The first row (not transformed), or None if there are no rows."""
+        return self._first[0] if self._first else None
+
+    def __iter__(self):
+        rest = (_drop_totals_flag(row) for row in self._cursor)
+        return map(self._transform, chain(self._first, rest))
+
+    def close(self):
+        if not self._cursor.closed:
+            self._cursor.close()
+
+
+class ClosingAppIter:
+    """
+    An app_iter that calls the functions in on_close when the server closes it.
+
+    Streamed reports use this to keep their cursor (and the Redshift connection
+    it belongs to) until the whole response is sent. The redshift view deriver
+    in plugger.py appends returning the connection to on_close.
+    """
+
+    def __init__(self, iterable, on_close=()):
+        self._iterable = iterable
+        self.on_close = list(on_close)
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            for callback in self.on_close:
+                callback()
+        finally:
+            self.on_close = []
+
+
+def stream_rows(request, query, transform=None):
+    """Return a RowStream for the query, using the configured itersize."""
+    itersize = int(
+        request.registry.settings.get('spynl.redshift.itersize', DEFAULT_ITERSIZE)
+    )
+    return RowStream(request.redshift, query, itersize=itersize, transform=transform)
+
+
+def streaming_enabled(request):
+    """Return True if csv and json reports should be streamed."""
+    return asbool(request.registry.settings.get('spynl.redshift.stream_reports'))
+
+
+def serve_stream(response, rows, app_iter, content_type):
+    """
+    Set the app_iter on the response, closing the rows when the response is sent.
+    """
+    response.content_type = content_type
+    response.app_iter = ClosingAppIter(app_iter, on_close=[rows.close])
+    return response
+
+
+def latest_timestamp(cursor, tenant_id):
+    """Return the timestamp of the latest transaction of the tenant, or None."""
+    query = sql.SQL(
+        'SELECT "timestamp" from "transactions" WHERE "tenant" = {tenant_id} '
+        'ORDER BY "timestamp" DESC LIMIT 1'
+    ).format(tenant_id=sql.Literal(int(tenant_id)))
+    debug_query(cursor, query)
+    cursor.execute(query)
+    result = cursor.fetchall()
+    return result[0]['timestamp'] if result else None
+
+
 def debug_query(cursor, query):
     if os.environ.get('DEBUG', False):
         import sqlparse
@@ -171,13 +306,29 @@ def _build_select_column(column, aliases):
     )
 
 
-def _build_group_by(columns):
+def _build_group_by(columns, with_totals=False):
     """Format group by
 
     GROUP BY "supplier", "tenantname"
+
+    with totals, also group by nothing to get the totals in the same query:
+
+    GROUP BY GROUPING SETS (("supplier", "tenantname"), ())
+    """
+    columns = sql.SQL(', ').join(sql.Identifier(c) for c in columns)
+    if with_totals:
+        return sql.SQL(' GROUP BY GROUPING SETS (({}), ())').format(columns)
+    return sql.SQL(' GROUP BY ') + columns
+
+
+def _build_totals_flag(group_by):
     """
-    return sql.SQL(' GROUP BY ') + sql.SQL(', ').join(
-        sql.Identifier(c) for c in columns
+    Format the select of the totals flag, which is 1 for the totals row only.
+
+    GROUPING("supplier") as "totals_row"
+    """
+    return sql.SQL('GROUPING({}) as {}').format(
+        sql.Identifier(sorted(group_by)[0]), sql.Identifier(TOTALS_COLUMN)
     )
 
 
@@ -254,66 +405,37 @@ def revert_back_to_camelcase(data, aliases):
 
 def generate_excel_report(parameters, data, totals):
     """generate an excel report for article status"""
-    # NOTE indexing on excel starts from 1.
-
     groups = parameters['groups']
     fields = parameters['fields_']
     metadata = parameters['columnMetadata']
+    header = [*groups, *fields]
 
-    wb = Workbook()
-    ws = wb.active
-    ws.title = parameters['report_name']
+    writer = ExcelWriter(title=parameters['report_name'])
+    formatters = column_formatters(header, metadata)
 
-    # copy style from the first field, because using Font(bold=True) uses different
-    # defaults for font name etc
-    bold = copy(ws['A1'].font)
-    bold.bold = True
-
-    for i, value in enumerate([*groups, *fields], start=1):
-        ws.cell(
-            row=1, column=i, value=lookup(metadata, f'{value}.label', value)
-        ).font = bold
-
-    # start from 2, 1 is the header row
-    for row_idx, row in enumerate(data, start=2):
-        for column_idx, key in enumerate([*groups, *fields], start=1):
-            value, format_ = format_value(metadata, key, row[key])
-            ws.cell(row=row_idx, column=column_idx, value=value).number_format = format_
+    # in the totals row we have a label 'total' and then the total values. if
+    # we have groups we merge those columns together and put the 'total' label
+    # in there. Groups such as brand or collection do not have totals. if not
+    # we start all rows one column later to make room for the label.
+    offset = 0 if groups else 1
+    writer.append_labels(header, metadata, offset=offset)
+    writer.append_rows(
+        ([row[key] for key in header] for row in data), formatters, offset=offset
+    )
 
-    # The row after the header and data rows
-    totals_row = len(data) + 2
+    bold = writer.bold
+    writer.append(
+        [writer.cell('total', font=bold)]
+        + [None] * (len(groups) - 1)
+        + [
+            writer.cell(*format_(totals[field]), font=bold)
+            for format_, field in zip(formatters[len(groups) :], fields)
+        ]
+    )
+    if len(groups) > 1:
+        writer.merge_last_row(len(groups))
 
-    # in the header row we have a label 'totals' and then the total values. if
-    # we have groups we merge those columns together and put the 'totals' label
-    # in there. Groups such as brand or collection do not have totals. if not
-    # we insert a new column.
-    if groups:
-        ws.merge_cells(
-            start_row=totals_row,
-            start_column=1,
-            end_row=totals_row,
-            end_column=len(groups),
-        )
-        first_non_group_column = len(groups) + 1
-    else:
-        ws.insert_cols(1)
-        first_non_group_column = 2
-
-    ws.cell(row=totals_row, column=1, value='total').font = bold
-    for column, field in enumerate(fields, start=first_non_group_column):
-        value, format_ = format_value(metadata, field, totals[field])
-        cell = ws.cell(row=totals_row, column=column, value=value)
-        cell.font = bold
-        cell.number_format = format_
-
-    tmp = NamedTemporaryFile()
-    wb.save(tmp.name + '.xlsx')
-    tmp.seek(0)
-
-    if os.getenv('DEBUG'):
-        wb.save('test.xlsx')
-
-    return tmp
+    return writer.save()
 
 
 def default_filter_values(result, schema):
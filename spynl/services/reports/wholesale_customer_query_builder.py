@@ -9,10 +9,12 @@ from psycopg2 import sql
 
 from spynl.services.reports.utils import build_filter_values  # noqa: F401
 from spynl.services.reports.utils import (
+    TOTALS_COLUMN,
     _build_dependencies,
     _build_group_by,
     _build_select_column,
     _build_sort,
+    _build_totals_flag,
     _build_where,
 )
 
@@ -211,17 +213,26 @@ def _build_outer_selects(columns, t1, t2, aliases=None):
     return sql.SQL('SELECT ') + sql.SQL(', ').join(selects)
 
 
-def _build_inner_query(columns, where, t1, t2):
+def _build_inner_query(columns, where, t1, t2, with_totals=False):
     query = _build_inner_selects(columns, t1, t2)
     group_by = columns - (AGGREGATED | COMPUTED.keys())
+    if with_totals:
+        query += sql.SQL(', ') + _build_totals_flag(group_by)
     query += sql.SQL(' FROM "transactions"')
     query += _build_where(where) if where else sql.SQL('')
     if group_by:
-        query += _build_group_by(group_by)
+        query += _build_group_by(group_by, with_totals=with_totals)
     return query
 
 
-def build(columns, where, sort, t1, t2, aliases=None):
+def build(columns, where, sort, t1, t2, aliases=None, with_totals=False):
+    """
+    Build the full query.
+
+    with_totals adds the totals row to the result, as the first row (see
+    TOTALS_COLUMN). It is ignored if there is nothing to group by, then the only
+    row is the totals row.
+    """
     if isinstance(t1, datetime):
         t1 = int(t1.timestamp())
 
@@ -232,8 +243,16 @@ def build(columns, where, sort, t1, t2, aliases=None):
     # if dependencies == columns:
     #     return _build_inner_query(columns, where, t1, t2)
 
-    inner_query = _build_inner_query(dependencies, where, t1, t2)
+    with_totals = with_totals and bool(dependencies - (AGGREGATED | COMPUTED.keys()))
+    if with_totals:
+        sort = [(TOTALS_COLUMN, 'DESC'), *sort]
+
+    inner_query = _build_inner_query(
+        dependencies, where, t1, t2, with_totals=with_totals
+    )
     query = _build_outer_selects(columns, t1, t2, aliases)
+    if with_totals:
+        query += sql.SQL(', {}').format(sql.Identifier(TOTALS_COLUMN))
     query += sql.SQL(' FROM ({}) as "inner"').format(inner_query)
 
     # Append the sort
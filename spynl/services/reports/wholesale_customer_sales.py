@@ -18,10 +18,11 @@ from spynl.locale import SpynlTranslationString as _
 from spynl.main.serial.file_responses import (
     METADATA_DESCRIPTION,
     ColumnMetadata,
-    export_csv,
     export_header,
+    iter_csv,
+    iter_json,
     make_pdf_file_response,
-    serve_csv_response,
+    serve_csv,
     serve_excel_response,
 )
 
@@ -29,6 +30,7 @@ from spynl.api.retail.exceptions import NoDataToExport
 from spynl.api.retail.utils import round_results
 
 from spynl.services.pdf.pdf import generate_article_status_html_css, generate_pdf
+from spynl.services.reports.cache import fetch_rows
 from spynl.services.reports.utils import (
     CollectionSchema,
     debug_query,
@@ -36,6 +38,10 @@ from spynl.services.reports.utils import (
     generate_excel_report,
     prepare_filter_response,
     revert_back_to_camelcase,
+    serve_stream,
+    split_totals,
+    stream_rows,
+    streaming_enabled,
 )
 from spynl.services.reports.wholesale_customer_query_builder import (
     build,
@@ -340,10 +346,7 @@ class ParamSchema(Schema):
             )
 
     @staticmethod
-    def to_query(data, totals=False):
-        if totals:
-            data = {**data, 'sort': [], 'groups': []}
-
+    def to_query(data, with_totals=False):
         t1, t2 = data['filter'].get('startDate'), data['filter'].get('endDate')
 
         filter_ = {
@@ -353,7 +356,9 @@ class ParamSchema(Schema):
         fields_ = {ALIAS_TO_COLUMN[f] for f in data['fields_'] + data['groups']}
         sort = SortSchema.build_implicit_sort(data['sort'], data['groups'])
 
-        return build(fields_, filter_, sort, t1, t2, COLUMN_TO_ALIAS)
+        return build(
+            fields_, filter_, sort, t1, t2, COLUMN_TO_ALIAS, with_totals=with_totals
+        )
 
     class Meta:
         unknown = EXCLUDE
@@ -397,41 +402,31 @@ def report(ctx, request, format='json'):
     """
     schema = ParamSchema(context={'tenant_id': request.requested_tenant_id})
     data = schema.load(request.json_payload)
-    query = schema.to_query(data)
 
-    with request.redshift.cursor() as cursor:
-        debug_query(cursor, query)
-        cursor.execute(query)
-        result = cursor.fetchall()
+    if format in ('json', 'csv') and streaming_enabled(request):
+        return stream_report(request, schema, data, format)
 
+    query = schema.to_query(data, with_totals=format != 'csv')
+    result = fetch_rows(request, query)
+
+    totals = split_totals(result)
     if not result:
         if format == 'json':
             return {'data': [], 'totals': []}
         raise NoDataToExport()
+    if totals is None:
+        # nothing was grouped by, so the only row is the totals row.
+        totals = dict(result[0])
 
     result = revert_back_to_camelcase(result, LOWER_TO_CAMEL)
     round_results(result, 2)
 
-    reference_order = [
-        i for i in data['groups'] + data['fields_'] if i in COLUMN_TO_ALIAS.values()
-    ]
-    header = export_header(result, reference_order)
+    header = report_header(data, result[0])
 
     if format == 'csv':
-        temp_file = export_csv(header, result)
-        return serve_csv_response(request.response, temp_file)
-
-    totals_query = schema.to_query(data, totals=True)
-    with request.redshift.cursor() as cursor:
-        debug_query(cursor, totals_query)
-        cursor.execute(totals_query)
-        totals = cursor.fetchall()
+        return serve_csv(request.response, header, result)
 
-    totals = revert_back_to_camelcase(totals, LOWER_TO_CAMEL)
-    totals = totals[0]
-    # assign an empty string to the columns in the report which are not numeric
-    for k in result[0]:
-        totals.setdefault(k, '')
+    totals = prepare_totals(data, totals, result[0])
 
     if format == 'json':
         return {'data': result, 'totals': totals}
@@ -454,6 +449,50 @@ def report(ctx, request, format='json'):
         return serve_excel_response(request.response, temp_file, filename)
 
 
+def prepare_row(row):
+    """Revert the column names to camelcase and round the values of a row."""
+    row = revert_back_to_camelcase(row, LOWER_TO_CAMEL)
+    round_results([row], 2)
+    return row
+
+
+def report_header(data, row):
+    reference_order = [
+        i for i in data['groups'] + data['fields_'] if i in COLUMN_TO_ALIAS.values()
+    ]
+    return export_header([row], reference_order)
+
+
+def prepare_totals(data, totals, columns):
+    totals = revert_back_to_camelcase(totals, LOWER_TO_CAMEL)
+    # assign an empty string to the columns in the report which are not numeric
+    for k in columns:
+        if k not in totals or k in data['groups']:
+            totals[k] = ''
+    return totals
+
+
+def stream_report(request, schema, data, format):
+    """Stream the csv or json report from a server side cursor."""
+    query = schema.to_query(data, with_totals=format == 'json')
+    rows = stream_rows(request, query, transform=prepare_row)
+    if not rows:
+        rows.close()
+        if format == 'json':
+            return {'data': [], 'totals': []}
+        raise NoDataToExport()
+
+    first = revert_back_to_camelcase(dict(rows.first), LOWER_TO_CAMEL)
+    if format == 'csv':
+        header = report_header(data, first)
+        return serve_stream(request.response, rows, iter_csv(header, rows), 'text/csv')
+
+    totals = rows.totals if rows.totals is not None else dict(rows.first)
+    totals = prepare_totals(data, totals, first)
+    app_iter = iter_json(rows, totals=totals)
+    return serve_stream(request.response, rows, app_iter, 'application/json')
+
+
 def report_csv(ctx, request):
     """
     Wholesale customer sales report csv file
@@ -10,7 +10,14 @@ from pyramid.testing import DummyRequest
 
 from spynl.main.dateutils import date_to_str
 
-from spynl.api.auth.authentication import challenge, scramble_password, set_password
+from spynl.api.auth import authentication
+from spynl.api.auth.authentication import (
+    challenge,
+    challenge_password,
+    scramble_password,
+    set_password,
+)
+from spynl.api.auth.exceptions import SpynlPasswordRequirementsException
 from spynl.api.auth.session_cycle import USER_DATA_WHITELIST, get_cookie_domain
 from spynl.api.auth.testutils import mkuser
 
@@ -814,6 +821,7 @@ def test_challenging_rehashes_users_password_and_ensures_loggingin(
     user_after = db.users.find_one({'email': user2['email']})
     assert user_after['hash_type'] != '1'
     assert user_before['password_hash'] != user_after['password_hash']
+    assert user_before['password_salt'] == user_after['password_salt']
     # Ensure user can still login
     assert challenge(request_, 'blah2', user2['username'])
 
@@ -829,6 +837,48 @@ def test_scramble():
         '5a705bb18b82e2ac0384b5127db97016e63609f712bc90e3506cfbea97599f46f'
     )
     assert sha == scramble_password('1', '1', '3')
+    pbkdf2_sha256 = '$pbkdf2-sha256$1000$8jqHh2EbyiAKJ1lVfYvYIWc7wdNA2FjITCc+fetyl9s='
+    assert pbkdf2_sha256 == scramble_password('1', '1', '4', iterations=1000)
+
+
+def test_challenge_password_uses_the_iterations_of_the_hash():
+    scrambled = scramble_password('pwd', 'salt', '4', iterations=1000)
+    assert challenge_password('pwd', scrambled, 'salt', '4')
+    assert not challenge_password('pwe', scrambled, 'salt', '4')
+    assert not challenge_password('pwd', None, 'salt', '4')
+    assert not challenge_password('pwd', 'not a hash', 'salt', '4')
+
+
+def test_challenge_rehashes_when_iterations_change(
+    db, user2, set_db, config, request_, monkeypatch
+):
+    monkeypatch.setattr(authentication, 'PBKDF2_ITERATIONS', 1000)
+    challenge(request_, 'blah2', user2['username'])
+    user = db.users.find_one({'email': user2['email']})
+    assert user['password_hash'].startswith('$pbkdf2-sha256$1000$')
+
+    monkeypatch.setattr(authentication, 'PBKDF2_ITERATIONS', 2000)
+    assert challenge(request_, 'blah2', user2['username'])
+    user = db.users.find_one({'email': user2['email']})
+    assert user['password_hash'].startswith('$pbkdf2-sha256$2000$')
+    # the password did not change, so it is not in the history
+    assert 'oldPasswords' not in user
+
+
+def test_password_history_after_rehash(
+    db, user2, set_db, config, request_, monkeypatch
+):
+    """rehashing keeps the salt, so the history can still be checked."""
+    monkeypatch.setattr(authentication, 'PBKDF2_ITERATIONS', 1000)
+    challenge(request_, 'blah2', user2['username'])
+    user = db.users.find_one({'email': user2['email']})
+    set_password(request_, user, 'blah3')
+
+    monkeypatch.setattr(authentication, 'PBKDF2_ITERATIONS', 2000)
+    assert challenge(request_, 'blah3', user2['username'])
+    user = db.users.find_one({'email': user2['email']})
+    with pytest.raises(SpynlPasswordRequirementsException):
+        set_password(request_, user, 'blah2')
 
 
 def test_time(app, set_db):
@@ -869,11 +919,11 @@ def test_login_rehashes_passwords_when_user_uses_old_hash_type(app, db, set_db):
     payload = {'username': 'blahuser', 'password': 'new.pass123'}
     app.post_json('/login', payload, status=200)
     user = db.users.find_one({'username': 'blahuser'})
-    # default hash type is 2(setting in .ini file)
-    assert user['hash_type'] == '2'
+    assert user['hash_type'] == authentication.HASH_TYPE
     # hash changed during login..
-    assert user['password_hash'] == scramble_password(
-        'new.pass123', user['password_salt'], '2'
+    assert user['password_hash'] != new_pass_hash
+    assert challenge_password(
+        'new.pass123', user['password_hash'], user['password_salt'], user['hash_type']
     )
 
 
@@ -12,12 +12,16 @@ for our use case:
 The resources we test are in spynl.auth.testutils.
 """
 
+import itertools
+import logging
+
 import bson
 import pytest
-from pyramid.authorization import Allow
+from pyramid.authorization import DENY_ALL, Allow, Authenticated, Deny
 
 from spynl.main.routing import Resource
 
+from spynl.api.auth.authorization import IAuthorizationPolicy
 from spynl.api.auth.plugger import includeme
 from spynl.api.auth.testutils import login, make_auth_header, mkuser
 
@@ -361,3 +365,68 @@ def test_role_access(app):
     app.get('/set-tenant', params)
     app.get('/test-pos', status=200)
     app.get('/test-dashboard', status=200)
+
+
+class ParentResource(Resource):
+    __acl__ = [(Allow, 'role:parent', ('read', 'edit')), (Deny, 'role:b', 'read')]
+
+
+class CompiledResource(Resource):
+    __parent__ = ParentResource
+    __acl__ = [
+        (Deny, 'role:a', 'delete'),
+        (Allow, 'role:a', ('read', 'edit', 'delete')),
+        (Allow, 'role:b', 'edit'),
+        (Allow, Authenticated, 'read'),
+    ]
+
+
+class DenyAllResource(Resource):
+    __acl__ = [(Allow, 'role:a', 'read'), DENY_ALL, (Allow, 'role:b', 'read')]
+
+
+@pytest.mark.parametrize('resource_class', [CompiledResource, DenyAllResource])
+def test_compiled_acls_decide_like_the_acls(resource_class):
+    policy = IAuthorizationPolicy([])
+    context = resource_class(None)
+    roles = ['role:a', 'role:b', 'role:parent', Authenticated, 'userid']
+    for size in range(len(roles) + 1):
+        for principals in itertools.combinations(roles, size):
+            for permission in ('read', 'edit', 'delete'):
+                compiled = policy.check_acls(context, list(principals), permission)
+                walked = policy.walk_acls(context, list(principals), permission)
+                assert (bool(compiled), compiled.ace, compiled.context) == (
+                    bool(walked),
+                    walked.ace,
+                    walked.context,
+                )
+
+
+def test_compiled_acl_decisions_do_not_depend_on_the_user():
+    policy = IAuthorizationPolicy([])
+    context = CompiledResource(None)
+    assert policy.check_acls(context, ['role:b', 'user1'], 'edit')
+    assert policy.check_acls(context, ['role:b', 'user2'], 'edit')
+    assert list(policy.acl_table(CompiledResource)._decisions) == [
+        (frozenset(['role:b']), 'edit')
+    ]
+
+
+def test_dynamic_acls_are_not_compiled():
+    class DynamicResource(Resource):
+        def __acl__(self):
+            return [(Allow, 'role:a', 'read')]
+
+    policy = IAuthorizationPolicy([])
+    assert policy.check_acls(DynamicResource(None), ['role:a'], 'read')
+    assert policy.acl_table(DynamicResource) is None
+
+
+def test_trace_acls(caplog):
+    caplog.set_level(logging.DEBUG, logger='spynl.api.auth.authorization')
+    context = CompiledResource(None)
+    IAuthorizationPolicy([]).check_acls(context, ['role:a'], 'read')
+    assert not caplog.records
+
+    IAuthorizationPolicy([], trace=True).check_acls(context, ['role:a'], 'read')
+    assert "'role:a'" in caplog.records[0].getMessage()
@@ -1,13 +1,21 @@
 """Tests for user sessions."""
 
+import logging
+from copy import deepcopy
 
 import pytest
 from pyramid import testing
 
 from spynl.main.version import __version__ as spynl_version
 
+from spynl.api.auth import session_authentication
 from spynl.api.auth.authentication import scramble_password
-from spynl.api.auth.session_authentication import rolefinder
+from spynl.api.auth.request_methods import IdentityCache, log_identity_cache_stats
+from spynl.api.auth.session_authentication import (
+    MongoDBSession,
+    SessionCache,
+    rolefinder,
+)
 from spynl.api.auth.testutils import mkuser
 
 # not interested in authentication here, so all test users have the same pwd
@@ -125,6 +133,7 @@ def test_change_remember_me(db, app, login):
 
 def test_rolefinder(spynl_data_db, db, set_db, config):
     """test if rolefinder returns expected roles"""
+
     # this test has nothing to do with principles so remove them.
     def rolefinder_(*args, **kwargs):
         rv = rolefinder(*args, **kwargs)
@@ -138,6 +147,7 @@ def test_rolefinder(spynl_data_db, db, set_db, config):
         endpoint_method='',
     )
     drequest.db = spynl_data_db
+    drequest.identity_cache = IdentityCache(spynl_data_db)
 
     user = db.users.find_one({'username': 'poor_user'})
     roles = rolefinder_(user['_id'], drequest)
@@ -170,6 +180,34 @@ def test_rolefinder(spynl_data_db, db, set_db, config):
     assert roles == ['role:sw-developer', 'role:spynl-developer']
 
 
+def test_rolefinder_uses_identity_cache(spynl_data_db, db, set_db):
+    drequest = testing.DummyRequest(
+        current_tenant_id='a_tenant_id', requested_tenant_id='a_tenant_id'
+    )
+    drequest.db = spynl_data_db
+    drequest.identity_cache = IdentityCache(spynl_data_db)
+
+    user = db.users.find_one({'username': 'dummy_user'})
+    first = rolefinder(user['_id'], drequest)
+    second = rolefinder(user['_id'], drequest)
+    assert first == second
+    assert drequest.identity_cache.stats() == {'fetched': 2, 'saved': 2}
+
+
+def test_identity_cache_stats_are_logged(spynl_data_db, caplog):
+    drequest = testing.DummyRequest(path='/me')
+    event = testing.DummyResource(request=drequest)
+    caplog.set_level(logging.DEBUG, logger='spynl.api.auth.request_methods')
+
+    log_identity_cache_stats(event)
+    assert not caplog.records
+
+    drequest.identity_cache = IdentityCache(spynl_data_db)
+    drequest.identity_cache.saved = 3
+    log_identity_cache_stats(event)
+    assert "'saved': 3" in caplog.records[0].getMessage()
+
+
 def test_no_session_for_unauthenticated_requests(app, db):
     """
     Do not save sessions without a user_id
@@ -189,3 +227,126 @@ def test_spynl_developer_role(app):
     app.get('/set-tenant', params)
 
     assert app.post_json('/about/sleep', {'sleep': 0}, status=200)
+
+
+class RecordingCollection:
+    """Keeps sessions in a dict and records the calls that write to it."""
+
+    def __init__(self, *documents):
+        self.documents = {document['_id']: document for document in documents}
+        self.reads = 0
+        self.writes = []
+
+    def find_one(self, query):
+        self.reads += 1
+        return deepcopy(self.documents.get(query['_id']))
+
+    def replace_one(self, query, document, upsert=False):
+        self.writes.append(('replace_one', deepcopy(document)))
+
+    def update_one(self, query, update):
+        self.writes.append(('update_one', deepcopy(update)))
+
+    def delete_one(self, query):
+        self.writes.append(('delete_one', query))
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    collection = RecordingCollection(
+        {'_id': 'sid', '_remember_me': False, 'auth___userid': 1, 'username': 'x'}
+    )
+    monkeypatch.setattr(MongoDBSession, '_collection', lambda self: collection)
+    monkeypatch.setattr(session_authentication, 'SESSION_CACHE', SessionCache(ttl=0))
+    return collection
+
+
+def test_session_changes_are_saved_in_one_update(sessions):
+    session = MongoDBSession('sid')
+    session['tenant_id'] = 'a'
+    session['tenant_id'] = 'b'
+    del session['username']
+    session.remember_me = True
+    assert not sessions.writes
+
+    session.save()
+    session.save()
+    assert sessions.writes == [
+        (
+            'update_one',
+            {
+                '$set': {'tenant_id': 'b', '_remember_me': True},
+                '$unset': {'username': ''},
+            },
+        )
+    ]
+
+
+def test_read_session_is_not_saved(sessions):
+    session = MongoDBSession('sid')
+    assert session['username'] == 'x'
+    session.save()
+    assert not sessions.writes
+
+
+def test_new_session_is_saved_once_it_has_a_user(sessions):
+    session = MongoDBSession()
+    session['tenant_id'] = 'a'
+    session.save()
+    assert not sessions.writes
+
+    session['auth.userid'] = 1
+    session.save()
+    session['tenant_id'] = 'b'
+    session.save()
+    (method, document), update = sessions.writes
+    assert method == 'replace_one'
+    assert document['auth___userid'] == 1 and document['tenant_id'] == 'a'
+    assert update == ('update_one', {'$set': {'tenant_id': 'b'}})
+
+
+def test_changed_saves_nested_values(sessions):
+    session = MongoDBSession('sid')
+    session['settings'] = {'a': 1}
+    session.save()
+    session['settings']['a'] = 2
+    session.changed()
+    session.save()
+    assert sessions.writes[-1] == (
+        'update_one',
+        {
+            '$set': {
+                '_remember_me': False,
+                'auth___userid': 1,
+                'username': 'x',
+                'settings': {'a': 2},
+            }
+        },
+    )
+
+
+def test_session_cache(sessions, monkeypatch):
+    cache = SessionCache(ttl=60)
+    monkeypatch.setattr(session_authentication, 'SESSION_CACHE', cache)
+    # changes that are not saved do not end up in the cache
+    MongoDBSession('sid')['tenant_id'] = 'a'
+    session = MongoDBSession('sid')
+    assert 'tenant_id' not in session
+    session['tenant_id'] = 'b'
+    session.save()
+    assert MongoDBSession('sid')['tenant_id'] == 'b'
+    assert sessions.reads == 1
+
+    MongoDBSession('sid').invalidate()
+    MongoDBSession('sid')
+    assert sessions.reads == 2
+
+
+def test_session_cache_remove_user():
+    cache = SessionCache(ttl=60)
+    cache.set('a', {'_id': 'a', 'auth___userid': 1})
+    cache.set('b', {'_id': 'b', 'auth___userid': 1})
+    cache.set('c', {'_id': 'c', 'auth___userid': 2})
+    cache.remove_user(1, keep='b')
+    assert cache.get('a') is None
+    assert cache.get('b') and cache.get('c')
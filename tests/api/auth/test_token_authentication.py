@@ -1,3 +1,4 @@
+import datetime
 import uuid
 
 import bson
@@ -199,3 +200,47 @@ def test_cannot_revoke(spynl_data_db, monkeypatch):
     monkeypatch.setattr('boto3.client', fake_client(False))
     with pytest.raises(TokenError):
         tokens.revoke(spynl_data_db, token['_id'])
+
+
+@pytest.fixture
+def token_cache(monkeypatch):
+    """The process-wide token cache, which is disabled in the other tests."""
+    cache = tokens.TOKEN_CACHE
+    cache.invalidate()
+    monkeypatch.setattr(cache, 'ttl', 60)
+    monkeypatch.setattr(cache, 'hits', 0)
+    monkeypatch.setattr(cache, 'misses', 0)
+    return cache
+
+
+def test_token_cache(spynl_data_db, data, token_cache):
+    token = tokens.generate(spynl_data_db, USERID, '1')['token']
+    assert token_cache.find_one(spynl_data_db, token)['user_id'] == USERID
+    assert token_cache.find_one(spynl_data_db, token)['user_id'] == USERID
+    assert token_cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+    tokens.revoke(spynl_data_db, token)
+    assert token_cache.find_one(spynl_data_db, token) is None
+
+
+def test_token_cache_signal(spynl_data_db, data, token_cache, monkeypatch):
+    """A token revoked by one process is dropped by the others."""
+    monkeypatch.setattr(token_cache, 'signal', True)
+    other_process = tokens.TokenCache(ttl=60, signal=True)
+    token = tokens.generate(spynl_data_db, USERID, '1')['token']
+    assert other_process.find_one(spynl_data_db, token)
+
+    tokens.revoke(spynl_data_db, token)
+    assert other_process.find_one(spynl_data_db, token)
+    # the next check for revoked tokens
+    other_process._last_poll -= datetime.timedelta(seconds=2)
+    assert other_process.find_one(spynl_data_db, token) is None
+
+
+def test_token_is_looked_up_once(app, spynl_data_db, data, token_cache):
+    headers = make_auth_header(
+        spynl_data_db, USERID, '1', payload={'roles': ['pos-device']}
+    )
+    app.get('/test-pos', headers=headers, status=200)
+    app.get('/test-pos', headers=headers, status=200)
+    assert token_cache.stats()['misses'] == 1
@@ -35,6 +35,12 @@ SPYNL_SETTINGS = {
     'spynl.mongo.max_limit': 100,
     'spynl.mongo.max_agglimit': 100,
     'spynl.mongo.large_collection_threshold': 100000,
+    # tests create indexes halfway through the session
+    'spynl.mongo.index_cache_ttl': 0,
+    # tests change sessions in the database
+    'spynl.auth.session_cache_ttl': 0,
+    # tests insert the same tokens again
+    'spynl.auth.token_cache_ttl': 0,
     'spynl.auth.otp.jwt.secret_key': 'secret',
     'spynl.auth.otp.issuer': 'sw2fa',
     'pyramid.default_locale_name': 'en',
@@ -147,11 +153,12 @@ def db(spynl_data_db):
 
 
 @pytest.fixture(autouse=True)
-def clean_db_collections(db):
+def clean_db_collections(spynl_data_db, db):
     """Clean collections after every test."""
     yield
     for coll in db.list_collection_names():
         db[coll].delete_many({})
+    spynl_data_db.invalidate_index_cache()
 
 
 def include_dummy_views(config):
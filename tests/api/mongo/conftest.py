@@ -21,6 +21,7 @@ def mongo_config(db):
         'spynl.mongo.db': db.name,
         'spynl.mongo.max_limit': 100,
         'spynl.mongo.max_agglimit': 10,
+        'spynl.mongo.index_cache_ttl': 0,
     }
     config = testing.setUp(settings=settings)
     # hook add_endpoint so mongo plugger can be hooked too
@@ -436,6 +436,16 @@ def test_incremental_id_is_created_correctly_after_100000(db, mongo_config, requ
     assert db.test_collection.find_one({'name': '2'})['_id'] == '100007'
 
 
+def test_incremental_id_skips_ids_saved_without_counter(db, mongo_config, request_):
+    """Ids that were used without the counter are skipped."""
+    save_with_incremental_id(MongoResource(), request_, [{'name': '0'}])
+    db.test_collection.insert_many([{"_id": "100001"}, {"_id": "100002"}])
+
+    save_with_incremental_id(MongoResource(), request_, [{'name': '1'}])
+    assert db.test_collection.find_one({'name': '0'})['_id'] == '100000'
+    assert db.test_collection.find_one({'name': '1'})['_id'] == '100003'
+
+
 def test_save_new_document_that_returns_string_instead_of_object_id(
     mongo_config, request_
 ):
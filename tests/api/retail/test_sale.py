@@ -5,6 +5,9 @@ from copy import deepcopy
 
 import pytest
 from bson import ObjectId
+from pymongo.errors import AutoReconnect
+
+from spynl_dbaccess.database import UnitOfWork
 
 from spynl.api.auth.testutils import mkuser
 from spynl.api.retail.sales import SaleFilterSchema
@@ -378,3 +381,106 @@ def test_add_fiscal_receipt(app):
     assert updated_sale_resp.json['data'][0]['fiscal_shift_nr'] == "1"
     assert updated_sale_resp.json['data'][0]['fiscal_date'] == "2022-09-28"
     assert updated_sale_resp.json['data'][0]['fiscal_printer_id'] == "1234567890A"
+
+
+def test_add_batch(app, spynl_data_db):
+    sales = [
+        {**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-1'},
+        {**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-2'},
+        {**BADSALE, 'clientId': 'pos-3'},
+        {**SALE, 'customer': {'id': str(CUSTOMER_ID)}, 'clientId': 'pos-4'},
+    ]
+    response = app.post('/sales/add-batch', json.dumps({'data': sales})).json
+    results = response['data']
+    assert [result['status'] for result in results] == ['ok', 'ok', 'error', 'ok']
+    assert 'errors' in results[2]
+    assert spynl_data_db.transactions.count_documents({}) == 3
+    first = spynl_data_db.transactions.find_one({'_id': ObjectId(results[0]['_id'])})
+    second = spynl_data_db.transactions.find_one({'_id': ObjectId(results[1]['_id'])})
+    assert first['nr'] == 'pos-1'
+    assert first['clientId'] == 'pos-1'
+    assert second['receiptNr'] - first['receiptNr'] == 1
+
+    # sending the batch again does not add the sales again
+    response = app.post('/sales/add-batch', json.dumps({'data': sales})).json
+    assert [result['status'] for result in response['data']] == [
+        'duplicate',
+        'duplicate',
+        'error',
+        'duplicate',
+    ]
+    assert response['data'][0]['_id'] == results[0]['_id']
+    assert spynl_data_db.transactions.count_documents({}) == 3
+
+
+def test_add_batch_numbers_valid_sales_only(app, spynl_data_db):
+    bad = {key: value for key, value in BADSALE.items() if key != 'receiptNr'}
+    sales = [
+        {**bad, 'clientId': 'pos-1'},
+        {**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-2'},
+        {**bad, 'clientId': 'pos-3'},
+        {**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-4'},
+    ]
+    results = app.post('/sales/add-batch', json.dumps({'data': sales})).json['data']
+    assert [result['status'] for result in results] == ['error', 'ok', 'error', 'ok']
+    sales = [{**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-5'}]
+    app.post('/sales/add-batch', json.dumps({'data': sales}))
+
+    numbers = [
+        spynl_data_db.transactions.find_one({'clientId': client_id})['receiptNr']
+        for client_id in ('pos-2', 'pos-4', 'pos-5')
+    ]
+    # the sales that were not valid did not use up receipt numbers
+    assert numbers == [numbers[0], numbers[0] + 1, numbers[0] + 2]
+
+
+def test_add_batch_write_error(app, spynl_data_db, monkeypatch):
+    commit = UnitOfWork.commit
+    calls = []
+
+    def fail_first(self):
+        calls.append(self)
+        if len(calls) == 1:
+            raise AutoReconnect('connection lost')
+        commit(self)
+
+    monkeypatch.setattr(UnitOfWork, 'commit', fail_first)
+    sales = [
+        {**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-1'},
+        {**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-2'},
+    ]
+    results = app.post('/sales/add-batch', json.dumps({'data': sales})).json['data']
+    assert [result['status'] for result in results] == ['error', 'ok']
+    assert spynl_data_db.transactions.count_documents({'clientId': 'pos-1'}) == 0
+    assert spynl_data_db.transactions.count_documents({'clientId': 'pos-2'}) == 1
+
+
+def test_add_batch_client_id_added_meanwhile(app, spynl_data_db):
+    sales = [{**SALE_WITHOUT_NR_RECEIPTNR, 'clientId': 'pos-1'}]
+    app.post('/sales/add-batch', json.dumps({'data': sales}))
+    # a sale with the clientId that is not found by nr, like one added by a
+    # request that ran at the same time
+    existing = spynl_data_db.transactions.find_one({'clientId': 'pos-1'})
+    spynl_data_db.transactions.update_one(
+        {'_id': existing['_id']}, {'$set': {'nr': 'other'}}
+    )
+    results = app.post('/sales/add-batch', json.dumps({'data': sales})).json['data']
+    assert results == [
+        {'clientId': 'pos-1', 'status': 'duplicate', '_id': str(existing['_id'])}
+    ]
+    assert spynl_data_db.transactions.count_documents({'clientId': 'pos-1'}) == 1
+
+
+def test_add_batch_duplicate_nr(app):
+    sales = [
+        {**SALE, 'clientId': 'pos-1'},
+        {**SALE, 'clientId': 'pos-1'},
+        {**SALE, 'clientId': 'pos-2'},
+    ]
+    results = app.post('/sales/add-batch', json.dumps({'data': sales})).json['data']
+    assert [result['status'] for result in results] == ['ok', 'duplicate', 'error']
+    assert results[1]['_id'] == results[0]['_id']
+
+
+def test_add_batch_requires_client_id(app):
+    app.post('/sales/add-batch', json.dumps({'data': [SALE]}), status=400)
@@ -1,15 +1,24 @@
 import datetime
+import json
+import zipfile
 
 import openpyxl
 
+from spynl.main.serial import file_responses
 from spynl.main.serial.file_responses import (
     export_csv,
     export_data,
     export_excel,
     export_header,
+    export_zip,
+    iter_csv,
+    iter_json,
+    serve_csv,
     serve_csv_response,
     serve_excel_response,
 )
+from spynl.main.serial.json import make_encoders
+from spynl.main.serial.objects import encode_date
 
 
 def test_export_csv(dummyrequest):
@@ -27,6 +36,54 @@ def test_export_csv(dummyrequest):
     )
 
 
+def test_iter_csv():
+    data = [{'a': i, 'b': 'x' * 1000} for i in range(200)]
+    chunks = list(iter_csv(['b', 'a'], iter(data)))
+    assert len(chunks) > 1
+    assert b''.join(chunks).decode() == export_csv(['b', 'a'], data)
+
+
+def test_serve_csv(dummyrequest):
+    data = [{'a': 1, 'b': None}, {'a': 2, 'c': 'x'}]
+    resp = serve_csv(dummyrequest.response, ['a', 'b'], iter(data))
+    assert resp.content_type == 'text/csv'
+    assert resp.text == 'a,b\r\n1,\r\n2,\r\n'
+
+
+def test_iter_csv_formatters():
+    data = [{'a': 1.5, 'b': 'x'}, {'a': None, 'b': 'y'}]
+    chunks = iter_csv(['a', 'b'], data, formatters={'a': '{:.2f}'.format})
+    assert b''.join(chunks).decode() == 'a,b\r\n1.50,x\r\n,y\r\n'
+
+
+def test_iter_json():
+    data = [{'a': i, 'b': 'é' * 1000} for i in range(200)]
+    chunks = list(iter_json(iter(data), totals={'a': 1}))
+    assert len(chunks) > 1
+    assert json.loads(b''.join(chunks)) == {
+        'data': data,
+        'totals': {'a': 1},
+        'status': 'ok',
+    }
+    assert json.loads(b''.join(iter_json([]))) == {'data': [], 'status': 'ok'}
+
+
+def test_iter_json_encodes_after_the_request(monkeypatch):
+    """The encoder and time zone are looked up before the response is sent."""
+    settings = {'serial_encode_functions': {datetime.datetime: encode_date}}
+    encoder = make_encoders(settings)[False]
+    monkeypatch.setattr(file_responses, 'get_encoder', lambda: encoder)
+    monkeypatch.setattr(file_responses, 'get_user_timezone', lambda: 'Europe/Amsterdam')
+    day = datetime.datetime(2021, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+    chunks = iter_json([{'day': day}], totals={'day': day})
+    monkeypatch.undo()
+    assert json.loads(b''.join(chunks)) == {
+        'data': [{'day': '2021-01-01T13:00:00+0100'}],
+        'totals': {'day': '2021-01-01T13:00:00+0100'},
+        'status': 'ok',
+    }
+
+
 def test_export_excel(dummyrequest):
     day = datetime.datetime(2021, 7, 29, 7, 0, tzinfo=datetime.timezone.utc)
     day_naive = datetime.datetime(2021, 7, 29, 9, 0)
@@ -43,7 +100,7 @@ def test_export_excel(dummyrequest):
         resp.content_type
         == 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
-    ws = openpyxl.load_workbook(resp.app_iter.file.name + '.xlsx').active
+    ws = openpyxl.load_workbook(resp.app_iter.file).active
 
     expected = [[cell.value for cell in row] for row in ws.rows]
 
@@ -54,6 +111,30 @@ def test_export_excel(dummyrequest):
     ]
 
 
+def test_export_excel_formats_columns():
+    metadata = {
+        'price': {'label': 'Price', 'type': 'money'},
+        'margin': {'type': 'percentage', 'decimals': 1},
+    }
+    data = ({'price': 10, 'margin': 25} for _ in range(3))
+    temp_file = export_excel(['price', 'margin'], data, metadata)
+    ws = openpyxl.load_workbook(temp_file).active
+
+    assert [cell.value for cell in ws[1]] == ['Price', 'margin']
+    assert all(cell.font.bold for cell in ws[1])
+    assert [[cell.value for cell in row] for row in ws.iter_rows(min_row=2)] == [
+        [10, 0.25]
+    ] * 3
+    assert ws['A2'].number_format == '€ #,##0.00'
+    assert ws['B2'].number_format == '0.0%'
+
+
+def test_export_zip():
+    with zipfile.ZipFile(export_zip([('a.pdf', b'a'), ('b.pdf', b'b')])) as archive:
+        assert archive.namelist() == ['a.pdf', 'b.pdf']
+        assert archive.read('b.pdf') == b'b'
+
+
 def test_export_header_sorting(request):
     data = [
         {'collection': 'spring', 'brand': 'G-Star', 'warehouse': 'abc'},
@@ -1,11 +1,13 @@
 """Tests for origin whitelists."""
 
-
 from json import loads
 
 import pytest
 from pyramid.httpexceptions import HTTPForbidden
 
+from spynl.main import utils
+from spynl.main.utils import OriginMatcher
+
 
 def test_whitelisted_origin(app):
     """Test whitelisted origin."""
@@ -35,3 +37,33 @@ def test_notwhitelisted_origin(app):
     headers = {"Origin": "http://0.0.0.0:9003"}
     with pytest.raises(HTTPForbidden, match=msg + "'http://0.0.0.0:9003'"):
         app.get('/ping', headers=headers)
+
+
+def test_origin_matcher():
+    matcher = OriginMatcher(
+        'http://0.0.0.0:9001, chrome-extension://,', 'softwearconnect.com,swcloud.nl'
+    )
+    assert matcher.allowed('http://0.0.0.0:9001')
+    assert matcher.allowed('chrome-extension://sdlkhsldkfhlksjhsdfsdf')
+    assert matcher.allowed('https://www.softwearconnect.com')
+    assert not matcher.allowed('http://0.0.0.0:9003')
+    assert not matcher.allowed('http://chrome-extension://')
+    assert not matcher.allowed('https://www.swcloud.com')
+    assert not matcher.allowed('')
+
+
+def test_origin_matcher_caches_decisions(monkeypatch):
+    resolved = []
+
+    def get_tld(origin):
+        resolved.append(origin)
+        return 'swcloud.nl'
+
+    monkeypatch.setattr(utils, 'get_tld', get_tld)
+    matcher = OriginMatcher('', 'swcloud.nl', cache_size=1)
+    assert matcher.allowed('https://a.swcloud.nl')
+    assert matcher.allowed('https://a.swcloud.nl')
+    assert resolved == ['https://a.swcloud.nl']
+    assert matcher.allowed('https://b.swcloud.nl')
+    assert matcher.allowed('https://a.swcloud.nl')
+    assert len(resolved) == 3
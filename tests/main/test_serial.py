@@ -21,6 +21,7 @@ from spynl.main.serial import (
     py,
 )
 from spynl.main.serial.csv import loads as csv_loads
+from spynl.main.serial.objects import SpynlDecoder, TypeEncoder
 
 
 def test_empty():
@@ -281,3 +282,70 @@ def test_csv_loads_csvimport_with_datefield(app):
 def test_decimal_json_dumps():
     """test dumping decimals to floats."""
     assert dumps({'a': Decimal(1)}, 'application/json') == '{"a": 1.0}'
+
+
+def test_type_encoder_subclasses():
+    """subclasses of a registered type use its function, like isinstance."""
+
+    class Date(datetime.datetime):
+        pass
+
+    encoder = TypeEncoder({datetime.date: lambda obj: 'date'})
+    assert encoder(Date(2020, 1, 1)) == 'date'
+    assert encoder(datetime.datetime(2020, 1, 1)) == 'date'
+    assert encoder(1) == '1'
+
+
+def test_type_encoder_chains_functions():
+    """the result of a function is encoded by the functions registered later."""
+    encoder = TypeEncoder({int: lambda obj: obj / 2, float: lambda obj: obj + 0.25})
+    assert encoder(1) == '0.75'
+    # but not by the functions registered earlier
+    assert encoder(1.0) == '1.25'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 20, 1024])
+def test_json_iterdumps(chunk_size):
+    """the chunks together are the same document as dumps makes."""
+    body = {
+        'data': [{'a': i, 'b': Decimal(i)} for i in range(10)],
+        'totals': {'a': 45},
+        'status': 'ok',
+    }
+    chunks = list(json.iterdumps(body, chunk_size=chunk_size))
+    assert b''.join(chunks).decode() == json.dumps(body)
+    assert len(chunks) > 1 or chunk_size > 100
+
+
+def test_decoder_decode_same_as_object_hook():
+    """decode calls the functions like json.loads with the decoder would."""
+    calls = []
+
+    def decode(dic, fieldname, context):
+        calls.append(dic[fieldname])
+        dic[fieldname] = 'decoded'
+
+    body = {'a': [{'date': 1, 'b': {'date': 2}}], 'c': {'d': 3}, 'date': 4}
+    decoder = SpynlDecoder(decode_functions={'date': decode})
+    expected = json_py.loads(json_py.dumps(body), object_hook=decoder)
+    expected_calls = list(calls)
+    calls.clear()
+
+    assert decoder.decode(body) == expected
+    assert calls == expected_calls == [2, 1, 4]
+
+
+def test_decoder_without_fields_is_no_object_hook():
+    assert SpynlDecoder(decode_functions={}).object_hook is None
+    body = {'date': '2020'}
+    assert SpynlDecoder(decode_functions={}).decode(body) is body
+
+
+def test_csv_iterdumps():
+    """the chunks together are the same document as dumps makes."""
+    body = {'data': [{'a': "it's", 'b': 1.5, 'c': None, 'd': [1]} for _ in range(50)]}
+    chunks = list(csv.iterdumps(body, chunk_size=100))
+    assert len(chunks) > 1
+    assert b''.join(chunks).decode() == csv.dumps(body)
+    lines = csv.dumps(body).split('\r\n')
+    assert lines[:2] == ['a,b,c,d', '\'"it\'\'s"\',1.5,null,[1]']
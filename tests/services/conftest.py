@@ -14,7 +14,6 @@ from bson.codec_options import CodecOptions
 from jinja2 import ChoiceLoader, Environment, PackageLoader
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from psycopg2.extras import RealDictCursor
-from psycopg2.pool import ThreadedConnectionPool
 from pymongo import MongoClient
 from pyramid import testing
 from pyramid_mailer import get_mailer
@@ -57,11 +56,17 @@ def settings():
     settings_ = {
         'spynl.redshift.url': REDSHIFT_URL,
         'spynl.redshift.max_connections': 1,
+        'spynl.redshift.connection_max_age': 0,
         'spynl.pretty': '1',
         'spynl.mongo.url': MONGO_URL,
         'spynl.mongo.max_limit': 100,
         'spynl.mongo.max_agglimit': 10000,
         'spynl.mongo.large_collection_threshold': 100000,
+        'spynl.mongo.index_cache_ttl': 0,
+        # tests change sessions in the database
+        'spynl.auth.session_cache_ttl': 0,
+        # tests insert the same tokens again
+        'spynl.auth.token_cache_ttl': 0,
         'spynl.domain': 'localhost',
         'spynl.latestcollection.url': 'https://www.latestcollection.fashion',
         'spynl.latestcollection.master_token': 'masterToken',
@@ -84,16 +89,6 @@ def settings():
     return deepcopy(settings_)
 
 
-@pytest.fixture(autouse=True)
-def patch_connectionpool(monkeypatch):
-    class Pool(ThreadedConnectionPool):
-        def putconn(self, *args, **kwargs):
-            kwargs['close'] = True
-            return super().putconn(*args, **kwargs)
-
-    monkeypatch.setattr('spynl.services.reports.plugger.ThreadedConnectionPool', Pool)
-
-
 @pytest.fixture(scope="session")
 def db():
     """Create and return a unique database."""
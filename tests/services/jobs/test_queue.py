@@ -0,0 +1,113 @@
+import time
+from datetime import timedelta
+
+from gridfs import GridFS
+from pyramid_mailer.message import Attachment
+
+from spynl.main.dateutils import now
+
+from spynl.api.retail.exceptions import NoDataToExport
+
+from spynl.services.jobs.queue import (
+    DONE,
+    FAILED,
+    FILES_COLLECTION,
+    QUEUED,
+    RUNNING,
+    claim,
+    cleanup,
+    fail,
+    finish,
+    keep_lease,
+)
+
+
+def add_job(db, **kwargs):
+    job = {'type': 'test', 'status': QUEUED, 'attempts': 0, 'created': now()}
+    job.update(kwargs)
+    db.jobs.insert_one(job)
+    return job
+
+
+def test_claim_oldest_first(db):
+    add_job(db, _id=2, created=now())
+    add_job(db, _id=1, created=now() - timedelta(seconds=10))
+    job = claim(db)
+    assert job['_id'] == 1
+    assert job['status'] == RUNNING
+    assert job['attempts'] == 1
+    assert claim(db)['_id'] == 2
+    assert claim(db) is None
+
+
+def test_claim_abandoned_job(db):
+    add_job(db, status=RUNNING, attempts=1, started=now() - timedelta(seconds=700))
+    add_job(db, status=RUNNING, attempts=1, started=now())
+    add_job(db, status=RUNNING, attempts=3, started=now() - timedelta(seconds=700))
+    job = claim(db, lease=600, max_attempts=3)
+    assert job['attempts'] == 2
+    assert claim(db, lease=600, max_attempts=3) is None
+
+
+def test_fail_retries_temporary_errors(db):
+    add_job(db, _id=1)
+    fail(db, claim(db), ConnectionError('oops'))
+    assert db.jobs.find_one()['status'] == QUEUED
+    fail(db, claim(db), NoDataToExport())
+    assert db.jobs.find_one()['status'] == FAILED
+
+
+def test_fail_other_errors(db):
+    add_job(db, _id=1)
+    fail(db, claim(db), ValueError('oops'))
+    assert db.jobs.find_one()['status'] == FAILED
+
+
+def test_fail_max_attempts(db):
+    add_job(db, _id=1, attempts=2)
+    fail(db, claim(db), ConnectionError('oops'), max_attempts=3)
+    job = db.jobs.find_one()
+    assert job['status'] == FAILED
+    assert job['error'] == 'oops'
+
+
+def test_keep_lease(db):
+    add_job(db, _id=1)
+    job = claim(db)
+    db.jobs.update_one({'_id': 1}, {'$set': {'started': now() - timedelta(1)}})
+    with keep_lease(db, job, lease=0.3):
+        time.sleep(0.2)
+    assert claim(db, lease=3600) is None
+
+
+def test_finish_after_losing_the_job(db):
+    add_job(db, _id=1)
+    job = claim(db)
+    db.jobs.update_one({'_id': 1}, {'$set': {'started': now() - timedelta(1)}})
+    assert claim(db, lease=600)['attempts'] == 2
+    finish(db, job, Attachment('report.csv', 'text/csv', b'a,b\n'))
+    assert db.jobs.find_one()['status'] == RUNNING
+    assert GridFS(db, collection=FILES_COLLECTION).find_one() is None
+
+
+def test_finish_stores_file(db):
+    add_job(db, _id=1)
+    finish(db, claim(db), Attachment('report.csv', 'text/csv', b'a,b\n1,2\n'))
+    job = db.jobs.find_one()
+    assert job['status'] == DONE
+    assert job['filename'] == 'report.csv'
+    file = GridFS(db, collection=FILES_COLLECTION).get(job['file_id'])
+    assert file.read() == b'a,b\n1,2\n'
+
+
+def test_cleanup(db):
+    add_job(db, _id=1)
+    finish(db, claim(db), Attachment('report.csv', 'text/csv', b'a,b\n'))
+    add_job(db, _id=2, status=RUNNING, attempts=3, started=now() - timedelta(1))
+    cleanup(db, keep=3600)
+    assert db.jobs.find_one({'_id': 1})['status'] == DONE
+    assert db.jobs.find_one({'_id': 2})['status'] == FAILED
+
+    cleanup(db, keep=0)
+    assert db.jobs.count_documents({}) == 0
+    assert GridFS(db, collection=FILES_COLLECTION).find_one() is None
@@ -0,0 +1,174 @@
+"""Tests for the mail outbox, with a local SMTP server as the mail server."""
+
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from pyramid import testing
+from pyramid_mailer.message import Message
+
+from spynl.main.dateutils import now
+from spynl.main.mail import _sendmail as sendmail
+from spynl.main.testutils import DebuggingSMTPServer
+
+from spynl.services.mail import plugger
+from spynl.services.mail.outbox import (
+    COLLECTION,
+    FAILED,
+    QUEUED,
+    SENDING,
+    SENT,
+    SMTPPool,
+    claim,
+    deliver,
+    enqueue,
+    retry_delay,
+    work,
+)
+
+
+@pytest.fixture
+def smtp_server():
+    with DebuggingSMTPServer() as server:
+        yield server
+
+
+@pytest.fixture
+def pool(smtp_server):
+    pool = SMTPPool(host=smtp_server.host, port=smtp_server.port)
+    yield pool
+    pool.close()
+
+
+def message(recipient='customer@example.com', subject='Receipt'):
+    return Message(
+        sender='info@spynl.com',
+        recipients=[recipient],
+        subject=subject,
+        body='Thank you',
+    )
+
+
+@pytest.fixture
+def outbox_config(db):
+    settings = {
+        'spynl.mail.outbox': 'true',
+        'spynl.mongo.db': db,
+        'mail.sender': 'info@spynl.com',
+    }
+    config = testing.setUp(settings=settings)
+    config.include('pyramid_mailer.testing')
+    config.include(plugger)
+    yield config
+    testing.tearDown()
+
+
+def test_sendmail_adds_to_outbox(db, outbox_config):
+    request = testing.DummyRequest(registry=outbox_config.registry)
+    assert sendmail(request, 'customer@example.com', 'Receipt', 'Thanks')
+    queued = db[COLLECTION].find_one()
+    assert queued['status'] == QUEUED
+    assert queued['recipients'] == ['customer@example.com']
+    assert queued['subject'] == 'Receipt'
+    assert b'Thanks' in queued['data']
+
+
+def test_claim_is_due_and_exclusive(db):
+    enqueue(db, message())
+    later = enqueue(db, message())
+    db[COLLECTION].update_one(
+        {'_id': later}, {'$set': {'next_attempt': now() + timedelta(minutes=1)}}
+    )
+    claimed = claim(db, 'worker-1')
+    assert len(claimed) == 1
+    assert claimed[0]['status'] == SENDING
+    assert claimed[0]['attempts'] == 1
+    assert claim(db, 'worker-2') == []
+
+
+def test_claim_abandoned_message(db):
+    _id = enqueue(db, message())
+    claim(db, 'worker-1')
+    db[COLLECTION].update_one(
+        {'_id': _id}, {'$set': {'claimed': now() - timedelta(seconds=600)}}
+    )
+    assert claim(db, 'worker-2', lease=300)[0]['attempts'] == 2
+    db[COLLECTION].update_one(
+        {'_id': _id}, {'$set': {'claimed': now() - timedelta(seconds=600)}}
+    )
+    assert claim(db, 'worker-3', lease=300, max_attempts=2) == []
+
+
+def test_work_sends_batch_over_one_connection(db, smtp_server):
+    for i in range(3):
+        enqueue(db, message(subject='Receipt {}'.format(i)))
+    registry = SimpleNamespace(
+        settings={
+            'spynl.mongo.db': db,
+            'spynl.mail.connections': '1',
+            'mail.host': smtp_server.host,
+            'mail.port': str(smtp_server.port),
+        }
+    )
+    work(registry, burst=True)
+
+    assert len(smtp_server.messages) == 3
+    assert smtp_server.connections == 1
+    sender, recipients, data = smtp_server.messages[0]
+    assert sender == 'info@spynl.com'
+    assert recipients == ['customer@example.com']
+    assert b'Message-Id: <' in data
+    assert db[COLLECTION].count_documents({'status': SENT}) == 3
+
+
+def test_temporary_error_is_retried_later(db, pool, smtp_server):
+    enqueue(db, message())
+    smtp_server.replies = [451]
+    assert not deliver(db, pool, claim(db, 'worker')[0], delay=60)
+    queued = db[COLLECTION].find_one()
+    assert queued['status'] == QUEUED
+    assert queued['error'].startswith('(451')
+    assert queued['next_attempt'] > now() + timedelta(seconds=55)
+
+    db[COLLECTION].update_one({}, {'$set': {'next_attempt': now()}})
+    assert deliver(db, pool, claim(db, 'worker')[0])
+    assert db[COLLECTION].find_one()['status'] == SENT
+    # the connection was reused after the error
+    assert smtp_server.connections == 1
+
+
+def test_permanent_error_fails(db, pool, smtp_server):
+    enqueue(db, message())
+    smtp_server.replies = [554]
+    deliver(db, pool, claim(db, 'worker')[0])
+    assert db[COLLECTION].find_one()['status'] == FAILED
+
+
+def test_refused_recipients(db, pool, smtp_server):
+    smtp_server.refuse['gone@example.com'] = 550
+    enqueue(db, message(recipient='gone@example.com'))
+    msg = message()
+    msg.cc = ['gone@example.com']
+    enqueue(db, msg)
+    for claimed in claim(db, 'worker'):
+        deliver(db, pool, claimed)
+
+    failed = db[COLLECTION].find_one({'recipients': ['gone@example.com']})
+    assert failed['status'] == FAILED
+    sent = db[COLLECTION].find_one({'status': SENT})
+    assert sent['refused'] == [
+        {'recipient': 'gone@example.com', 'error': '550 refused'}
+    ]
+
+
+def test_pool_replaces_closed_connection(pool, smtp_server):
+    pool.sendmail('info@spynl.com', ['a@example.com'], b'Subject: 1\r\n\r\n1')
+    smtp_server.drop_connections()
+    pool.sendmail('info@spynl.com', ['a@example.com'], b'Subject: 2\r\n\r\n2')
+    assert len(smtp_server.messages) == 2
+    assert pool.connects == 2
+
+
+def test_retry_delay():
+    assert [retry_delay(attempt, 60) for attempt in (1, 2, 3)] == [60, 120, 240]
+    assert retry_delay(10, 60) == 3600
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+from weasyprint.urls import URLFetcher, URLFetcherResponse
+
+from spynl.services.pdf.images import (
+    CachingURLFetcher,
+    ImageCache,
+    ImageMissing,
+    image_urls,
+)
+
+IMAGES = {
+    'https://cdn.example.com/a.jpg': b'a' * 100,
+    'https://cdn.example.com/b.jpg': b'b' * 100,
+    'https://cdn.example.com/copy-of-a.jpg': b'a' * 100,
+}
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """Serve IMAGES instead of fetching urls, and record the urls fetched."""
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch(self, url, headers=None):
+        with lock:
+            fetched.append(url)
+        if url not in IMAGES:
+            raise HTTPError(url, 404, 'Not Found', {}, None)
+        return URLFetcherResponse(url, IMAGES[url], {'Content-Type': 'image/jpeg'})
+
+    monkeypatch.setattr(URLFetcher, 'fetch', fetch)
+    return fetched
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ImageCache(str(tmp_path), max_size=1000, ttl=60)
+
+
+def test_image_urls():
+    html = (
+        '<img class="thumbnail" src="https://cdn.example.com/a&amp;b.jpg">'
+        '<img\n src="data:image/png;base64,AAAA">'
+        '<IMG src="http://cdn.example.com/c.jpg"/>'
+    )
+    assert image_urls(html) == {
+        'https://cdn.example.com/a&b.jpg',
+        'http://cdn.example.com/c.jpg',
+    }
+
+
+def test_cache_is_content_addressed(cache, tmp_path):
+    cache.put('https://cdn.example.com/a.jpg', b'a' * 100, 'image/jpeg')
+    cache.put('https://cdn.example.com/copy-of-a.jpg', b'a' * 100, 'image/jpeg')
+    assert cache.get('https://cdn.example.com/copy-of-a.jpg') == (
+        b'a' * 100,
+        'image/jpeg',
+    )
+    assert len(list(cache._blobs())) == 1
+    assert cache.get('https://cdn.example.com/b.jpg') is None
+
+
+def test_cache_ttl(cache):
+    cache.put('https://cdn.example.com/a.jpg', b'a', 'image/jpeg')
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get('https://cdn.example.com/a.jpg') is None
+    assert 'https://cdn.example.com/a.jpg' not in cache
+
+
+def cache_url(i):
+    return 'https://cdn.example.com/{}.jpg'.format(i)
+
+
+def test_cache_evicts_least_recently_used(cache):
+    for i in range(9):
+        cache.put(cache_url(i), bytes([i]) * 100, 'x')
+        # make sure the modification times differ
+        os.utime(cache._blob_path(cache._entry(cache_url(i))['digest']), (i, i))
+    cache.get(cache_url(0))
+    cache.put(cache_url(9), b'9' * 200, 'x')
+
+    assert cache._size <= 900
+    assert cache.get(cache_url(0)) is not None
+    assert cache.get(cache_url(1)) is None
+    assert cache.get(cache_url(9)) is not None
+
+
+def test_fetcher_prefetches_once(cache, downloads):
+    fetcher = CachingURLFetcher(cache, threads=4)
+    fetcher.prefetch([*IMAGES, 'https://cdn.example.com/missing.jpg'])
+    assert sorted(downloads) == sorted([*IMAGES, 'https://cdn.example.com/missing.jpg'])
+
+    response = fetcher.fetch('https://cdn.example.com/b.jpg')
+    assert response.read() == b'b' * 100
+    assert response.content_type == 'image/jpeg'
+    with pytest.raises(ValueError):
+        fetcher.fetch('https://cdn.example.com/missing.jpg')
+    fetcher.prefetch(IMAGES)
+    assert len(downloads) == 4
+
+
+def test_fetcher_per_thread(cache, monkeypatch):
+    """the prefetch threads do not share a URLFetcher."""
+    threads = {}
+    lock = threading.Lock()
+
+    def fetch(self, url, headers=None):
+        with lock:
+            threads.setdefault(self, set()).add(threading.get_ident())
+        time.sleep(0.01)
+        return URLFetcherResponse(url, IMAGES[url], {'Content-Type': 'image/jpeg'})
+
+    monkeypatch.setattr(URLFetcher, 'fetch', fetch)
+    fetcher = CachingURLFetcher(cache, threads=3)
+    fetcher.prefetch(IMAGES)
+    assert fetcher not in threads
+    assert all(len(idents) == 1 for idents in threads.values())
+
+
+def test_fetcher_missing_image_is_cached(cache, downloads):
+    fetcher = CachingURLFetcher(cache)
+    with pytest.raises(HTTPError):
+        fetcher.fetch('https://cdn.example.com/missing.jpg')
+    with pytest.raises(ImageMissing):
+        cache.get('https://cdn.example.com/missing.jpg')
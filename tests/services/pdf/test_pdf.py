@@ -1,10 +1,12 @@
 """
 Tests the procedure of sending PDF files to email addresses.
 """
+import io
 import json
 import os
 import subprocess
 import sys
+import zipfile
 from copy import deepcopy
 from datetime import datetime
 
@@ -139,6 +141,29 @@ def test_download_sales_receipt(app):
     app.post_json('/sales/download', payload, status=200)
 
 
+def test_download_sales_receipts_batch(app):
+    payload = {'_ids': [str(SALE_ID)], 'footer': 'Bedankt en tot ziens.'}
+    response = app.post_json('/sales/download-batch', payload, status=200)
+    assert response.content_type == 'application/pdf'
+    assert response.body.startswith(b'%PDF')
+
+
+def test_download_sales_receipts_batch_zip(app):
+    payload = {'_ids': [str(SALE_ID), str(SALE_ID)], 'format': 'zip'}
+    response = app.post_json('/sales/download-batch', payload, status=200)
+    assert response.content_type == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(response.body)) as archive:
+        # the same sale is only included once
+        (name,) = archive.namelist()
+        assert archive.read(name).startswith(b'%PDF')
+
+
+def test_download_sales_receipts_batch_missing(app):
+    payload = {'_ids': [str(SALE_ID), str(ObjectId())]}
+    response = app.post_json('/sales/download-batch', payload, status=400)
+    assert response.json['type'] == 'SpynlException'
+
+
 def test_email_transit_pdf(app, inbox):
     """Check if the email transit pdf endpoint works as expected"""
     payload = {'recipients': ['bla@bla.com'], '_id': str(TRANSIT_ID)}
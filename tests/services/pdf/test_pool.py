@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+from spynl.services.pdf.pool import PdfPool, PdfRenderError, PdfRenderTimeout
+
+
+class FakeRenderer:
+    """Renders the html as is, so the pool can be tested without weasyprint."""
+
+    def warm_up(self):
+        pass
+
+    def render(self, html, css=()):
+        if html == 'slow':
+            time.sleep(30)
+        if html == 'error':
+            raise ValueError('cannot render')
+        return ''.join([html, *css]).encode()
+
+    def render_merged(self, documents):
+        return b'|'.join(self.render(html, css) for html, css in documents)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**kwargs):
+        pool = PdfPool(renderer_factory=FakeRenderer, **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def test_render_in_process(make_pool):
+    pool = make_pool()
+    assert pool.render('<p>', ('a',)) == b'<p>a'
+    assert pool.stats()['rendered'] == 0
+
+
+def test_render_in_worker(make_pool):
+    pool = make_pool(processes=2)
+    pool.warm_up()
+    assert pool.stats()['idle'] == 2
+    assert pool.render('<p>', ('a', 'b')) == b'<p>ab'
+    stats = pool.stats()
+    assert stats['rendered'] == 1
+    assert stats['idle'] == 2
+    assert stats['inUse'] == stats['waiting'] == 0
+
+
+def test_render_merged(make_pool):
+    pool = make_pool(processes=1)
+    assert pool.render_merged([('<p>', ['a']), ('<q>', ())]) == b'<p>a|<q>'
+
+
+def test_render_merged_max_timeout(make_pool):
+    pool = make_pool(processes=1, timeout=1, max_timeout=1)
+    pool.warm_up()
+    start = time.monotonic()
+    with pytest.raises(PdfRenderTimeout):
+        pool.render_merged([('<p>', ())] * 30 + [('slow', ())])
+    assert time.monotonic() - start < 10
+
+
+def test_render_error(make_pool):
+    pool = make_pool(processes=1)
+    with pytest.raises(PdfRenderError) as e:
+        pool.render('error')
+    assert 'cannot render' in e.value.developer_message
+    # the worker is still usable
+    assert pool.render('<p>') == b'<p>'
+    assert pool.stats()['failures'] == 1
+
+
+def test_render_timeout_replaces_worker(make_pool):
+    pool = make_pool(processes=1, timeout=1)
+    pool.warm_up()
+    worker = pool._idle[0]
+    with pytest.raises(PdfRenderTimeout):
+        pool.render('slow')
+    assert not worker.process.is_alive()
+    # a new worker was started, starting it is not part of the timeout
+    assert pool.stats()['idle'] == 1
+    assert pool.render('<p>') == b'<p>'
+    assert pool.stats()['timeouts'] == 1
@@ -8,6 +8,7 @@ from marshmallow import ValidationError, fields
 
 from spynl.api.auth.testutils import mkuser
 
+from spynl.services.jobs.queue import work
 from spynl.services.reports.article_status import (
     ARTICLE,
     COLUMNS,
@@ -509,6 +510,30 @@ def test_excel(app, setup_db):
     app.post_json('/reports/article-status-excel', PAYLOAD, status=200)
 
 
+@pytest.mark.parametrize('path', ['article-status', 'article-status-csv'])
+def test_streamed_report_is_the_same(app, setup_db, monkeypatch, path):
+    expected = app.post_json('/reports/' + path, PAYLOAD, status=200)
+    monkeypatch.setitem(
+        app.app.registry.settings, 'spynl.redshift.stream_reports', 'true'
+    )
+    monkeypatch.setitem(app.app.registry.settings, 'spynl.redshift.itersize', 1)
+    response = app.post_json('/reports/' + path, PAYLOAD, status=200)
+    assert response.content_type == expected.content_type
+    if path == 'article-status':
+        assert response.json == expected.json
+    else:
+        assert response.text == expected.text
+
+
+def test_streamed_report_no_data(app, setup_db, monkeypatch):
+    monkeypatch.setitem(
+        app.app.registry.settings, 'spynl.redshift.stream_reports', 'true'
+    )
+    payload = {**PAYLOAD, 'filter': {**PAYLOAD['filter'], 'articleCode': ['nope']}}
+    result = app.post_json('/reports/article-status', payload, status=200)
+    assert result.json == {'data': [], 'totals': [], 'status': 'ok'}
+
+
 @pytest.mark.parametrize(
     'format, content_type',
     [
@@ -534,6 +559,63 @@ def test_email(app, setup_db, inbox, format, content_type):
     assert 'Artikelstatus' in inbox[0].subject
 
 
+@pytest.fixture
+def enable_jobs(app, monkeypatch):
+    monkeypatch.setitem(app.app.registry.settings, 'spynl.jobs.enabled', 'true')
+
+
+def test_email_job(app, setup_db, inbox, enable_jobs):
+    payload = {**PAYLOAD, 'recipients': ['bla@bla.com'], 'format': 'csv'}
+    job_id = app.post_json('/reports/article-status-email', payload).json['jobId']
+    assert not inbox
+    response = app.get('/reports/job-status', {'jobId': job_id})
+    assert response.json['data']['status'] == 'queued'
+
+    work(app.app.registry, burst=True)
+    assert inbox[0].attachments[0].content_type == 'text/csv'
+    assert 'Artikelstatus' in inbox[0].subject
+    response = app.get('/reports/job-status', {'jobId': job_id})
+    assert response.json['data']['status'] == 'done'
+
+
+def test_email_job_validates_payload(app, setup_db, db, enable_jobs):
+    payload = {**PAYLOAD, 'recipients': ['not an email'], 'format': 'csv'}
+    app.post_json('/reports/article-status-email', payload, status=400)
+    assert db.jobs.count_documents({}) == 0
+
+
+def test_export_job(app, setup_db):
+    payload = {**PAYLOAD, 'format': 'csv'}
+    job_id = app.post_json('/reports/article-status-export', payload).json['jobId']
+    app.get('/reports/job-download', {'jobId': job_id}, status=400)
+
+    work(app.app.registry, burst=True)
+    response = app.get('/reports/job-download', {'jobId': job_id})
+    assert response.content_type == 'text/csv'
+    assert response.content_disposition.endswith('.csv"')
+    assert response.body
+
+
+def test_export_job_no_data(app, setup_db):
+    payload = {
+        **PAYLOAD,
+        'format': 'csv',
+        'filter': {**PAYLOAD['filter'], 'articleCode': ['nope']},
+    }
+    job_id = app.post_json('/reports/article-status-export', payload).json['jobId']
+    work(app.app.registry, burst=True)
+    response = app.get('/reports/job-status', {'jobId': job_id})
+    assert response.json['data']['status'] == 'failed'
+    assert response.json['data']['error']
+
+
+def test_job_of_other_user(app, setup_db, db):
+    payload = {**PAYLOAD, 'format': 'csv'}
+    job_id = app.post_json('/reports/article-status-export', payload).json['jobId']
+    db.jobs.update_one({}, {'$set': {'user_id': 'someone else'}})
+    app.get('/reports/job-status', {'jobId': job_id}, status=404)
+
+
 PAYLOAD = {
     'groups': ['brand', 'supplier', 'articleCode'],
     'fields': [
@@ -0,0 +1,127 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+from spynl.services.reports.cache import MemoryBackend, MongoBackend, ReportCache
+
+
+class FakeCursor:
+    def __init__(self, latest=1):
+        self.latest = latest
+        self.executed = []
+
+    def mogrify(self, query):
+        return query.encode()
+
+    def execute(self, query):
+        self.executed.append(query)
+
+    def fetchall(self):
+        if 'ORDER BY "timestamp" DESC' in str(self.executed[-1]):
+            return [{'timestamp': self.latest}]
+        return [{'a': len(self.executed)}]
+
+
+def execute(cursor, query):
+    cursor.execute(query)
+    return cursor.fetchall()
+
+
+@pytest.fixture
+def backend():
+    return MemoryBackend(maxsize=2, ttl=60)
+
+
+def test_report_cache_hit(backend):
+    cursor = FakeCursor()
+    rows = ReportCache(backend, '1').fetchall(cursor, 'query', execute)
+    rows[0]['a'] = 'changed'
+    assert ReportCache(backend, '1').fetchall(cursor, 'query', execute) == [{'a': 2}]
+    # 2 lookups of the latest transaction, 1 query
+    assert cursor.executed.count('query') == 1
+    assert backend.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_report_cache_key(backend):
+    cursor = FakeCursor()
+    cache = ReportCache(backend, '1')
+    assert cache.key(cursor, 'query') == cache.key(cursor, 'query')
+    assert cache.key(cursor, 'query') != cache.key(cursor, 'other query')
+    assert cache.key(cursor, 'query') != ReportCache(backend, '2').key(cursor, 'query')
+    assert cache.key(cursor, 'query') != ReportCache(backend, '1').key(
+        FakeCursor(latest=2), 'query'
+    )
+
+
+def test_report_cache_new_data(backend):
+    ReportCache(backend, '1').fetchall(FakeCursor(latest=1), 'query', execute)
+    cursor = FakeCursor(latest=2)
+    ReportCache(backend, '1').fetchall(cursor, 'query', execute)
+    assert 'query' in cursor.executed
+
+
+def test_report_cache_max_rows(backend):
+    ReportCache(backend, '1', max_rows=0).fetchall(FakeCursor(), 'query', execute)
+    assert backend.stats()['size'] == 0
+
+
+def test_memory_backend_lru(backend):
+    for key in 'abc':
+        backend.set(key, [])
+    assert backend.get('a') is None
+    assert backend.get('c') == []
+
+
+def test_memory_backend_ttl(backend):
+    backend.set('a', [])
+    backend.ttl = -1
+    assert backend.get('a') is None
+
+
+def test_mongo_backend(db):
+    backend = MongoBackend(db.report_cache, ttl=60)
+    rows = [{'a': 1.5, 'b': None}]
+    backend.set('key', rows)
+    assert backend.get('key') == rows
+    assert backend.get('other key') is None
+
+    backend.ttl = -1
+    backend.set('key', rows)
+    assert backend.get('key') is None
+
+
+def test_mongo_backend_types(db):
+    backend = MongoBackend(db.report_cache, ttl=60)
+    rows = [
+        {
+            'amount': Decimal('12.30'),
+            'day': date(2021, 1, 1),
+            'sold': datetime(2021, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc),
+            'created': datetime(2021, 1, 1, 12, 0),
+            'name': 'shirt',
+        },
+        {
+            'amount': Decimal('-1'),
+            'day': None,
+            'sold': datetime(2021, 1, 1, tzinfo=timezone(timedelta(hours=1))),
+            'created': None,
+            'name': None,
+        },
+    ]
+    backend.set('key', rows)
+    assert backend.get('key') == rows
+    assert [type(value) for value in backend.get('key')[0].values()] == [
+        Decimal,
+        date,
+        datetime,
+        datetime,
+        str,
+    ]
+    assert backend.get('key')[1]['sold'].utcoffset() == timedelta(hours=1)
+
+
+def test_mongo_backend_unsupported_type(db):
+    backend = MongoBackend(db.report_cache, ttl=60)
+    backend.set('key', [{'a': object()}])
+    assert backend.get('key') is None
@@ -0,0 +1,102 @@
+import pytest
+from pyramid.testing import DummyRequest
+
+from spynl.api.auth.testutils import mkuser
+
+from spynl.services.reports.pool import RedshiftPool, redshift_connection_health
+from spynl.services.reports.utils import RedshiftConnectionError
+
+
+@pytest.fixture
+def make_pool(settings):
+    pools = []
+
+    def make(**kwargs):
+        pool = RedshiftPool(settings['spynl.redshift.url'], **kwargs)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        if pool._pool is not None:
+            pool._pool.closeall()
+
+
+def test_acquire_timeout(make_pool):
+    pool = make_pool(maxconn=1, acquire_timeout=0.1)
+    conn = pool.getconn()
+    with pytest.raises(RedshiftConnectionError):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['inUse'] == 0
+
+
+def test_broken_connection_is_replaced(make_pool):
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    # as if the server closed the idle connection
+    conn.close()
+    new_conn = pool.getconn()
+    assert new_conn is not conn and not new_conn.closed
+    pool.putconn(new_conn)
+    assert pool.stats()['recycled'] == 1
+
+
+def test_old_connection_is_closed(make_pool):
+    pool = make_pool(maxconn=1, max_age=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert conn.closed
+
+
+def test_warm_up(make_pool):
+    pool = make_pool(minconn=1, maxconn=2)
+    pool.warm_up()
+    assert pool.stats()['idle'] == 1
+
+
+def test_bad_uri():
+    pool = RedshiftPool('no uri')
+    pool.warm_up()
+    with pytest.raises(RedshiftConnectionError):
+        pool.getconn()
+    assert pool.stats()['inUse'] == 0
+
+
+@pytest.fixture
+def developer(app, db):
+    db.tenants.insert_one({'_id': 'master', 'active': True, 'applications': []})
+    mkuser(
+        db, 'developer', 'bla', ['master'], tenant_roles={'master': ['sw-developer']}
+    )
+    app.post_json('/login', {'username': 'developer', 'password': 'bla'})
+    yield
+    app.get('/logout')
+    db.tenants.delete_one({'_id': 'master'})
+    db.users.delete_one({'username': 'developer'})
+
+
+def test_redshift_status(app, developer):
+    response = app.get('/about/redshift-status')
+    assert response.json['status'] == 'healthy'
+    assert response.json['pool']['inUse'] == 0
+    assert response.json['pool']['acquired'] >= 1
+
+
+def test_redshift_status_requires_permission(app):
+    app.get('/about/redshift-status', status=403)
+
+
+def test_redshift_status_does_not_connect(monkeypatch):
+    pool = RedshiftPool('no uri')
+    pool.warm_up()
+    monkeypatch.setattr(
+        RedshiftPool, 'getconn', lambda self: pytest.fail('took a connection')
+    )
+    request = DummyRequest(redshift_pool=pool)
+    response = redshift_connection_health(request)
+    assert response['status'] == 'error'
+    assert response['message'] == 'BadRedshiftURI'
+    assert request.response.status_int == 503
@@ -57,6 +57,13 @@ def test_group_by(postgres_cursor):
     ]
 
 
+def test_group_by_with_totals(postgres_cursor):
+    result = _build_group_by(['field1', 'field2'], with_totals=True)
+    assert result.as_string(postgres_cursor) == (
+        ' GROUP BY GROUPING SETS (("field1", "field2"), ())'
+    )
+
+
 def test_where_empty_values(postgres_cursor):
     result = _build_where({'y': '', 'x': {}, 'z': []}).as_string(postgres_cursor)
     assert result == ' WHERE "y" = \'\''
@@ -658,3 +665,42 @@ def test_build_without_inner(postgres_cursor):
     }
     assert matches['order'].strip() == '"tenantname" ASC'
     assert matches['limit'].strip() == '5000'
+
+
+def test_build_with_totals(postgres_cursor):
+    result = build(
+        set('max_turnover sellout_percentage supplier'.split()),
+        {'tenant': [1]},
+        [('supplier', 'ASC')],
+        1,
+        4,
+        with_totals=True,
+    ).as_string(postgres_cursor)
+
+    assert result.count('"totals_row"') == 3
+    assert 'GROUPING("supplier") as "totals_row"' in result
+    assert 'GROUP BY GROUPING SETS (("supplier"), ())' in result
+    assert result.endswith('ORDER BY "totals_row" DESC, "supplier" ASC')
+
+
+def test_build_with_totals_sales_only(postgres_cursor):
+    """Filtering on sales does not drop the totals row."""
+    result = build(
+        set('n_sold supplier'.split()),
+        {'tenant': [1]},
+        [('supplier', 'ASC')],
+        1,
+        4,
+        filter_sales=True,
+        with_totals=True,
+    ).as_string(postgres_cursor)
+    assert 'WHERE ("n_sold" != 0 OR "totals_row" = 1)' in result
+
+
+def test_build_with_totals_without_groups(postgres_cursor):
+    """Without groups the only row is the totals row."""
+    result = build(
+        {'max_turnover'}, {'tenant': [1]}, [], 1, 4, with_totals=True
+    ).as_string(postgres_cursor)
+    assert 'totals_row' not in result
+    assert 'GROUP BY' not in result
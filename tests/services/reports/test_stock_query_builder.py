@@ -6,6 +6,7 @@ from spynl.services.reports.stock import StockFilter
 from spynl.services.reports.stock_query_builder import (
     LABEL_SEPARATOR,
     _build_group_by,
+    _build_keyset,
     _build_select,
     _build_sort,
     build,
@@ -759,6 +760,45 @@ def test_build_history(postgres_cursor):
     assert query == expected
 
 
+def test_build_keyset(postgres_cursor):
+    keyset = _build_keyset(
+        [('brand', 'DESC'), ('article', 'ASC'), ('sizeidx', 'ASC')],
+        {'brand': None, 'article': 'a1', 'sizeidx': 3},
+    ).as_string(postgres_cursor)
+    assert keyset == (
+        '("brand" IS NOT NULL OR ("brand" IS NULL AND ("article" > \'a1\' OR '
+        '"article" IS NULL)) OR ("brand" IS NULL AND "article" = \'a1\' AND '
+        '("sizeidx" > 3 OR "sizeidx" IS NULL)))'
+    )
+
+
+def test_build_keyset_last_row():
+    # nothing comes after NULL when sorting ascending
+    keyset = _build_keyset([('brand', 'ASC')], {'brand': None})
+    assert keyset.as_string(None) == 'FALSE'
+
+
+def test_build_page(postgres_cursor):
+    query = build(
+        ['article', 'sizename', 'label', 'sizeidx', 'n_stock'],
+        {'tenant': 1},
+        [('article', 'ASC'), ('sizeidx', 'ASC'), ('label', 'ASC')],
+        0,
+        100,
+        page_size=2,
+        after={'article': 'a1', 'sizename': 'M', 'label': 'red', 'sizeidx': 1},
+    ).as_string(postgres_cursor)
+    assert (
+        'AND ("timestamp" >= 0 and "timestamp" <= 100) AND (("article" > \'a1\' OR '
+        '"article" IS NULL) OR ("article" = \'a1\' AND ("sizeidx" > 1 OR '
+        '"sizeidx" IS NULL)) OR ("article" = \'a1\' AND "sizeidx" = 1 AND '
+        '((COALESCE("color",\'\') ' in query
+    )
+    assert query.endswith(
+        'ORDER BY "article" ASC, "sizeidx" ASC, "label" ASC, "sizename" ASC LIMIT 2'
+    )
+
+
 def test_to_query(postgres_cursor):
     data = StockFilter(context={'tenant_id': '1'}).load({})
     query = StockFilter.to_query(data).as_string(postgres_cursor)
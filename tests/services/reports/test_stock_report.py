@@ -113,6 +113,22 @@ def test_stock_report(app, set_db):
     ]
 
 
+@pytest.mark.parametrize('page_size', [0, 1, 2])
+def test_stock_report_pages(app, set_db, monkeypatch, page_size):
+    query = {
+        'groups': ['articleGroup1', 'brand'],
+        'filter': {'endDate': '2021-01-01T00:00Z'},
+    }
+    expected = app.post_json('/reports/stock-report', query).json_body['data']
+    monkeypatch.setitem(
+        app.app.registry.settings, 'spynl.redshift.stock_page_size', page_size
+    )
+    response = app.post_json(
+        '/reports/stock-report', query, headers={'Cache-Control': 'no-cache'}
+    )
+    assert response.json_body['data'] == expected
+
+
 def test_stock_report_history(app, set_db):
     query = {
         'sort': [{'field': 'articleGroup1', 'direction': -1}],
@@ -1,6 +1,14 @@
+import openpyxl
 from marshmallow import Schema, fields
 
-from spynl.services.reports.utils import default_filter_values
+from spynl.services.reports.utils import (
+    TOTALS_COLUMN,
+    ClosingAppIter,
+    RowStream,
+    default_filter_values,
+    generate_excel_report,
+    split_totals,
+)
 
 
 def test_default_filter_values():
@@ -17,3 +25,141 @@ def test_default_filter_values():
         'b_column': [],
         'no_filter_values': None,
     }
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.fetched = 0
+        self.closed = False
+
+    def execute(self, query):
+        self.query = query
+
+    def fetchmany(self, size):
+        rows = [row for _, row in zip(range(size), self.rows)]
+        self.fetched += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self.rows:
+            self.fetched += 1
+            yield row
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, rows):
+        self.cursors = []
+        self.rows = rows
+
+    def cursor(self, name=None):
+        cursor = FakeCursor(self.rows)
+        cursor.name = name
+        self.cursors.append(cursor)
+        return cursor
+
+
+def test_row_stream_is_lazy():
+    connection = FakeConnection([{'a': i} for i in range(10)])
+    rows = RowStream(connection, 'query', itersize=3, transform=lambda r: r['a'])
+    cursor = connection.cursors[0]
+    assert cursor.name and cursor.itersize == 3
+    assert rows and rows.first == {'a': 0}
+    assert rows.totals is None
+    assert cursor.fetched == 3
+
+    iterator = iter(rows)
+    assert [next(iterator) for _ in range(4)] == [0, 1, 2, 3]
+    assert cursor.fetched == 4
+    assert list(iterator) == list(range(4, 10))
+
+    rows.close()
+    assert cursor.closed
+
+
+def test_row_stream_empty():
+    rows = RowStream(FakeConnection([]), 'query')
+    assert not rows
+    assert rows.first is None
+
+
+def test_row_stream_totals():
+    rows = [{'a': None, TOTALS_COLUMN: 1}] + [
+        {'a': i, TOTALS_COLUMN: 0} for i in range(3)
+    ]
+    rows = RowStream(FakeConnection(rows), 'query', itersize=1)
+    assert rows.totals == {'a': None}
+    assert rows.first == {'a': 0}
+    assert list(rows) == [{'a': 0}, {'a': 1}, {'a': 2}]
+
+
+def test_split_totals():
+    rows = [{'a': None, TOTALS_COLUMN: 1}, {'a': 1, TOTALS_COLUMN: 0}]
+    assert split_totals(rows) == {'a': None}
+    assert rows == [{'a': 1}]
+
+    rows = [{'a': 1}]
+    assert split_totals(rows) is None
+    assert rows == [{'a': 1}]
+
+    # the totals row was filtered out
+    rows = [{'a': 1, TOTALS_COLUMN: 0}]
+    assert split_totals(rows) == {}
+    assert rows == [{'a': 1}]
+
+
+def test_closing_app_iter():
+    closed = []
+    app_iter = ClosingAppIter([b'a', b'b'], on_close=[lambda: closed.append(1)])
+    app_iter.on_close.append(lambda: closed.append(2))
+    assert list(app_iter) == [b'a', b'b']
+    app_iter.close()
+    app_iter.close()
+    assert closed == [1, 2]
+
+
+def test_generate_excel_report():
+    parameters = {
+        'report_name': 'Report',
+        'groups': ['brand', 'collection'],
+        'fields_': ['qty'],
+        'columnMetadata': {'qty': {'label': 'Quantity', 'type': 'quantity'}},
+    }
+    data = [
+        {'brand': 'a', 'collection': 'x', 'qty': 1},
+        {'brand': 'b', 'collection': 'y', 'qty': 2},
+    ]
+    ws = openpyxl.load_workbook(
+        generate_excel_report(parameters, iter(data), {'qty': 3})
+    ).active
+
+    assert ws.title == 'Report'
+    assert [[cell.value for cell in row] for row in ws.rows] == [
+        ['brand', 'collection', 'Quantity'],
+        ['a', 'x', 1],
+        ['b', 'y', 2],
+        ['total', None, 3],
+    ]
+    assert [str(cells) for cells in ws.merged_cells] == ['A4:B4']
+    assert ws['C4'].font.bold and ws['C4'].number_format == '0'
+
+
+def test_generate_excel_report_without_groups():
+    parameters = {
+        'report_name': 'Report',
+        'groups': [],
+        'fields_': ['qty'],
+        'columnMetadata': {},
+    }
+    ws = openpyxl.load_workbook(
+        generate_excel_report(parameters, [{'qty': 1}], {'qty': 1})
+    ).active
+
+    assert [[cell.value for cell in row] for row in ws.rows] == [
+        [None, 'qty'],
+        [None, 1],
+        ['total', 1],
+    ]